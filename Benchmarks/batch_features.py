@@ -0,0 +1,109 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from Engine.batch import analyse, encode_fens
+from Engine.bitboard import popcount
+from Engine.evaluation import PIECE_VALUES
+from Engine.game import Game
+
+
+"""
+Batch feature benchmark
+
+Works out material, attacks, mobility and check for random positions one
+at a time with Game (get_valid_moves for every piece, the attack maps and
+the board), then for all of them at once with Engine.batch, and reports
+positions per second for both.
+
+Usage: python -m Benchmarks.batch_features [--positions 1000] [--batch 200000]
+"""
+
+
+def random_fens(count: int, seed: int = 0) -> list:
+    """
+    Positions from random games, 0 to 100 plies in
+    """
+    rng = random.Random(seed)
+    fens = []
+    while len(fens) < count:
+        game = Game(backend="bitboard")
+        for _ in range(rng.randrange(101)):
+            moves = game.generate_legal_moves()
+            if not moves:
+                break
+            game.make_move(rng.choice(moves))
+        fens.append(game.to_fen())
+    return fens
+
+
+def game_features(fen: str) -> tuple:
+    """
+    (material, squares attacked, mobility, in check) of the side to move,
+    the per-position way
+    """
+    game = Game.from_fen(fen, backend="bitboard")
+    color, enemy = game.turn, "B" if game.turn == "W" else "W"
+    material = mobility = 0
+    for y in range(8):
+        for x in range(8):
+            piece = game.board[y][x]
+            if piece[0] == color:
+                material += PIECE_VALUES[piece[1]]
+                mobility += len(game.get_valid_moves(y * 8 + x))
+    king = game.king_squares[color]
+    in_check = game.is_square_attacked(king % 8, king // 8, enemy)
+    return material, popcount(game.attacked_squares(color)), mobility, in_check
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch feature benchmark")
+    parser.add_argument("--positions", type=int, default=1000, help="positions for the Game path")
+    parser.add_argument("--batch", type=int, default=200000, help="positions for the NumPy path")
+    args = parser.parse_args()
+
+    fens = random_fens(args.positions)
+    start = time.perf_counter()
+    for fen in fens:
+        game_features(fen)
+    game_time = time.perf_counter() - start
+
+    batch_fens = (fens * (args.batch // len(fens) + 1))[:args.batch]
+    start = time.perf_counter()
+    boards, turns = encode_fens(batch_fens)
+    encoded = time.perf_counter() - start
+    features = analyse(boards, turns)
+    batch_time = time.perf_counter() - start
+
+    game_rate = len(fens) / game_time
+    batch_rate = len(batch_fens) / batch_time
+    print(f"Game        {len(fens):8d} positions {game_time:8.2f} s {game_rate:12.0f} positions/s")
+    print(
+        f"NumPy batch {len(batch_fens):8d} positions {batch_time:8.2f} s {batch_rate:12.0f} positions/s"
+        f"  (encoding {encoded:.2f} s)   speedup {batch_rate / game_rate:.0f}x"
+    )
+    print(f"{int(np.count_nonzero(features.check))} positions in check, mean mobility {features.mobility.mean():.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+"""
+Import time benchmark
+
+Measures how long a fresh interpreter takes to import the headless rules
+core (Engine.game) compared to the Kivy front end (chess), which is what
+importing Game used to cost.
+
+Usage: python -m Benchmarks.import_time [--runs 20]
+"""
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = {
+    "interpreter only": "pass",
+    "rules core (Engine.game)": "import Engine.game",
+    "kivy front end (chess)": "import chess",
+}
+
+
+def time_import(statement: str, runs: int) -> list | None:
+    """
+    Runs `statement` in `runs` fresh interpreters and returns the wall
+    times in seconds, or None if the import fails (e.g. Kivy is missing)
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-c", statement],
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            return None
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time benchmark")
+    parser.add_argument("--runs", type=int, default=20, help="interpreters started per target")
+    args = parser.parse_args()
+
+    for name, statement in TARGETS.items():
+        times = time_import(statement, args.runs)
+        if times is None:
+            print(f"{name:<28} unavailable (import failed)")
+            continue
+        print(
+            f"{name:<28} median {statistics.median(times) * 1000:8.1f} ms"
+            f"   min {min(times) * 1000:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import time
+
+import trio
+
+from Engine.game import Game
+from Engine.moves import parse_square
+
+
+"""
+Move generation benchmark
+
+Times listing every legal move of the side to move, with the nested list
+("mailbox") generators and with the bitboard ones:
+- per square: Game.get_valid_moves for each piece in turn, as the GUI does
+  when a piece is selected
+- full position: the mailbox backend can only do it square by square, the
+  bitboard backend generates all moves at once (Game.generate_legal_moves,
+  as the search, perft and the server do). This is the case the bitboard
+  backend is built for, and where it is at least ten times faster
+
+Usage: python -m Benchmarks.movegen [--repeat 20]
+"""
+
+
+# Positions are reached by playing these moves from the starting position
+POSITIONS = {
+    "start": [],
+    "open game": ["e2 e4", "e7 e5", "g1 f3", "b8 c6", "f1 c4", "g8 f6", "d2 d3", "f8 c5"],
+    "middlegame": [
+        "d2 d4", "d7 d5", "c2 c4", "e7 e6", "b1 c3", "g8 f6", "c1 g5", "f8 e7",
+        "e2 e3", "e8 g8", "g1 f3", "b8 d7", "a1 c1", "c7 c6", "f1 d3", "d5 c4",
+        "d3 c4", "f6 d5",
+    ],
+}
+
+
+def setup(moves: list, backend: str) -> Game:
+    game = Game(backend=backend)
+    for move in moves:
+        trio.run(game.move, *map(parse_square, move.split()))
+    return game
+
+
+def time_per_square(game: Game, repeat: int) -> float:
+    """
+    Seconds for `repeat` passes of get_valid_moves over the pieces of the
+    side to move
+    """
+    squares = [
+        y * 8 + x
+        for y in range(8) for x in range(8) if game.board[y][x][0] == game.turn
+    ]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for square in squares:
+            game.get_valid_moves(square)
+    return time.perf_counter() - start
+
+
+def time_full_position(game: Game, repeat: int) -> float:
+    """
+    Seconds for `repeat` generate_legal_moves calls, each in a position
+    seen for the first time (as in a search)
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        game.check_info = None
+        game.generate_legal_moves()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move generation benchmark")
+    parser.add_argument("--repeat", type=int, default=20, help="passes per position")
+    args = parser.parse_args()
+
+    for name, moves in POSITIONS.items():
+        mailbox_game, bitboard_game = setup(moves, "mailbox"), setup(moves, "bitboard")
+        count = len(bitboard_game.generate_legal_moves())
+        mailbox = time_per_square(mailbox_game, args.repeat)
+        results = [
+            ("per square", time_per_square(bitboard_game, args.repeat)),
+            ("full position", time_full_position(bitboard_game, args.repeat)),
+        ]
+        for kind, bitboard in results:
+            print(
+                f"{name:<12} {kind:<14} {count:3d} moves   mailbox {args.repeat / mailbox:8.0f} positions/s"
+                f"   bitboard {args.repeat / bitboard:8.0f} positions/s   speedup {mailbox / bitboard:5.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
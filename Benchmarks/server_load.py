@@ -0,0 +1,137 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import json
+import random
+import time
+
+import trio
+
+from Engine.server import GameServer
+
+
+"""
+Game server load test
+
+Starts an Engine.server in this process (or uses a running one with
+--port) and plays random games on many connections at once. Every
+connection asks for the legal moves and plays one of them until its games
+are over. Reports moves per second and request latency percentiles.
+
+Usage: python -m Benchmarks.server_load [--connections 100] [--games 2] [--port PORT]
+"""
+
+
+class Connection:
+    """
+    A client connection sending one request at a time
+    """
+
+    def __init__(self, stream: trio.SocketStream):
+        self.stream = stream
+        self.buffer = b""
+        self.next_id = 0
+        self.latencies = []
+
+    async def request(self, **request) -> dict:
+        self.next_id += 1
+        request["id"] = self.next_id
+        start = time.perf_counter()
+        await self.stream.send_all(json.dumps(request).encode() + b"\n")
+        while b"\n" not in self.buffer:
+            data = await self.stream.receive_some(65536)
+            if not data:
+                raise ConnectionError("The server closed the connection")
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        self.latencies.append(time.perf_counter() - start)
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+
+async def play(port: int, games: int, max_plies: int, seed: int, connections: list) -> int:
+    """
+    Plays random games on one connection, returns the number of moves made
+    """
+    rng = random.Random(seed)
+    connection = Connection(await trio.open_tcp_stream("127.0.0.1", port))
+    connections.append(connection)
+    moves_made = 0
+    async with connection.stream:
+        for _ in range(games):
+            game = (await connection.request(op="new"))["game"]
+            for _ in range(max_plies):
+                moves = (await connection.request(op="moves", game=game))["moves"]
+                response = await connection.request(op="move", game=game, move=rng.choice(moves))
+                moves_made += 1
+                if response["status"] != "ongoing":
+                    break
+            await connection.request(op="close", game=game)
+    return moves_made
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def run(args) -> None:
+    async with trio.open_nursery() as nursery:
+        port = args.port
+        if port is None:
+            listeners = await nursery.start(GameServer(max_games=args.connections * 2).serve, 0)
+            port = listeners[0].socket.getsockname()[1]
+
+        connections, totals = [], []
+
+        async def client(seed):
+            totals.append(await play(port, args.games, args.max_plies, seed, connections))
+
+        start = time.perf_counter()
+        async with trio.open_nursery() as clients:
+            for seed in range(args.connections):
+                clients.start_soon(client, seed)
+        elapsed = time.perf_counter() - start
+        nursery.cancel_scope.cancel()
+
+    latencies = [latency for connection in connections for latency in connection.latencies]
+    moves = sum(totals)
+    print(
+        f"{args.connections} connections, {moves} moves, {len(latencies)} requests in {elapsed:.2f} s\n"
+        f"{moves / elapsed:.0f} moves/s, {len(latencies) / elapsed:.0f} requests/s\n"
+        f"latency p50 {percentile(latencies, 0.5) * 1000:.2f} ms"
+        f"  p99 {percentile(latencies, 0.99) * 1000:.2f} ms"
+        f"  max {max(latencies) * 1000:.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Game server load test")
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--games", type=int, default=2, help="games per connection")
+    parser.add_argument("--max-plies", type=int, default=200)
+    parser.add_argument("--port", type=int, help="use a server already running on this port")
+    args = parser.parse_args()
+    trio.run(run, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import os
+
+from Engine.game import Game
+from Engine.smp import ParallelSearcher
+
+
+"""
+Parallel search benchmark
+
+Times how long the search takes to finish a fixed depth with 1, 2, 4, 8
+and 16 processes (lazy SMP, see Engine.smp), starting from an empty
+transposition table each time. Speedups need as many free cores as
+processes.
+
+Usage: python -m Benchmarks.smp_scaling [--depth 5] [--workers 1 2 4 8 16]
+"""
+
+
+POSITIONS = {
+    "start": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "middlegame": "r2q1rk1/pp2bppp/2n1pn2/3p4/3P4/2NBPN2/PP3PPP/R2Q1RK1 w - - 0 10",
+    "kiwipete": "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+}
+
+
+def time_to_depth(fen: str, depth: int, workers: int) -> tuple:
+    """
+    Returns (seconds, nodes) for a search of `fen` to `depth`
+    """
+    with ParallelSearcher(workers, tt_entries=1 << 18) as searcher:
+        result = searcher.search(Game.from_fen(fen, backend="bitboard"), depth)
+    return result.elapsed, result.nodes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel search benchmark")
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16],
+        help="process counts to time; speedups are relative to the first"
+    )
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, depth {args.depth}")
+
+    for name, fen in POSITIONS.items():
+        base = None
+        for workers in args.workers:
+            elapsed, nodes = time_to_depth(fen, args.depth, workers)
+            base = base or elapsed
+            print(
+                f"{name:<12} {workers:3d} workers {elapsed:8.2f} s {nodes:10d} nodes"
+                f"   speedup {base / elapsed:5.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
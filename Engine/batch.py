@@ -0,0 +1,263 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from Engine.bitboard import (
+    BISHOP_DIRECTIONS, KING_ATTACKS, KNIGHT_ATTACKS, PAWN_ATTACKS, PIECE_NAMES, PIECE_TYPES,
+    ROOK_DIRECTIONS, iter_squares
+)
+from Engine.evaluation import PIECE_VALUES
+from Engine.game import Game
+
+
+"""
+Batch position analysis with NumPy
+
+Positions are rows of an N x 64 int8 array, indexed like the board
+(square = y * 8 + x, a8 = 0): 0 is empty, 1-6 a white pawn, knight,
+bishop, rook, queen or king and -1 to -6 the black pieces. analyse works
+out the features of every row at once with array operations, so millions
+of positions take seconds instead of hours with Game.
+
+Colors are indexed 0 for white and 1 for black in every result.
+"""
+
+EMPTY = 0
+CODES = {name: (PIECE_TYPES.index(name[1]) + 1) * (1 if name[0] == "W" else -1) for name in PIECE_NAMES}
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(1, 7)
+VALUES = np.array([PIECE_VALUES[kind] for kind in PIECE_TYPES], dtype=np.int32)
+CHUNK = 1 << 16  # rows analysed at a time, which bounds the memory used
+
+# Byte -> piece code for the characters of a FEN placement ("." is empty)
+_FEN_CODES = np.zeros(256, dtype=np.int8)
+for _kind, _code in zip("pnbrqk", range(1, 7)):
+    _FEN_CODES[ord(_kind.upper())], _FEN_CODES[ord(_kind)] = _code, -_code
+
+
+def _expand(placement: bytes) -> bytes:
+    """
+    A FEN placement (or many joined together) with one byte per square
+    """
+    placement = placement.replace(b"/", b"")
+    for n in range(8, 0, -1):
+        placement = placement.replace(str(n).encode(), b"." * n)
+    return placement
+
+
+def _attack_matrix(table) -> np.ndarray:
+    """
+    matrix[from, to] = 1 if a piece on `from` attacks `to`
+    """
+    matrix = np.zeros((64, 64), dtype=np.float32)
+    for sq in range(64):
+        matrix[sq, list(iter_squares(table[sq]))] = 1
+    return matrix
+
+
+def _previous_squares(dx: int, dy: int) -> np.ndarray:
+    """
+    For every square, the square one step back along (dx, dy), or 64 if
+    that is off the board
+    """
+    previous = np.full(64, 64, dtype=np.intp)
+    for sq in range(64):
+        x, y = sq % 8 - dx, sq // 8 - dy
+        if 0 <= x < 8 and 0 <= y < 8:
+            previous[sq] = y * 8 + x
+    return previous
+
+
+KNIGHT_MATRIX = _attack_matrix(KNIGHT_ATTACKS)
+KING_MATRIX = _attack_matrix(KING_ATTACKS)
+PAWN_MATRICES = (_attack_matrix(PAWN_ATTACKS["W"]), _attack_matrix(PAWN_ATTACKS["B"]))
+ROOK_PREVIOUS = [_previous_squares(dx, dy) for dx, dy in ROOK_DIRECTIONS]
+BISHOP_PREVIOUS = [_previous_squares(dx, dy) for dx, dy in BISHOP_DIRECTIONS]
+
+
+class Features:
+    """
+    The features of a batch of N positions:
+
+    piece_counts   N x 2 x 6  pieces of each color and kind (P, N, B, R, Q, K)
+    material       N x 2      material in centipawns (Engine.evaluation.PIECE_VALUES)
+    attack_maps    N x 2 x 64 number of pieces of each color attacking each square
+    attacks        N x 2      attacks in total (sum of attack_maps)
+    attacked       N x 2      squares attacked at least once
+    mobility       N x 2      pseudo-legal moves: pins and checks are ignored,
+                              castling and en passant are not counted
+    in_check       N x 2      whether each color's king is attacked
+    check          N          whether the side to move is in check (if the
+                              turns were given, else None)
+    """
+
+    NAMES = (
+        "material_w", "material_b", "attacks_w", "attacks_b", "attacked_w", "attacked_b",
+        "mobility_w", "mobility_b", "in_check_w", "in_check_b"
+    )
+
+    def __init__(self, piece_counts, material, attack_maps, mobility, in_check, check):
+        self.piece_counts = piece_counts
+        self.material = material
+        self.attack_maps = attack_maps
+        self.attacks = attack_maps.sum(axis=2, dtype=np.int32)
+        self.attacked = np.count_nonzero(attack_maps, axis=2)
+        self.mobility = mobility
+        self.in_check = in_check
+        self.check = check
+
+    def __len__(self) -> int:
+        return len(self.material)
+
+    def matrix(self) -> np.ndarray:
+        """
+        The scalar features as an N x 10 float32 array, columns as in NAMES
+        """
+        return np.concatenate(
+            (self.material, self.attacks, self.attacked, self.mobility, self.in_check), axis=1
+        ).astype(np.float32)
+
+
+def encode_fens(fens: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (boards, turns) for FEN strings: the N x 64 int8 boards and
+    an N bool array, True where white is to move
+    """
+    fields = [fen.split(None, 2) for fen in fens]
+    placements = _expand("".join(field[0] for field in fields).encode("ascii"))
+    if len(placements) != 64 * len(fields) or any(len(field) < 2 for field in fields):
+        for field in fields:
+            if len(field) < 2 or len(_expand(field[0].encode("ascii"))) != 64:
+                raise ValueError(f"Invalid FEN: {' '.join(field)!r}")
+    boards = _FEN_CODES[np.frombuffer(placements, dtype=np.uint8)]
+    return boards.reshape(len(fields), 64), np.array([field[1] == "w" for field in fields], dtype=bool)
+
+
+def encode_bitboards(bitboards: np.ndarray) -> np.ndarray:
+    """
+    N x 64 boards from an N x 12 uint64 array of piece bitboards, in the
+    order of Engine.bitboard.PIECE_NAMES
+    """
+    bitboards = np.ascontiguousarray(bitboards, dtype="<u8")
+    bits = np.unpackbits(bitboards.view(np.uint8).reshape(-1, 12, 8), axis=2, bitorder="little")
+    codes = np.array([CODES[name] for name in PIECE_NAMES], dtype=np.int8)
+    return np.einsum("nps,p->ns", bits.view(np.int8), codes)
+
+
+def encode_games(games: Iterable[Game]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (boards, turns) for Game positions, see encode_fens
+    """
+    bitboards, turns = [], []
+    for game in games:
+        pieces = game.bitboards.pieces
+        bitboards.append([pieces[name] for name in PIECE_NAMES])
+        turns.append(game.turn == "W")
+    bitboards = np.array(bitboards, dtype=np.uint64).reshape(-1, 12)
+    return encode_bitboards(bitboards), np.array(turns, dtype=bool)
+
+
+def _slider_attacks(sliders: np.ndarray, empty: np.ndarray, directions) -> np.ndarray:
+    """
+    Number of sliders attacking each square along the given directions,
+    for 64 x N (square major) arrays. A ray is carried one square further
+    per step while the squares it passes are empty, so 6 steps cover the
+    longest ray
+    """
+    count = sliders.shape[1]
+    attacks = np.zeros((64, count), dtype=np.int16)
+    carry = np.zeros((65, count), dtype=np.int8)  # row 64 stands for off the board
+    for previous in directions:
+        carry[:64] = sliders
+        for _ in range(6):
+            carry[:64] = sliders + empty * carry[previous]
+        attacks += carry[previous]
+    return attacks
+
+
+def _analyse_chunk(boards: np.ndarray, turns: Optional[np.ndarray]) -> Features:
+    # Square major, so that moving along a ray copies whole rows
+    boards = np.ascontiguousarray(boards.T)
+    count = boards.shape[1]
+    empty = (boards == EMPTY).astype(np.int8)
+    piece_counts = np.zeros((count, 2, 6), dtype=np.int16)
+    attack_maps = np.zeros((2, 64, count), dtype=np.int16)
+    mobility = np.zeros((count, 2), dtype=np.int32)
+
+    for color, sign in ((0, 1), (1, -1)):
+        kinds = [boards == sign * kind for kind in range(1, 7)]
+        for i, squares in enumerate(kinds):
+            piece_counts[:, color, i] = np.count_nonzero(squares, axis=0)
+        pawns, knights, _, _, _, kings = (squares.astype(np.float32) for squares in kinds)
+
+        pawn_attacks = (PAWN_MATRICES[color].T @ pawns).astype(np.int16)
+        pieces = (KNIGHT_MATRIX.T @ knights + KING_MATRIX.T @ kings).astype(np.int16)
+        pieces += _slider_attacks((kinds[ROOK - 1] | kinds[QUEEN - 1]).view(np.int8), empty, ROOK_PREVIOUS)
+        pieces += _slider_attacks((kinds[BISHOP - 1] | kinds[QUEEN - 1]).view(np.int8), empty, BISHOP_PREVIOUS)
+        attack_maps[color] = pieces + pawn_attacks
+
+        own = boards * sign > 0
+        enemy = boards * sign < 0
+        pawn_squares = kinds[PAWN - 1]
+        if color == 0:  # white pawns move towards y = 0
+            single = pawn_squares[8:] & (empty[:-8] == 1)
+            double = single[40:48] & (empty[32:40] == 1)
+        else:
+            single = pawn_squares[:-8] & (empty[8:] == 1)
+            double = single[8:16] & (empty[24:32] == 1)
+        mobility[:, color] = (
+            (pieces * ~own).sum(axis=0, dtype=np.int32)
+            + (pawn_attacks * enemy).sum(axis=0, dtype=np.int32)
+            + np.count_nonzero(single, axis=0)
+            + np.count_nonzero(double, axis=0)
+        )
+
+    kings = np.stack((boards == KING, boards == -KING))
+    # A king is in check if the other color attacks its square
+    in_check = (attack_maps[::-1] * kings).any(axis=1).T
+    material = (piece_counts * VALUES).sum(axis=2, dtype=np.int32)
+    check = None if turns is None else np.where(turns, in_check[:, 0], in_check[:, 1])
+    return Features(piece_counts, material, attack_maps.transpose(2, 0, 1), mobility, in_check, check)
+
+
+def analyse(boards: np.ndarray, turns: Optional[np.ndarray] = None) -> Features:
+    """
+    Works out the Features of N positions given as N x 64 int8 boards.
+    turns (N bools, True where white is to move) is only needed for
+    Features.check
+    """
+    boards = np.asarray(boards, dtype=np.int8)
+    if boards.ndim != 2 or boards.shape[1] != 64:
+        raise ValueError(f"Expected an N x 64 array of boards, got shape {boards.shape}")
+    if turns is not None:
+        turns = np.asarray(turns, dtype=bool)
+        if turns.shape != (len(boards),):
+            raise ValueError(f"Expected {len(boards)} turns, got shape {turns.shape}")
+    if len(boards) <= CHUNK:
+        return _analyse_chunk(boards, turns)
+
+    chunks = [
+        _analyse_chunk(boards[start:start + CHUNK], None if turns is None else turns[start:start + CHUNK])
+        for start in range(0, len(boards), CHUNK)
+    ]
+    return Features(*(
+        None if getattr(chunks[0], name) is None else np.concatenate([getattr(chunk, name) for chunk in chunks])
+        for name in ("piece_counts", "material", "attack_maps", "mobility", "in_check", "check")
+    ))
@@ -0,0 +1,289 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from typing import Dict, Iterator, List, Literal
+
+
+"""
+Bitboard board representation
+
+Squares are numbered the same way as the nested list board so the two can
+be converted cheaply: square = y * 8 + x, where y = 0 is the 8th rank
+(black's back rank) and x = 0 is the a file. So a8 = 0, h8 = 7 and h1 = 63.
+Bit n of a bitboard is set if square n is occupied.
+"""
+
+FULL = (1 << 64) - 1
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+LIGHT_SQUARES = 0xAA55AA55AA55AA55  # a8, c8, ... b7, d7, ...
+BACK_RANKS = 0xFF | 0xFF << 56  # ranks 8 and 1
+PIECE_TYPES = ("P", "N", "B", "R", "Q", "K")
+PIECE_NAMES = tuple(f"{color}{piece}" for color in "WB" for piece in PIECE_TYPES)
+
+# (dx, dy) steps. Rook directions first, then bishop directions
+ROOK_DIRECTIONS = ((0, -1), (0, 1), (-1, 0), (1, 0))
+BISHOP_DIRECTIONS = ((-1, -1), (1, -1), (-1, 1), (1, 1))
+
+
+def square_bb(x: int, y: int) -> int:
+    return 1 << (y * 8 + x)
+
+
+def iter_squares(bb: int) -> Iterator[int]:
+    """
+    Yields the index of every set bit, lowest first
+    """
+    while bb:
+        lsb = bb & -bb
+        yield lsb.bit_length() - 1
+        bb ^= lsb
+
+
+def popcount(bb: int) -> int:
+    return bb.bit_count()
+
+
+def _step_table(steps) -> List[int]:
+    table = []
+    for sq in range(64):
+        x, y = sq % 8, sq // 8
+        bb = 0
+        for dx, dy in steps:
+            if 0 <= x + dx < 8 and 0 <= y + dy < 8:
+                bb |= square_bb(x + dx, y + dy)
+        table.append(bb)
+    return table
+
+
+def _ray_table(dx: int, dy: int) -> List[int]:
+    table = []
+    for sq in range(64):
+        x, y = sq % 8 + dx, sq // 8 + dy
+        bb = 0
+        while 0 <= x < 8 and 0 <= y < 8:
+            bb |= square_bb(x, y)
+            x, y = x + dx, y + dy
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _step_table(
+    [(dx, dy) for dx in (-2, -1, 1, 2) for dy in (-2, -1, 1, 2) if abs(dx) != abs(dy)])
+KING_ATTACKS = _step_table(
+    [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy])
+# Squares attacked BY a pawn of the given color standing on the square
+PAWN_ATTACKS: Dict[str, List[int]] = {
+    "W": _step_table([(-1, -1), (1, -1)]),
+    "B": _step_table([(-1, 1), (1, 1)]),
+}
+
+# RAYS[direction][square]: every square from `square` (exclusive) to the edge.
+# A direction is "positive" when squares along it have increasing indices,
+# so the nearest blocker is the lowest set bit, otherwise it is the highest.
+ROOK_RAYS = [(_ray_table(dx, dy), dy > 0 or (dy == 0 and dx > 0)) for dx, dy in ROOK_DIRECTIONS]
+BISHOP_RAYS = [(_ray_table(dx, dy), dy > 0) for dx, dy in BISHOP_DIRECTIONS]
+
+
+def _between_table() -> List[List[int]]:
+    table = [[0] * 64 for _ in range(64)]
+    for rays, _ in ROOK_RAYS + BISHOP_RAYS:
+        for sq in range(64):
+            for target in iter_squares(rays[sq]):
+                table[sq][target] = rays[sq] & ~rays[target] & ~(1 << target)
+    return table
+
+
+# BETWEEN[a][b]: squares strictly between a and b if they share a rank,
+# file or diagonal, otherwise 0
+BETWEEN = _between_table()
+
+
+def _slider_attacks(rays, sq: int, occupied: int) -> int:
+    attacks = 0
+    for table, positive in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            if positive:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= table[first]
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(sq: int, occupied: int) -> int:
+    return _slider_attacks(ROOK_RAYS, sq, occupied)
+
+
+def bishop_attacks(sq: int, occupied: int) -> int:
+    return _slider_attacks(BISHOP_RAYS, sq, occupied)
+
+
+def queen_attacks(sq: int, occupied: int) -> int:
+    return _slider_attacks(ROOK_RAYS, sq, occupied) | _slider_attacks(BISHOP_RAYS, sq, occupied)
+
+
+class Bitboards:
+    """
+    One 64-bit bitboard per piece type and color plus per-color occupancy.
+    pieces is keyed by the same names used on the nested list board ("WP", "BK", ...)
+    """
+
+    def __init__(self):
+        self.pieces: Dict[str, int] = {name: 0 for name in PIECE_NAMES}
+        self.colors: Dict[str, int] = {"W": 0, "B": 0}
+
+    @classmethod
+    def from_board(cls, board: List[list]) -> "Bitboards":
+        bitboards = cls()
+        for y, row in enumerate(board):
+            for x, piece in enumerate(row):
+                if piece != "  ":
+                    bitboards.put(piece, y * 8 + x)
+        return bitboards
+
+    @property
+    def occupied(self) -> int:
+        return self.colors["W"] | self.colors["B"]
+
+    def put(self, piece: str, sq: int) -> None:
+        bb = 1 << sq
+        self.pieces[piece] |= bb
+        self.colors[piece[0]] |= bb
+
+    def remove(self, piece: str, sq: int) -> None:
+        bb = ~(1 << sq)
+        self.pieces[piece] &= bb
+        self.colors[piece[0]] &= bb
+
+    def king_square(self, color: Literal["W", "B"]) -> int:
+        return self.pieces[f"{color}K"].bit_length() - 1
+
+    def attacks_from(self, piece: str, sq: int, occupied: int) -> int:
+        """
+        Squares attacked by `piece` standing on `sq` (own pieces included)
+        """
+        kind = piece[1]
+        if kind == "P":
+            return PAWN_ATTACKS[piece[0]][sq]
+        if kind == "N":
+            return KNIGHT_ATTACKS[sq]
+        if kind == "B":
+            return bishop_attacks(sq, occupied)
+        if kind == "R":
+            return rook_attacks(sq, occupied)
+        if kind == "Q":
+            return queen_attacks(sq, occupied)
+        return KING_ATTACKS[sq]
+
+    def is_attacked(
+            self,
+            sq: int,
+            by: Literal["W", "B"],
+            occupied: int | None = None,
+            ignore: int = 0
+        ) -> bool:
+        """
+        Checks if `sq` is attacked by any piece of color `by`.
+
+        occupied: occupancy to use for sliding pieces (defaults to the board)
+        ignore: bitboard of attacking pieces to skip (e.g. a piece that has
+        just been captured in a hypothetical move)
+        """
+        if occupied is None:
+            occupied = self.occupied
+        pieces = self.pieces
+        keep = ~ignore
+        enemy = "B" if by == "W" else "W"
+        if PAWN_ATTACKS[enemy][sq] & pieces[f"{by}P"] & keep:
+            return True
+        if KNIGHT_ATTACKS[sq] & pieces[f"{by}N"] & keep:
+            return True
+        if KING_ATTACKS[sq] & pieces[f"{by}K"]:
+            return True
+        queens = pieces[f"{by}Q"]
+        rooks = (pieces[f"{by}R"] | queens) & keep
+        if rooks and rook_attacks(sq, occupied) & rooks:
+            return True
+        bishops = (pieces[f"{by}B"] | queens) & keep
+        if bishops and bishop_attacks(sq, occupied) & bishops:
+            return True
+        return False
+
+    def attack_map(self, color: Literal["W", "B"]) -> int:
+        """
+        Bitboard of every square attacked by at least one piece of `color`
+        """
+        pieces = self.pieces
+        occupied = self.occupied
+        pawns = pieces[f"{color}P"]
+        if color == "W":
+            attacked = ((pawns & ~FILE_A) >> 9) | ((pawns & ~FILE_H) >> 7)
+        else:
+            attacked = (((pawns & ~FILE_A) << 7) | ((pawns & ~FILE_H) << 9)) & FULL
+        for sq in iter_squares(pieces[f"{color}N"]):
+            attacked |= KNIGHT_ATTACKS[sq]
+        queens = pieces[f"{color}Q"]
+        for sq in iter_squares(pieces[f"{color}B"] | queens):
+            attacked |= bishop_attacks(sq, occupied)
+        for sq in iter_squares(pieces[f"{color}R"] | queens):
+            attacked |= rook_attacks(sq, occupied)
+        return attacked | KING_ATTACKS[self.king_square(color)]
+
+    def attackers(self, sq: int, by: Literal["W", "B"], occupied: int) -> int:
+        """
+        Bitboard of all pieces of color `by` attacking `sq`
+        """
+        pieces = self.pieces
+        enemy = "B" if by == "W" else "W"
+        queens = pieces[f"{by}Q"]
+        return (
+            (PAWN_ATTACKS[enemy][sq] & pieces[f"{by}P"])
+            | (KNIGHT_ATTACKS[sq] & pieces[f"{by}N"])
+            | (KING_ATTACKS[sq] & pieces[f"{by}K"])
+            | (rook_attacks(sq, occupied) & (pieces[f"{by}R"] | queens))
+            | (bishop_attacks(sq, occupied) & (pieces[f"{by}B"] | queens))
+        )
+
+    def pinned(self, color: Literal["W", "B"]) -> Dict[int, int]:
+        """
+        Finds the pieces of `color` pinned to their king.
+        Returns {pinned square: squares it may still move to}, which is the
+        line between the king and the pinning piece, including the pinner
+        """
+        pieces = self.pieces
+        enemy = "B" if color == "W" else "W"
+        king = self.king_square(color)
+        own = self.colors[color]
+        enemy_occupied = self.colors[enemy]
+        queens = pieces[f"{enemy}Q"]
+        # Enemy sliders that would attack the king if our pieces were not there
+        snipers = (
+            (rook_attacks(king, enemy_occupied) & (pieces[f"{enemy}R"] | queens))
+            | (bishop_attacks(king, enemy_occupied) & (pieces[f"{enemy}B"] | queens))
+        )
+        pinned = {}
+        for sniper in iter_squares(snipers):
+            between = BETWEEN[king][sniper]
+            blockers = between & own
+            if blockers and not blockers & (blockers - 1):  # exactly one of ours
+                pinned[blockers.bit_length() - 1] = between | (1 << sniper)
+        return pinned
@@ -0,0 +1,98 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from collections import OrderedDict
+import sys
+from typing import Hashable, Optional
+
+
+"""
+Move cache
+
+Legal move lists kept by position hash, so positions that come up again
+(transpositions, repeated GUI queries of the same piece, games replayed
+from the same opening) skip move generation. Bounded by entry count and,
+optionally, by an estimate of the memory the lists use.
+"""
+
+
+class MoveCache:
+    """
+    A least recently used cache of legal move lists, keyed by
+    (position hash, origin square). Game uses it when passed as
+    Game(move_cache=MoveCache(...)).
+
+    max_entries: most lists kept
+    max_bytes: rough limit on the memory used by the cached lists (optional)
+    When either limit is passed, the least recently used lists are dropped.
+    """
+
+    def __init__(self, max_entries: int = 4096, max_bytes: Optional[int] = None):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key: (moves, size in bytes)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable) -> Optional[list]:
+        """
+        Returns a copy of the cached moves, or None on a miss
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return list(entry[0])
+
+    def put(self, key: Hashable, moves: list) -> None:
+        moves = tuple(moves)  # stored immutable, callers get copies
+        size = sys.getsizeof(moves) + sum(sys.getsizeof(move) for move in moves)
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        self.entries[key] = (moves, size)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or (
+                self.max_bytes is not None and self.bytes > self.max_bytes and len(self.entries) > 1):
+            _, (_, dropped) = self.entries.popitem(last=False)
+            self.bytes -= dropped
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
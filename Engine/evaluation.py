@@ -0,0 +1,359 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from Engine.bitboard import FILE_A, PIECE_NAMES, iter_squares, popcount
+
+if TYPE_CHECKING:
+    from Engine.game import Game  # Engine.game imports this module
+
+
+"""
+Static evaluation
+
+Material and piece-square tables with separate middlegame and endgame
+values, blended by the game phase (how much non-pawn material is left),
+plus pawn structure (doubled, isolated and passed pawns) and king safety
+(the pawn shield in front of the king and open files next to it).
+
+The middlegame and endgame values are kept together in one int,
+score(mg, eg) = eg * 2**16 + mg, so a single addition updates both.
+Material and piece-square values only change with the pieces that move:
+Game keeps their sum in Game.psqt and make_move adds and subtracts the
+values of the pieces it moves, the same way it updates the Zobrist key.
+Pawn structure only changes when pawns move, so it is cached per pawn
+position in a PawnTable.
+
+Scores are in centipawns from white's point of view until evaluate turns
+them round for the side to move.
+"""
+
+PIECE_VALUES = {"P": 100, "N": 320, "B": 330, "R": 500, "Q": 900, "K": 0}  # for move ordering and counting
+MAX_PHASE = 24  # all minor and major pieces on the board
+
+
+def score(mg: int, eg: int) -> int:
+    return (eg << 16) + mg
+
+
+def unpack(packed: int) -> Tuple[int, int]:
+    """
+    The (middlegame, endgame) values of a packed score
+    """
+    mg = ((packed + 0x8000) & 0xFFFF) - 0x8000
+    return mg, (packed - mg) >> 16
+
+
+MIDDLEGAME_VALUES = {"P": 82, "N": 337, "B": 365, "R": 477, "Q": 1025, "K": 0}
+ENDGAME_VALUES = {"P": 94, "N": 281, "B": 297, "R": 512, "Q": 936, "K": 0}
+
+# Piece-square tables for white, indexed like the board (a8 = 0, h1 = 63).
+# Black uses the same tables flipped top to bottom (square ^ 56)
+MIDDLEGAME_TABLES = {
+    "P": [
+          0,   0,   0,   0,   0,   0,   0,   0,
+         98, 134,  61,  95,  68, 126,  34, -11,
+         -6,   7,  26,  31,  65,  56,  25, -20,
+        -14,  13,   6,  21,  23,  12,  17, -23,
+        -27,  -2,  -5,  12,  17,   6,  10, -25,
+        -26,  -4,  -4, -10,   3,   3,  33, -12,
+        -35,  -1, -20, -23, -15,  24,  38, -22,
+          0,   0,   0,   0,   0,   0,   0,   0,
+    ],
+    "N": [
+        -167, -89, -34, -49,  61, -97, -15, -107,
+         -73, -41,  72,  36,  23,  62,   7,  -17,
+         -47,  60,  37,  65,  84, 129,  73,   44,
+          -9,  17,  19,  53,  37,  69,  18,   22,
+         -13,   4,  16,  13,  28,  19,  21,   -8,
+         -23,  -9,  12,  10,  19,  17,  25,  -16,
+         -29, -53, -12,  -3,  -1,  18, -14,  -19,
+        -105, -21, -58, -33, -17, -28, -19,  -23,
+    ],
+    "B": [
+        -29,   4, -82, -37, -25, -42,   7,  -8,
+        -26,  16, -18, -13,  30,  59,  18, -47,
+        -16,  37,  43,  40,  35,  50,  37,  -2,
+         -4,   5,  19,  50,  37,  37,   7,  -2,
+         -6,  13,  13,  26,  34,  12,  10,   4,
+          0,  15,  15,  15,  14,  27,  18,  10,
+          4,  15,  16,   0,   7,  21,  33,   1,
+        -33,  -3, -14, -21, -13, -12, -39, -21,
+    ],
+    "R": [
+         32,  42,  32,  51,  63,   9,  31,  43,
+         27,  32,  58,  62,  80,  67,  26,  44,
+         -5,  19,  26,  36,  17,  45,  61,  16,
+        -24, -11,   7,  26,  24,  35,  -8, -20,
+        -36, -26, -12,  -1,   9,  -7,   6, -23,
+        -45, -25, -16, -17,   3,   0,  -5, -33,
+        -44, -16, -20,  -9,  -1,  11,  -6, -71,
+        -19, -13,   1,  17,  16,   7, -37, -26,
+    ],
+    "Q": [
+        -28,   0,  29,  12,  59,  44,  43,  45,
+        -24, -39,  -5,   1, -16,  57,  28,  54,
+        -13, -17,   7,   8,  29,  56,  47,  57,
+        -27, -27, -16, -16,  -1,  17,  -2,   1,
+         -9, -26,  -9, -10,  -2,  -4,   3,  -3,
+        -14,   2, -11,  -2,  -5,   2,  14,   5,
+        -35,  -8,  11,   2,   8,  15,  -3,   1,
+         -1, -18,  -9,  10, -15, -25, -31, -50,
+    ],
+    "K": [
+        -65,  23,  16, -15, -56, -34,   2,  13,
+         29,  -1, -20,  -7,  -8,  -4, -38, -29,
+         -9,  24,   2, -16, -20,   6,  22, -22,
+        -17, -20, -12, -27, -30, -25, -14, -36,
+        -49,  -1, -27, -39, -46, -44, -33, -51,
+        -14, -14, -22, -46, -44, -30, -15, -27,
+          1,   7,  -8, -64, -43, -16,   9,   8,
+        -15,  36,  12, -54,   8, -28,  24,  14,
+    ],
+}
+ENDGAME_TABLES = {
+    "P": [
+          0,   0,   0,   0,   0,   0,   0,   0,
+        178, 173, 158, 134, 147, 132, 165, 187,
+         94, 100,  85,  67,  56,  53,  82,  84,
+         32,  24,  13,   5,  -2,   4,  17,  17,
+         13,   9,  -3,  -7,  -7,  -8,   3,  -1,
+          4,   7,  -6,   1,   0,  -5,  -1,  -8,
+         13,   8,   8,  10,  13,   0,   2,  -7,
+          0,   0,   0,   0,   0,   0,   0,   0,
+    ],
+    "N": [
+        -58, -38, -13, -28, -31, -27, -63, -99,
+        -25,  -8, -25,  -2,  -9, -25, -24, -52,
+        -24, -20,  10,   9,  -1,  -9, -19, -41,
+        -17,   3,  22,  22,  22,  11,   8, -18,
+        -18,  -6,  16,  25,  16,  17,   4, -18,
+        -23,  -3,  -1,  15,  10,  -3, -20, -22,
+        -42, -20, -10,  -5,  -2, -20, -23, -44,
+        -29, -51, -23, -15, -22, -18, -50, -64,
+    ],
+    "B": [
+        -14, -21, -11,  -8,  -7,  -9, -17, -24,
+         -8,  -4,   7, -12,  -3, -13,  -4, -14,
+          2,  -8,   0,  -1,  -2,   6,   0,   4,
+         -3,   9,  12,   9,  14,  10,   3,   2,
+         -6,   3,  13,  19,   7,  10,  -3,  -9,
+        -12,  -3,   8,  10,  13,   3,  -7, -15,
+        -14, -18,  -7,  -1,   4,  -9, -15, -27,
+        -23,  -9, -23,  -5,  -9, -16,  -5, -17,
+    ],
+    "R": [
+         13,  10,  18,  15,  12,  12,   8,   5,
+         11,  13,  13,  11,  -3,   3,   8,   3,
+          7,   7,   7,   5,   4,  -3,  -5,  -3,
+          4,   3,  13,   1,   2,   1,  -1,   2,
+          3,   5,   8,   4,  -5,  -6,  -8, -11,
+         -4,   0,  -5,  -1,  -7, -12,  -8, -16,
+         -6,  -6,   0,   2,  -9,  -9, -11,  -3,
+         -9,   2,   3,  -1,  -5, -13,   4, -20,
+    ],
+    "Q": [
+         -9,  22,  22,  27,  27,  19,  10,  20,
+        -17,  20,  32,  41,  58,  25,  30,   0,
+        -20,   6,   9,  49,  47,  35,  19,   9,
+          3,  22,  24,  45,  57,  40,  57,  36,
+        -18,  28,  19,  47,  31,  34,  39,  23,
+        -16, -27,  15,   6,   9,  17,  10,   5,
+        -22, -23, -30, -16, -16, -23, -36, -32,
+        -33, -28, -22, -43,  -5, -32, -20, -41,
+    ],
+    "K": [
+        -74, -35, -18, -18, -11,  15,   4, -17,
+        -12,  17,  14,  17,  17,  38,  23,  11,
+         10,  17,  23,  15,  20,  45,  44,  13,
+         -8,  22,  24,  27,  26,  33,  26,   3,
+        -18,  -4,  21,  24,  27,  23,   9, -11,
+        -19,  -3,  11,  21,  23,  16,   7,  -9,
+        -27, -11,   4,  13,  14,   4,  -5, -17,
+        -53, -34, -21, -11, -28, -14, -24, -43,
+    ],
+}
+
+# Packed material + piece-square value of every (piece, square), negative
+# for black pieces. Game.psqt is the sum over the pieces on the board
+PIECE_SQUARE: Dict[str, List[int]] = {
+    name: [
+        (1 if name[0] == "W" else -1) * score(
+            MIDDLEGAME_VALUES[name[1]] + MIDDLEGAME_TABLES[name[1]][sq if name[0] == "W" else sq ^ 56],
+            ENDGAME_VALUES[name[1]] + ENDGAME_TABLES[name[1]][sq if name[0] == "W" else sq ^ 56],
+        )
+        for sq in range(64)
+    ]
+    for name in PIECE_NAMES
+}
+
+# Pawn structure, per pawn
+DOUBLED = score(-10, -20)  # for each pawn on a file after the first
+ISOLATED = score(-12, -15)  # no friendly pawn on the files next to it
+# Indexed by how far the pawn has advanced (1 on its starting rank)
+PASSED = [score(mg, eg) for mg, eg in ((0, 0), (0, 5), (5, 10), (10, 20), (20, 40), (35, 70), (55, 110), (0, 0))]
+
+# King safety, middlegame only
+SHIELD_PAWN = 12  # per own pawn on the three squares in front of the king (or the ones past them)
+OPEN_FILE = -18  # per file next to (or at) the king with no own pawn
+
+FILES = [FILE_A << x for x in range(8)]
+ADJACENT_FILES = [(FILES[x - 1] if x > 0 else 0) | (FILES[x + 1] if x < 7 else 0) for x in range(8)]
+KING_FILES = [FILES[x] | ADJACENT_FILES[x] for x in range(8)]
+KING_FILE_BITS = [0b111 << x >> 1 & 0xFF for x in range(8)]  # the king's file and its neighbours, as a byte
+
+
+def _ahead(color: str, sq: int, ranks: int = 8) -> int:
+    """
+    The squares on the same and adjacent files up to `ranks` ranks in front
+    of `sq`, from `color`'s side
+    """
+    x, y = sq % 8, sq // 8
+    step = -1 if color == "W" else 1
+    mask = 0
+    for distance in range(1, ranks + 1):
+        row = y + step * distance
+        if 0 <= row < 8:
+            mask |= KING_FILES[x] & (0xFF << row * 8)
+    return mask
+
+
+# Squares that enemy pawns must not be on (or guard) for a pawn to be passed
+PASSED_MASKS = {color: [_ahead(color, sq) for sq in range(64)] for color in "WB"}
+# The two ranks in front of a king
+SHIELD_MASKS = {color: [_ahead(color, sq, 2) for sq in range(64)] for color in "WB"}
+
+
+def board_score(board: List[list]) -> int:
+    """
+    The packed material and piece-square score of a board, from scratch.
+    Game.make_move keeps it up to date from there
+    """
+    total = 0
+    for y, row in enumerate(board):
+        for x, piece in enumerate(row):
+            if piece != "  ":
+                total += PIECE_SQUARE[piece][y * 8 + x]
+    return total
+
+
+def pawn_structure(white: int, black: int) -> int:
+    """
+    Packed score of the doubled, isolated and passed pawns, for the white
+    and black pawn bitboards
+    """
+    total = 0
+    for color, own, enemy, sign in (("W", white, black, 1), ("B", black, white, -1)):
+        side = 0
+        passed_masks = PASSED_MASKS[color]
+        for sq in iter_squares(own):
+            if not own & ADJACENT_FILES[sq % 8]:
+                side += ISOLATED
+            if not enemy & passed_masks[sq]:
+                side += PASSED[7 - sq // 8 if color == "W" else sq // 8]
+        for file in FILES:
+            count = popcount(own & file)
+            if count > 1:
+                side += DOUBLED * (count - 1)
+        total += sign * side
+    return total
+
+
+class PawnTable:
+    """
+    Remembers pawn_structure per pawn position. When full, the table is
+    cleared
+    """
+
+    def __init__(self, max_entries: int = 1 << 16):
+        self.max_entries = max_entries
+        self.entries = {}
+
+    def probe(self, white: int, black: int) -> int:
+        key = white << 64 | black
+        found = self.entries.get(key)
+        if found is None:
+            if len(self.entries) >= self.max_entries:
+                self.entries.clear()
+            found = self.entries[key] = pawn_structure(white, black)
+        return found
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+def _pawn_files(pawns: int) -> int:
+    """
+    A byte with bit x set if there is a pawn on file x
+    """
+    pawns |= pawns >> 32
+    pawns |= pawns >> 16
+    pawns |= pawns >> 8
+    return pawns & 0xFF
+
+
+def king_safety(pieces: Dict[str, int], king_squares: Dict[str, int]) -> int:
+    """
+    Middlegame king safety of white minus black: pawns shielding each king
+    and open files around it
+    """
+    white_pawns, black_pawns = pieces["WP"], pieces["BP"]
+    white_king, black_king = king_squares["W"], king_squares["B"]
+    white = (
+        SHIELD_PAWN * min(popcount(white_pawns & SHIELD_MASKS["W"][white_king]), 3)
+        + OPEN_FILE * popcount(~_pawn_files(white_pawns) & KING_FILE_BITS[white_king % 8])
+    )
+    black = (
+        SHIELD_PAWN * min(popcount(black_pawns & SHIELD_MASKS["B"][black_king]), 3)
+        + OPEN_FILE * popcount(~_pawn_files(black_pawns) & KING_FILE_BITS[black_king % 8])
+    )
+    return white - black
+
+
+def phase(pieces: Dict[str, int]) -> int:
+    """
+    MAX_PHASE with all the pieces on the board, down to 0 with only kings
+    and pawns left: knights and bishops count 1, rooks 2 and queens 4
+    """
+    return min(MAX_PHASE, (
+        popcount(pieces["WN"] | pieces["BN"] | pieces["WB"] | pieces["BB"])
+        + 2 * popcount(pieces["WR"] | pieces["BR"])
+        + 4 * popcount(pieces["WQ"] | pieces["BQ"])
+    ))
+
+
+def evaluate(game: "Game", pawn_table: Optional[PawnTable] = None) -> int:
+    """
+    Static evaluation in centipawns from the side to move's point of view.
+    pawn_table caches the pawn structure between calls (see PawnTable)
+    """
+    pieces = game.bitboards.pieces
+    white_pawns, black_pawns = pieces["WP"], pieces["BP"]
+    if pawn_table is not None:
+        pawns = pawn_table.probe(white_pawns, black_pawns)
+    else:
+        pawns = pawn_structure(white_pawns, black_pawns)
+    mg, eg = unpack(game.psqt + pawns)
+    game_phase = phase(pieces)
+    if game_phase:
+        mg += king_safety(pieces, game.king_squares)
+    total = mg * game_phase + eg * (MAX_PHASE - game_phase)
+    # Rounded towards zero, so a position and its mirror image score the same
+    total = total // MAX_PHASE if total >= 0 else -(-total // MAX_PHASE)
+    return total if game.turn == "W" else -total
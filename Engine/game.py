@@ -0,0 +1,1039 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import logging
+from typing import Awaitable, Callable, Iterator, Literal, List, Optional, Tuple, Union  # Type annotations
+
+from Engine.bitboard import BACK_RANKS, Bitboards, BETWEEN, FILE_A, FILE_H, FULL, KING_ATTACKS, KNIGHT_ATTACKS, \
+    LIGHT_SQUARES, PAWN_ATTACKS, bishop_attacks, iter_squares, queen_attacks, rook_attacks
+from Engine.cache import MoveCache
+from Engine.evaluation import PIECE_SQUARE, board_score
+from Engine.moves import CAPTURE, CASTLING, EN_PASSANT, KEY, PROMOTION_BITS, PROMOTION_MASK, PROMOTIONS, \
+    Move, parse_square, square_name
+from Engine.zobrist import BLACK_TO_MOVE_KEY, CASTLE_KEYS, EN_PASSANT_KEYS, PIECE_KEYS, \
+    castling_index, position_key
+from Errors.errors import InvalidMove
+
+
+"""
+Chess Game Logic
+
+This module has no GUI dependencies so the rules can be used (and imported
+quickly) without Kivy, e.g. by batch validators and worker processes.
+"""
+
+PromotionCallback = Callable[[str], Union[str, Awaitable[str]]]
+
+log = logging.getLogger(__name__)
+
+# Promotion flags in the order they are generated: queen, rook, bishop, knight
+PROMOTION_CHOICES = tuple(PROMOTION_BITS[piece] for piece in PROMOTIONS[1:])
+
+
+def promote_to_queen(color: Literal["W", "B"]) -> Literal["Q"]:
+    """
+    Default promotion choice used when no callback is given
+    """
+    return "Q"
+
+
+class Game:
+    """
+    This class consists of the chess game logic.
+
+    promotion_callback: called with the color of the promoting side and
+    returns the piece letter to promote to ("Q", "R", "B" or "N"). It may
+    return an awaitable (e.g. when a GUI has to wait for the user's choice).
+
+    backend: "mailbox" generates moves by scanning the nested list board,
+    "bitboard" uses the 64-bit integer bitboards (much faster). Both give
+    the same moves and self.board is kept up to date either way.
+
+    move_cache: an optional Engine.cache.MoveCache. Move lists are then
+    remembered per position, so selecting the same piece again (or
+    revisiting a position) does not generate them again.
+    """
+
+    def __init__(
+            self,
+            promotion_callback: Optional[PromotionCallback] = None,
+            backend: Literal["mailbox", "bitboard"] = "mailbox",
+            move_cache: Optional[MoveCache] = None
+        ):
+        self.board = [
+            ["BR", "BN", "BB", "BQ", "BK", "BB", "BN", "BR"],
+            ["BP", "BP", "BP", "BP", "BP", "BP", "BP", "BP"],
+            ["  ", "  ", "  ", "  ", "  ", "  ", "  ", "  "],
+            ["  ", "  ", "  ", "  ", "  ", "  ", "  ", "  "],
+            ["  ", "  ", "  ", "  ", "  ", "  ", "  ", "  "],
+            ["  ", "  ", "  ", "  ", "  ", "  ", "  ", "  "],
+            ["WP", "WP", "WP", "WP", "WP", "WP", "WP", "WP"],
+            ["WR", "WN", "WB", "WQ", "WK", "WB", "WN", "WR"],
+        ]
+        self.turn = "W"
+        self.moves = 0  # plies played, kept up to date by make_move
+        self.winner = None
+        self.warning = ""
+        self.promotion_callback = promotion_callback or promote_to_queen
+        self.backend = backend
+        self.move_cache = move_cache
+        self.bitboards = Bitboards.from_board(self.board)
+        self.move_stack = []  # see make_move
+        self.king_squares = {"W": 60, "B": 4}  # y * 8 + x, kept up to date by make_move
+        # Squares attacked by each side, worked out when first needed
+        # (see attacked_squares) and thrown away whenever a move is made
+        self.attack_maps = {"W": None, "B": None}
+        # (hash, checkers, pinned) of the last position moves were generated
+        # in, so asking for the moves of one piece after another is cheap
+        self.check_info = None
+        self.en_passant = None  # square a pawn can capture en passant on (y * 8 + x)
+        self.castle_status = {
+            "W": [True, True],  # O-O, O-O-O
+            "B": [True, True]
+        }
+        self.halfmove_clock = 0  # plies since the last capture or pawn move
+        self.fullmove_number = 1
+        # Zobrist key of the position, updated by make_move (see Engine.zobrist)
+        self.hash = position_key(self.board, self.turn, self.castle_status, self.en_passant)
+        # How many times each position (by hash) has occurred in this game,
+        # counted up by make_move and down by unmake_move
+        self.repetitions = {self.hash: 1}
+        # Material and piece-square score, updated by make_move (see Engine.evaluation)
+        self.psqt = board_score(self.board)
+
+    @classmethod
+    def from_fen(cls, fen: str, **kwargs) -> "Game":
+        """
+        Creates a game from a FEN string, e.g.
+        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1".
+        The move counters may be left out. Other arguments are passed to Game().
+        Raises ValueError if the FEN cannot be read or the position cannot
+        come up in a game (not one king each, pawns on the first or last
+        rank, or the side not to move in check). Castling rights and an en
+        passant square that the position rules out are dropped
+        """
+        fields = fen.split()
+        if len(fields) not in (4, 6):
+            raise ValueError(f"Invalid FEN: {fen!r}")
+        placement, turn, castling, en_passant = fields[:4]
+
+        board = []
+        for rank in placement.split("/"):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row += ["  "] * int(char)
+                elif char.upper() in "PNBRQK":
+                    row.append(("W" if char.isupper() else "B") + char.upper())
+                else:
+                    raise ValueError(f"Invalid FEN: {fen!r}")
+            if len(row) != 8:
+                raise ValueError(f"Invalid FEN: {fen!r}")
+            board.append(row)
+        if len(board) != 8 or turn not in ("w", "b"):
+            raise ValueError(f"Invalid FEN: {fen!r}")
+
+        game = cls(**kwargs)
+        game.board = board
+        game.bitboards = Bitboards.from_board(board)
+        pieces = game.bitboards.pieces
+        # Positions that cannot come up in a game would break the rules
+        # (a king could be captured, a pawn could move off the board)
+        for color in ("W", "B"):
+            kings = pieces[f"{color}K"]
+            if not kings or kings & (kings - 1):
+                raise ValueError(f"Invalid FEN, each side needs exactly one king: {fen!r}")
+            game.king_squares[color] = game.bitboards.king_square(color)
+        if (pieces["WP"] | pieces["BP"]) & BACK_RANKS:
+            raise ValueError(f"Invalid FEN, pawns on the first or last rank: {fen!r}")
+        game.turn = turn.upper()
+        enemy = "B" if game.turn == "W" else "W"
+        if game.bitboards.attackers(game.king_squares[enemy], game.turn, game.bitboards.occupied):
+            raise ValueError(f"Invalid FEN, the side not to move is in check: {fen!r}")
+        # A castling right is dropped unless its king and rook are at home
+        game.castle_status = {}
+        for color, row, king_side, queen_side in (("W", 7, "K", "Q"), ("B", 0, "k", "q")):
+            at_home = board[row][4] == f"{color}K"
+            game.castle_status[color] = [
+                king_side in castling and at_home and board[row][7] == f"{color}R",
+                queen_side in castling and at_home and board[row][0] == f"{color}R",
+            ]
+        game.en_passant = None
+        if en_passant != "-":
+            ep = parse_square(en_passant)
+            # The square an enemy pawn just skipped: on the sixth rank seen
+            # from the side to move, empty, with the pawn beyond it and its
+            # start square empty. Kept only if a pawn can take it, the same
+            # as make_move does
+            ep_y, ep_x = divmod(ep, 8)
+            ahead = 1 if game.turn == "W" else -1  # towards the enemy pawn
+            if (
+                ep_y == (2 if game.turn == "W" else 5)
+                and board[ep_y][ep_x] == "  "
+                and board[ep_y - ahead][ep_x] == "  "
+                and board[ep_y + ahead][ep_x] == f"{enemy}P"
+                and PAWN_ATTACKS[enemy][ep] & pieces[f"{game.turn}P"]
+            ):
+                game.en_passant = ep
+        if len(fields) == 6:
+            game.halfmove_clock, game.fullmove_number = int(fields[4]), int(fields[5])
+        game.hash = position_key(board, game.turn, game.castle_status, game.en_passant)
+        game.repetitions = {game.hash: 1}
+        game.psqt = board_score(board)
+        return game
+
+    def to_fen(self) -> str:
+        """
+        Returns the position as a FEN string
+        """
+        ranks = []
+        for row in self.board:
+            rank, empty = "", 0
+            for piece in row:
+                if piece == "  ":
+                    empty += 1
+                    continue
+                if empty:
+                    rank, empty = rank + str(empty), 0
+                rank += piece[1] if piece[0] == "W" else piece[1].lower()
+            ranks.append(rank + (str(empty) if empty else ""))
+
+        castling = "".join(
+            char for char, allowed in zip(
+                "KQkq", self.castle_status["W"] + self.castle_status["B"]) if allowed
+        ) or "-"
+        en_passant = "-"
+        if self.en_passant is not None:
+            en_passant = square_name(self.en_passant)
+        return (
+            f"{'/'.join(ranks)} {self.turn.lower()} {castling} {en_passant}"
+            f" {self.halfmove_clock} {self.fullmove_number}"
+        )
+
+    def attacked_squares(self, color: Literal["W", "B"]) -> int:
+        """
+        Returns a bitboard of the squares attacked by `color`. The maps are
+        recomputed lazily, not updated move by move: worked out at most once
+        per position, dropped by make_move and restored by unmake_move
+        """
+        attacked = self.attack_maps[color]
+        if attacked is None:
+            attacked = self.attack_maps[color] = self.bitboards.attack_map(color)
+        return attacked
+
+    def is_square_attacked(self, x: int, y: int, by: Literal["W", "B"]) -> bool:
+        """
+        Checks if a square is attacked by any piece of color `by`
+        """
+        return bool(self.attacked_squares(by) >> (y * 8 + x) & 1)
+
+    def find_pawn_moves(
+            self,
+            color: Literal["W", "B"],
+            piece_x: int,
+            piece_y: int,
+            return_check: bool = False
+        ) -> List[str]:
+        """
+        Finds all valid pawn moves
+        """
+        ret = []
+        if not return_check:  # if return_check, only check for takes
+            # Find valid vert movements (1/ 2 up for first move)
+            can_move_vertically = False
+            # Single vert moves
+            new_x, new_y = (piece_x, piece_y +
+                            1) if color == "B" else (piece_x, piece_y-1)
+            if self.board[new_y][new_x] == "  " and piece_x == new_x:
+                can_move_vertically = True
+                ret.append(new_y * 8 + new_x)
+
+            # Double vert moves
+            # First, check if the pawn is on it's home square
+            if can_move_vertically and ((piece_y == 1 and color == "B") or (piece_y == 6 and color == "W")):
+                new_x, new_y = (piece_x, piece_y +
+                                2) if color == "B" else (piece_x, piece_y-2)
+                if self.board[new_y][new_x] == "  " and piece_x == new_x:
+                    ret.append(new_y * 8 + new_x)
+
+        # Check for diagonal movement
+        new_y = piece_y+1 if color == "B" else piece_y-1
+        if not 0 <= new_y < 8:  # a king on its last rank (return_check)
+            return ret if not return_check else False
+        # Check for left/right diagonals
+        for i in (-1, 1):
+            new_x = piece_x + i
+            if 0 <= new_x < 8:
+                if self.board[new_y][new_x][0] == ("W" if color == "B" else "B"):
+                    ret.append(new_y * 8 + new_x)
+                    if return_check and self.board[new_y][new_x][1] == "P":
+                        return True
+                # En passant
+                elif not return_check and new_y * 8 + new_x == self.en_passant:
+                    ret.append(new_y * 8 + new_x)
+
+        return ret if not return_check else False
+
+    def find_horizontal_moves(
+            self,
+            color: Literal["W", "B"],
+            piece_x: int,
+            piece_y: int,
+            return_check: bool = False
+        ) -> List[int] | bool:
+        """
+        Find all valid left and right movements
+        """
+        ret = []
+        # Check for valid left movements and right movements
+        ind = 0
+        for movements in (range(1, piece_x + 1), range(1, 8-piece_x)):
+            for x in movements:
+                new_x = piece_x - x if ind == 0 else piece_x + x
+
+                # Check if potential square is not occupied by your own piece,
+                # else stop checking further
+                if self.board[piece_y][new_x][0] != color:
+                    ret.append(piece_y * 8 + new_x)
+
+                    # If that spot is occupied by opponent's piece,
+                    # stop checking for moves further along axis
+                    if self.board[piece_y][new_x][0] == ("W" if color == "B" else "B"):
+                        if return_check and self.board[piece_y][new_x][1] in ["R", "Q"]:
+                            return True
+                        break
+                else:
+                    break
+
+            ind += 1
+        return ret if not return_check else False
+
+    def find_vertical_moves(
+            self, color: Literal["W", "B"],
+            piece_x: int,
+            piece_y: int,
+            return_check: bool = False
+        ) -> List[str] | bool:
+        """
+        Checks for all valid up and down movements
+        """
+        ret = []
+        ind = 0
+        for movements in (range(1, piece_y + 1), range(1, 8-piece_y)):
+            for y in movements:
+                new_y = piece_y - y if ind == 0 else piece_y + y
+
+                # Check if potential square is not occupied by your own piece,
+                # else stop checking further
+                if self.board[new_y][piece_x][0] != color:
+                    ret.append(new_y * 8 + piece_x)
+
+                    # If that spot is occupied by opponent's piece,
+                    # stop checking for moves further along axis
+                    if self.board[new_y][piece_x][0] == ("W" if color == "B" else "B"):
+                        if return_check and self.board[new_y][piece_x][1] in ["R", "Q"]:
+                            return True
+                        break
+                else:
+                    break
+
+            ind += 1
+        return ret if not return_check else False
+
+    def find_diagonal_moves(
+            self,
+            color: Literal["W", "B"],
+            piece_x: int,
+            piece_y: int,
+            return_check: bool = False
+        ) -> List[int] | bool:
+        """
+        Find all diagonal moves
+        """
+        ret = []
+        for y in (-1, 1):
+            for x in (-1, 1):
+                modx, mody = x, y
+                while 0 <= piece_x+modx < 8 and 0 <= piece_y+mody < 8:
+                    if self.board[piece_y+mody][piece_x+modx][0] != color:
+                        ret.append((piece_y + mody) * 8 + piece_x + modx)
+
+                        # If that spot is occupied by opponent's piece,
+                        # stop checking for moves further along axis
+                        if self.board[piece_y+mody][piece_x+modx][0] == ("W" if color == "B" else "B"):
+
+                            if return_check and self.board[piece_y+mody][piece_x+modx][1] in ["B", "Q"]:
+                                return True
+                            break
+                    else:
+                        break
+
+                    modx += x
+                    mody += y
+
+        return ret if not return_check else False
+
+    def find_knight_moves(
+            self,
+            color: Literal["W", "B"],
+            piece_x: int,
+            piece_y: int,
+            return_check: bool = False
+        ) -> List[int] | bool:
+        """
+        Find all valid knight moves (L shape)
+        """
+        ret = []
+        for mody in (-2, -1, 1, 2):
+            for modx in (-2, -1, 1, 2):
+                if 0 <= piece_x+modx < 8 and 0 <= piece_y+mody < 8:
+                    if abs(modx) == abs(mody):
+                        continue  # Skip check if x and y change is same because only L shaped movements should be checked
+                    if self.board[piece_y+mody][piece_x+modx][0] != color:
+                        ret.append((piece_y + mody) * 8 + piece_x + modx)
+                        if return_check and self.board[piece_y+mody][piece_x+modx][1] == "N":
+                            return True
+
+        return ret if not return_check else False
+
+    def find_adj_moves(
+            self,
+            color: Literal["W", "B"],
+            piece_x: int,
+            piece_y: int,
+            return_check: bool = False
+        ) -> List[str]:
+        """
+        Finds all adjacent moves (mostly used for king movement)
+        """
+        ret = []
+        for mody in (-1, 0, 1):
+            for modx in (-1, 0, 1):
+                if mody == 0 and modx == 0:
+                    continue
+                if 0 <= piece_x+modx < 8 and 0 <= piece_y+mody < 8:
+                    if self.board[piece_y+mody][piece_x+modx][0] != color:
+                        ret.append((piece_y + mody) * 8 + piece_x + modx)
+                        if return_check and self.board[piece_y+mody][piece_x+modx][1] == "K":
+                            return True
+
+        return ret if not return_check else False
+
+    def is_in_check(
+            self,
+            color: Literal["W", "B"],
+            piece_x: int,
+            piece_y: int,
+            temp_board: Optional[List[list]] = None
+        ) -> bool:
+        """
+        This function checks if a "potential" position
+        on the board is threatened.
+        Will be used for kind movements and castling to ensure the
+        players don't castle into check ect.
+        """
+        # The generators only read self.board, so a temporary board is
+        # swapped in (not copied) and always swapped back
+        original_board = self.board
+        if temp_board is not None:
+            self.board = temp_board
+        try:
+            return (
+                self.find_horizontal_moves(color, piece_x, piece_y, True)
+                or self.find_vertical_moves(color, piece_x, piece_y, True)
+                or self.find_diagonal_moves(color, piece_x, piece_y, True)
+                or self.find_knight_moves(color, piece_x, piece_y, True)
+                or self.find_adj_moves(color, piece_x, piece_y, True)
+                or self.find_pawn_moves(color, piece_x, piece_y, True)
+            )
+        finally:
+            self.board = original_board
+
+    def get_valid_moves(self, sq: int) -> List[Move]:
+        """
+        Returns a list of all valid moves the piece on square `sq`
+        (y * 8 + x) can make, as Engine.moves integers. A promotion is
+        listed once (as a queen promotion), the piece is chosen in Game.move
+        """
+        piece = self.board[sq // 8][sq % 8]
+        color = piece[0]
+
+        if piece[0] not in ("W", "B"):
+            raise InvalidMove
+        
+        if color != self.turn: # No valid moves if it isn't user's turn
+            return []
+
+        if self.move_cache is None:
+            valid_moves = self.find_valid_moves(piece, sq % 8, sq // 8)
+        else:
+            key = (self.hash, sq)
+            valid_moves = self.move_cache.get(key)
+            if valid_moves is None:
+                valid_moves = self.find_valid_moves(piece, sq % 8, sq // 8)
+                self.move_cache.put(key, valid_moves)
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Valid moves: %s", [square_name(move >> 6 & 63) for move in valid_moves])
+        return valid_moves
+
+    def find_valid_moves(self, piece: str, piece_x: int, piece_y: int) -> List[Move]:
+        """
+        Generates the moves for get_valid_moves with the selected backend
+        """
+        if self.backend == "bitboard":
+            return self.find_bitboard_moves(piece, piece_x, piece_y)
+
+        color = piece[0]
+        enemy = "B" if color == "W" else "W"
+        targets = []
+
+        # Check for valid pawn movement
+        if piece[-1] == "P":  # "P" in "WP"
+            targets += self.find_pawn_moves(piece[0], piece_x, piece_y)
+
+        # Check for rook movement
+        if piece[-1] == "R":
+            targets += self.find_horizontal_moves(
+                piece[0], piece_x, piece_y)
+            targets += self.find_vertical_moves(piece[0], piece_x, piece_y)
+
+        # Check for knight movement
+        if piece[-1] == "N":
+            targets += self.find_knight_moves(piece[0], piece_x, piece_y)
+
+        # Check for bishop movement
+        if piece[-1] == "B":
+            targets += self.find_diagonal_moves(piece[0], piece_x, piece_y)
+
+        if piece[-1] == "Q":
+            targets += self.find_horizontal_moves(
+                piece[0], piece_x, piece_y)
+            targets += self.find_vertical_moves(piece[0], piece_x, piece_y)
+            targets += self.find_diagonal_moves(piece[0], piece_x, piece_y)
+
+        from_sq = piece_y * 8 + piece_x
+        valid_moves = []
+        for to_sq in targets:
+            move = from_sq | to_sq << 6
+            if self.board[to_sq // 8][to_sq % 8][0] == enemy:
+                move |= CAPTURE
+            elif piece[1] == "P" and to_sq % 8 != piece_x:
+                move |= CAPTURE | EN_PASSANT
+            if piece[1] == "P" and to_sq // 8 in (0, 7):
+                move |= PROMOTION_BITS["Q"]
+            valid_moves.append(move)
+
+        if piece[-1] == "K":
+            valid_moves += [
+                from_sq | to_sq << 6 | (CAPTURE if self.board[to_sq // 8][to_sq % 8][0] == enemy else 0)
+                for to_sq in self.find_adj_moves(piece[0], piece_x, piece_y)
+            ]
+            # Check if player is allowed to castle
+            """
+            Castle status is defined as such:
+            self.castle_status = {
+            "W": [O-O: bool, O-O-O: bool],
+            "B": ...
+            }
+            """
+            num = 7 if color == "W" else 0  # row coord
+            # Only a king on its home square can castle, and not out of check!
+            if (piece_x, piece_y) == (4, num) and not self.is_square_attacked(piece_x, piece_y, enemy):
+                castling = self.castle_status[color]
+                # King's side castling (O-O)
+                if not self.is_square_attacked(5, num, enemy) and castling[0] and all(self.board[num][i] == "  " for i in range(5, 7)) and self.board[num][7] == f"{color}R":
+                    valid_moves.append(from_sq | (num * 8 + 6) << 6 | CASTLING)
+                # Queen's side castling (O-O-O)
+                if not self.is_square_attacked(3, num, enemy) and castling[1] and all(self.board[num][i] == "  " for i in range(1, 4)) and self.board[num][0] == f"{color}R":
+                    valid_moves.append(from_sq | (num * 8 + 2) << 6 | CASTLING)
+
+        # Check if king is in check.
+        for move in valid_moves.copy():
+            self.make_move(move)
+            try:
+                king_sq = self.king_squares[color]
+                if self.is_in_check(color, king_sq % 8, king_sq // 8):
+                    valid_moves.remove(move)
+            finally:
+                self.unmake_move()
+
+        return valid_moves
+
+    def find_bitboard_moves(self, piece: str, piece_x: int, piece_y: int) -> List[Move]:
+        """
+        Bitboard version of get_valid_moves
+        """
+        valid_moves = []
+        for move in self.generate_legal_moves(1 << (piece_y * 8 + piece_x)):
+            # Promotions are listed once, the piece is chosen in Game.move
+            if move >> 12 & 7 > 1:
+                continue
+            valid_moves.append(move)
+        return valid_moves
+
+    def generate_legal_moves(self, origins: int = FULL) -> List[Move]:
+        """
+        Returns every legal move of the side to move as Engine.moves
+        integers, with their CAPTURE, CASTLING and EN_PASSANT flags set.
+        Castling is a king move of two squares.
+
+        origins: bitboard of the squares to generate moves from (all by default)
+        """
+        return list(self.iter_legal_moves(origins))
+
+    def iter_legal_moves(self, origins: int = FULL) -> Iterator[Move]:
+        """
+        Yields the moves of generate_legal_moves one at a time, so callers
+        that only need the first (see has_legal_move) stop early. King
+        moves come first, then pawns, knights, bishops, rooks and queens,
+        and castling last: a king that can castle can always step towards
+        the rook, so castling is never the only legal move.
+
+        Checkers and pinned pieces are found once for the position (after
+        the king moves, and kept in check_info for the next call), so only
+        legal moves are generated and none have to be played to test them.
+        """
+        bitboards = self.bitboards
+        pieces = bitboards.pieces
+        color = self.turn
+        enemy = "B" if color == "W" else "W"
+        own = bitboards.colors[color]
+        enemy_occupied = bitboards.colors[enemy]
+        occupied = own | enemy_occupied
+        king = self.king_squares[color]
+
+        # King moves. The king is taken off the board first so it cannot
+        # hide behind itself on the line of a checking slider
+        king_moves = origins >> king & 1
+        if king_moves:
+            without_king = occupied & ~(1 << king)
+            for to_sq in iter_squares(KING_ATTACKS[king] & ~own):
+                if not bitboards.is_attacked(to_sq, enemy, without_king, ignore=1 << to_sq):
+                    yield king | to_sq << 6 | (CAPTURE if enemy_occupied >> to_sq & 1 else 0)
+
+        origins &= own & ~(1 << king)
+        if not origins:
+            if king_moves and not self.attacked_squares(enemy) >> king & 1:
+                yield from self.find_castling_moves(color, king, occupied)
+            return
+
+        check_info = self.check_info
+        if check_info is None or check_info[0] != self.hash:
+            check_info = self.check_info = (
+                self.hash, bitboards.attackers(king, enemy, occupied), bitboards.pinned(color))
+        _, checkers, pinned = check_info
+        if checkers & (checkers - 1):  # double check, only the king can move
+            return
+        if checkers:
+            # Capture the checker or block its line
+            target_mask = checkers | BETWEEN[king][checkers.bit_length() - 1]
+        else:
+            target_mask = FULL
+
+        # Pawns, all at once: every kind of pawn move is a shift of the pawn
+        # bitboard, so each target set is worked out in one go and the
+        # start square is the target minus the shift
+        pawns = pieces[f"{color}P"] & origins
+        if pawns:
+            empty = ~occupied
+            capturable = enemy_occupied & target_mask
+            if color == "W":
+                single = pawns >> 8 & empty
+                double = (single & 0xFF << 40) >> 8 & empty
+                left = (pawns & ~FILE_A) >> 9 & capturable
+                right = (pawns & ~FILE_H) >> 7 & capturable
+                shifts, last_row = (-8, -16, -9, -7), 0
+            else:
+                single = pawns << 8 & empty
+                double = (single & 0xFF << 16) << 8 & empty
+                left = (pawns & ~FILE_A) << 7 & capturable
+                right = (pawns & ~FILE_H) << 9 & capturable
+                shifts, last_row = (8, 16, 7, 9), 7
+            for targets, shift, flags in zip(
+                    (single & target_mask, double & target_mask, left, right),
+                    shifts, (0, 0, CAPTURE, CAPTURE)):
+                while targets:
+                    bb = targets & -targets
+                    targets ^= bb
+                    to_sq = bb.bit_length() - 1
+                    sq = to_sq - shift
+                    if sq in pinned and not pinned[sq] & bb:
+                        continue
+                    move = sq | to_sq << 6 | flags
+                    if to_sq >> 3 == last_row:
+                        for bits in PROMOTION_CHOICES:
+                            yield move | bits
+                    else:
+                        yield move
+
+            # En passant removes two pawns from the same rank, which no pin
+            # test covers, so it is checked by looking at the board after it
+            ep = self.en_passant
+            if ep is not None:
+                captured = 1 << (ep - shifts[0])
+                for sq in iter_squares(PAWN_ATTACKS[enemy][ep] & pawns):
+                    occupied_after = (occupied & ~(1 << sq) & ~captured) | (1 << ep)
+                    if not bitboards.is_attacked(king, enemy, occupied_after, ignore=captured):
+                        yield sq | ep << 6 | CAPTURE | EN_PASSANT
+
+        # A pinned knight can never move
+        for sq in iter_squares(pieces[f"{color}N"] & origins):
+            if sq in pinned:
+                continue
+            targets = KNIGHT_ATTACKS[sq] & ~own & target_mask
+            captures = targets & enemy_occupied
+            targets ^= captures
+            while captures:
+                bb = captures & -captures
+                captures ^= bb
+                yield sq | (bb.bit_length() - 1) << 6 | CAPTURE
+            while targets:
+                bb = targets & -targets
+                targets ^= bb
+                yield sq | (bb.bit_length() - 1) << 6
+
+        for kind, attacks in (("B", bishop_attacks), ("R", rook_attacks), ("Q", queen_attacks)):
+            for sq in iter_squares(pieces[f"{color}{kind}"] & origins):
+                targets = attacks(sq, occupied) & ~own & target_mask
+                if sq in pinned:
+                    targets &= pinned[sq]
+                captures = targets & enemy_occupied
+                targets ^= captures
+                while captures:
+                    bb = captures & -captures
+                    captures ^= bb
+                    yield sq | (bb.bit_length() - 1) << 6 | CAPTURE
+                while targets:
+                    bb = targets & -targets
+                    targets ^= bb
+                    yield sq | (bb.bit_length() - 1) << 6
+
+        if king_moves and not checkers:
+            yield from self.find_castling_moves(color, king, occupied)
+
+    def has_legal_move(self) -> bool:
+        """
+        Whether the side to move has any legal move. Stops at the first one
+        found, which in most positions is a king or pawn move
+        """
+        if self.move_cache is not None:
+            moves = self.move_cache.get((self.hash, None))
+            if moves is not None:
+                return bool(moves)
+        for _ in self.iter_legal_moves():
+            return True
+        return False
+
+    def cached_legal_moves(self) -> List[Move]:
+        """
+        generate_legal_moves, going through the move cache if there is one
+        """
+        if self.move_cache is None:
+            return self.generate_legal_moves()
+        key = (self.hash, None)
+        moves = self.move_cache.get(key)
+        if moves is None:
+            moves = self.generate_legal_moves()
+            self.move_cache.put(key, moves)
+        return moves
+
+    def legal_move(self, move: Move) -> Optional[Move]:
+        """
+        The legal move with the same squares and promotion as `move` (which
+        may be missing its flags, e.g. when read from a file), or None
+        """
+        key = move & KEY
+        for legal in self.generate_legal_moves(1 << (move & 63)):
+            if legal & KEY == key:
+                return legal
+        return None
+
+    def find_castling_moves(
+            self,
+            color: Literal["W", "B"],
+            king: int,
+            occupied: int
+        ) -> List[Move]:
+        """
+        Castling moves for generate_legal_moves (the king is not in check).
+        See get_valid_moves for the castle_status layout
+        """
+        castling = self.castle_status[color]
+        row = 56 if color == "W" else 0
+        moves = []
+        if king != row + 4 or not (castling[0] or castling[1]):
+            return moves
+        rooks = self.bitboards.pieces[f"{color}R"]
+        attacked = self.attacked_squares("B" if color == "W" else "W")
+        # King's side castling (O-O)
+        if castling[0] and rooks >> (row + 7) & 1 \
+                and not (occupied | attacked) & (0b11 << (row + 5)):
+            moves.append(king | (row + 6) << 6 | CASTLING)
+        # Queen's side castling (O-O-O)
+        if castling[1] and rooks >> row & 1 and not occupied & (0b111 << (row + 1)) \
+                and not attacked & (0b11 << (row + 2)):
+            moves.append(king | (row + 2) << 6 | CASTLING)
+        return moves
+
+    def make_move(self, move: Move) -> None:
+        """
+        Plays a move (see Engine.moves) on the board in place, without
+        checking if it is valid, and hands the turn to the other side. Its
+        flags are not needed: castling and en passant are recognised from
+        the board. Everything needed to take the move back is pushed onto
+        self.move_stack, see unmake_move.
+        """
+        from_sq, to_sq = move & 63, move >> 6 & 63
+        piece_x, piece_y, new_x, new_y = from_sq & 7, from_sq >> 3, to_sq & 7, to_sq >> 3
+        promote_to = PROMOTIONS[move >> 12 & 7]
+        board = self.board
+        bitboards = self.bitboards
+        castle_status = self.castle_status
+        piece = board[piece_y][piece_x]
+        captured = board[new_y][new_x]
+        color = piece[0]
+        enemy = "B" if color == "W" else "W"
+        old_castling = castling_index(castle_status)
+
+        self.move_stack.append((
+            piece_x, piece_y, new_x, new_y, piece, captured,
+            castle_status["W"][:], castle_status["B"][:], self.en_passant, self.attack_maps,
+            self.hash, self.halfmove_clock, self.psqt
+        ))
+        self.attack_maps = {"W": None, "B": None}
+
+        placed = f"{color}{promote_to}" if promote_to else piece
+        board[piece_y][piece_x] = "  "
+        board[new_y][new_x] = placed
+        bitboards.remove(piece, from_sq)
+        key = self.hash ^ PIECE_KEYS[piece][from_sq] ^ PIECE_KEYS[placed][to_sq] ^ BLACK_TO_MOVE_KEY
+        psqt = self.psqt - PIECE_SQUARE[piece][from_sq] + PIECE_SQUARE[placed][to_sq]
+        if captured != "  ":
+            bitboards.remove(captured, to_sq)
+            key ^= PIECE_KEYS[captured][to_sq]
+            psqt -= PIECE_SQUARE[captured][to_sq]
+        bitboards.put(placed, to_sq)
+
+        if self.en_passant is not None:
+            key ^= EN_PASSANT_KEYS[self.en_passant % 8]
+        self.en_passant = None
+        if piece[1] == "P":
+            if abs(new_y - piece_y) == 2:
+                # Only recorded when an enemy pawn could take it, so positions
+                # that only differ by an unusable en passant square match
+                ep = (piece_y + new_y) // 2 * 8 + piece_x
+                if PAWN_ATTACKS[color][ep] & bitboards.pieces[f"{enemy}P"]:
+                    self.en_passant = ep
+                    key ^= EN_PASSANT_KEYS[piece_x]
+            elif new_x != piece_x and captured == "  ":  # en passant capture
+                board[piece_y][new_x] = "  "
+                bitboards.remove(f"{enemy}P", piece_y * 8 + new_x)
+                key ^= PIECE_KEYS[f"{enemy}P"][piece_y * 8 + new_x]
+                psqt -= PIECE_SQUARE[f"{enemy}P"][piece_y * 8 + new_x]
+
+        if piece[1] == "K":
+            self.king_squares[color] = to_sq
+            if abs(new_x - piece_x) == 2:  # castling, move the rook as well
+                rook_x, rook_new_x = (7, 5) if new_x == 6 else (0, 3)
+                board[new_y][rook_x] = "  "
+                board[new_y][rook_new_x] = f"{color}R"
+                bitboards.remove(f"{color}R", new_y * 8 + rook_x)
+                bitboards.put(f"{color}R", new_y * 8 + rook_new_x)
+                key ^= PIECE_KEYS[f"{color}R"][new_y * 8 + rook_x] ^ PIECE_KEYS[f"{color}R"][new_y * 8 + rook_new_x]
+                psqt += PIECE_SQUARE[f"{color}R"][new_y * 8 + rook_new_x] - PIECE_SQUARE[f"{color}R"][new_y * 8 + rook_x]
+            castle_status[color] = [False, False]
+        # Moving from or capturing on a corner square loses that castling right
+        for x, y in ((piece_x, piece_y), (new_x, new_y)):
+            if (x == 0 or x == 7) and (y == 0 or y == 7):
+                castle_status["W" if y == 7 else "B"][0 if x == 7 else 1] = False
+        new_castling = castling_index(castle_status)
+        if new_castling != old_castling:
+            key ^= CASTLE_KEYS[old_castling] ^ CASTLE_KEYS[new_castling]
+
+        self.hash = key
+        self.psqt = psqt
+        self.repetitions[key] = self.repetitions.get(key, 0) + 1
+        self.moves += 1
+        if piece[1] == "P" or captured != "  ":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if color == "B":
+            self.fullmove_number += 1
+        self.turn = enemy
+
+    def unmake_move(self) -> None:
+        """
+        Takes back the last move played with make_move
+        """
+        repetitions = self.repetitions
+        if repetitions[self.hash] == 1:
+            del repetitions[self.hash]
+        else:
+            repetitions[self.hash] -= 1
+        self.moves -= 1
+        (piece_x, piece_y, new_x, new_y, piece, captured,
+         white_castle, black_castle, self.en_passant, self.attack_maps,
+         self.hash, self.halfmove_clock, self.psqt) = self.move_stack.pop()
+        board = self.board
+        bitboards = self.bitboards
+        color = piece[0]
+        from_sq, to_sq = piece_y * 8 + piece_x, new_y * 8 + new_x
+
+        bitboards.remove(board[new_y][new_x], to_sq)
+        board[new_y][new_x] = captured
+        board[piece_y][piece_x] = piece
+        bitboards.put(piece, from_sq)
+        if captured != "  ":
+            bitboards.put(captured, to_sq)
+
+        if piece[1] == "K":
+            self.king_squares[color] = from_sq
+        if piece[1] == "P" and new_x != piece_x and captured == "  ":  # en passant
+            enemy_pawn = "BP" if color == "W" else "WP"
+            board[piece_y][new_x] = enemy_pawn
+            bitboards.put(enemy_pawn, piece_y * 8 + new_x)
+        elif piece[1] == "K" and abs(new_x - piece_x) == 2:
+            rook_x, rook_new_x = (7, 5) if new_x == 6 else (0, 3)
+            board[new_y][rook_new_x] = "  "
+            board[new_y][rook_x] = f"{color}R"
+            bitboards.remove(f"{color}R", new_y * 8 + rook_new_x)
+            bitboards.put(f"{color}R", new_y * 8 + rook_x)
+
+        self.castle_status["W"], self.castle_status["B"] = white_castle, black_castle
+        if color == "B":
+            self.fullmove_number -= 1
+        self.turn = color
+
+    def last_move_squares(self) -> List[Tuple[int, int]]:
+        """
+        The (x, y) squares whose contents the last move changed, including
+        the rook's squares when castling and the captured pawn's square for
+        en passant. A GUI only needs to redraw these after a move
+        """
+        if not self.move_stack:
+            return []
+        piece_x, piece_y, new_x, new_y, piece, captured = self.move_stack[-1][:6]
+        squares = [(piece_x, piece_y), (new_x, new_y)]
+        if piece[1] == "P" and new_x != piece_x and captured == "  ":
+            squares.append((new_x, piece_y))
+        elif piece[1] == "K" and abs(new_x - piece_x) == 2:
+            squares += [(7, new_y), (5, new_y)] if new_x == 6 else [(0, new_y), (3, new_y)]
+        return squares
+
+    def insufficient_material(self) -> bool:
+        """
+        Whether neither side can ever mate: kings with at most one knight
+        or bishop, or with bishops that all stand on one color of square
+        """
+        pieces = self.bitboards.pieces
+        if pieces["WP"] | pieces["BP"] | pieces["WR"] | pieces["BR"] | pieces["WQ"] | pieces["BQ"]:
+            return False
+        knights = pieces["WN"] | pieces["BN"]
+        bishops = pieces["WB"] | pieces["BB"]
+        minors = knights | bishops
+        if not minors & (minors - 1):  # one minor piece or none
+            return True
+        return not knights and (bishops & LIGHT_SQUARES == bishops or not bishops & LIGHT_SQUARES)
+
+    def outcome(self) -> Optional[Tuple[str, str]]:
+        """
+        (winner, status) if the game is over, otherwise None. status is
+        "checkmate" or "stalemate" if the side to move has no legal moves,
+        or for a draw "repetition" (the position occurred three times),
+        "fifty-move rule" (100 plies without a capture or pawn move) or
+        "insufficient material". The winner is "White" or "Black" (on a draw
+        it is the side that moved last, and not used)
+        """
+        color = self.turn
+        enemy = "B" if color == "W" else "W"
+        winner = "White" if enemy == "W" else "Black"
+        if not self.has_legal_move():
+            king_x, king_y = self.king_squares[color] % 8, self.king_squares[color] // 8
+            status = "checkmate" if self.is_square_attacked(king_x, king_y, enemy) else "stalemate"
+            return winner, status
+        # Checked after mate, which stands even on the fiftieth move
+        if self.repetitions[self.hash] >= 3:
+            return winner, "repetition"
+        if self.halfmove_clock >= 100:
+            return winner, "fifty-move rule"
+        if self.insufficient_material():
+            return winner, "insufficient material"
+        return None
+
+    async def choose_promotion(self, color: Literal["W", "B"]) -> str:
+        """
+        Asks the promotion callback which piece a pawn should promote to.
+        Returns the full piece name, e.g. "WQ"
+        """
+        choice = self.promotion_callback(color)
+        if hasattr(choice, "__await__"):  # not inspect.isawaitable, importing inspect is slow
+            choice = await choice
+        if choice not in ("Q", "R", "B", "N"):
+            raise InvalidMove(f"Cannot promote to {choice!r}")
+        return f"{color}{choice}"
+
+    async def move(
+            self,
+            from_sq: int,
+            to_sq: int,
+            promote_to: Optional[Literal["Q", "R", "B", "N"]] = None
+        ) -> Optional[Union[bool, Tuple[str, str]]]:
+        """
+        This function helps move a piece on the board. Returns the
+        (winner, status) of outcome() if the move ended the game, True if it
+        did not, or None if to_sq is not a valid move for the piece
+
+        from_sq: the square of the piece (y * 8 + x)
+        to_sq: the square to move it to
+        promote_to: piece to promote a pawn to. If not given and the move is
+        a promotion, the promotion callback is asked
+        """
+        self.pawn_promotion = False
+        # Get the piece type based on from_sq (WR, WN, BP, etc)
+        # Reset warning
+        self.warning = ""
+
+        piece_type = self.board[from_sq // 8][from_sq % 8]
+        color = piece_type[0]
+
+        valid_moves = self.get_valid_moves(from_sq)
+
+        # Get ready to move piece
+        for move in valid_moves:
+            if move >> 6 & 63 != to_sq:
+                continue
+            # Check for pawn promotion
+            num = 0 if color == "W" else 7
+            if piece_type[1] == "P" and to_sq // 8 == num:
+                self.pawn_promotion = True
+
+            # Check pawn promotion
+            if not self.pawn_promotion:
+                promote_to = None
+            elif promote_to is None:
+                promote_to = (await self.choose_promotion(color))[1]
+
+            # Move piece (this also moves the rook when castling, updates
+            # castling rights and swaps self.turn so the opponent's moves
+            # can be checked for mate below)
+            self.make_move(move & ~PROMOTION_MASK | PROMOTION_BITS[promote_to])
+
+            # Check for checkmate, stalemate or a draw
+            return self.outcome() or True
@@ -0,0 +1,279 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+from array import array
+import mmap
+import os
+import struct
+import sys
+import time
+from typing import Iterator, List, Optional, Sequence
+
+from Engine.game import Game
+from Engine.moves import KEY, Move
+
+
+"""
+Binary game database
+
+Games are stored as compact binary records appended to one file:
+
+    file header  b"CHESSDB1"
+    record       size (u32, whole record), game id (u32), result (u8), pad,
+                 plies (u16), FEN length (u16), FEN (ASCII, empty for the
+                 starting position, padded to an even length),
+                 moves (u16 each, the Engine.moves int without its flags)
+
+All numbers are little endian. Records are never rewritten, so the file
+can be memory-mapped and read while games are added. Game ids count up
+from 1, and `<path>.idx` holds the offset of every record (u64 each),
+which is rebuilt from the records if it is missing or behind.
+
+Usage:
+    python -m Engine.gamedb import games.pgn games.cdb
+    python -m Engine.gamedb stats games.cdb
+"""
+
+MAGIC = b"CHESSDB1"
+RECORD = struct.Struct("<IIBxHH")
+RESULTS = ("*", "1-0", "0-1", "1/2-1/2")
+NATIVE_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+class GameRecord:
+    """
+    One stored game. `moves` is a read-only view of the moves in the
+    mapped file (no copy is made); they are Engine.moves ints without flags,
+    which Game.make_move plays as they are
+    """
+
+    def __init__(self, game_id: int, result: str, fen: Optional[str], moves: Sequence[int]):
+        self.game_id = game_id
+        self.result = result
+        self.fen = fen
+        self.moves = moves
+
+    def __repr__(self):
+        return f"GameRecord({self.game_id}, {len(self.moves)} plies, {self.result})"
+
+    def replay(self, **kwargs) -> Game:
+        """
+        Plays the moves and returns the final position. Other arguments are
+        passed to Game()
+        """
+        game = Game.from_fen(self.fen, **kwargs) if self.fen else Game(**kwargs)
+        for move in self.moves:
+            game.make_move(move)
+        return game
+
+
+class GameDatabase:
+    """
+    An append-only file of GameRecords, created if it does not exist.
+    Use as a context manager or call close()
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + ".idx"
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a+b")
+        if new:
+            self.file.write(MAGIC)
+            self.file.flush()
+        self.file.seek(0)
+        if self.file.read(len(MAGIC)) != MAGIC:
+            self.file.close()
+            raise ValueError(f"{path} is not a game database")
+        self.map = None
+        self.mapped_size = 0
+        self.offsets = array("Q")
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as index:
+                self.offsets.frombytes(index.read())
+            if not NATIVE_LITTLE_ENDIAN:
+                self.offsets.byteswap()
+        self.index = open(self.index_path, "ab")
+        self.rebuild_index()
+
+    def rebuild_index(self) -> None:
+        """
+        Indexes the records written after the last indexed one (e.g. if the
+        program stopped between writing a record and its index entry)
+        """
+        self.remap()
+        offset = self.offsets[-1] + self.record_size(self.offsets[-1]) if self.offsets else len(MAGIC)
+        missing = array("Q")
+        while offset + RECORD.size <= self.mapped_size:
+            size = self.record_size(offset)
+            if offset + size > self.mapped_size:
+                break  # a record that was only partly written
+            missing.append(offset)
+            offset += size
+        if missing:
+            self.offsets.extend(missing)
+            self.write_index(missing)
+
+    def write_index(self, offsets: array) -> None:
+        if not NATIVE_LITTLE_ENDIAN:
+            offsets = array("Q", offsets)
+            offsets.byteswap()
+        self.index.write(offsets.tobytes())
+        self.index.flush()
+
+    def remap(self) -> None:
+        """
+        Maps the file again if it has grown
+        """
+        size = os.path.getsize(self.path)
+        if size != self.mapped_size:
+            # The old map is not closed, records read from it may still be
+            # in use. It is freed when the last of them is
+            self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+            self.mapped_size = size
+
+    def record_size(self, offset: int) -> int:
+        return RECORD.unpack_from(self.map, offset)[0]
+
+    def append(self, moves: List[Move], result: str = "*", fen: Optional[str] = None) -> int:
+        """
+        Stores a game and returns its id
+        """
+        game_id = len(self.offsets) + 1
+        fen_bytes = (fen or "").encode("ascii")
+        if len(fen_bytes) % 2:
+            fen_bytes += b" "
+        packed = array("H", (move & KEY for move in moves))
+        if not NATIVE_LITTLE_ENDIAN:
+            packed.byteswap()
+        size = RECORD.size + len(fen_bytes) + 2 * len(packed)
+        header = RECORD.pack(size, game_id, RESULTS.index(result), len(packed), len(fen_bytes))
+
+        self.file.seek(0, os.SEEK_END)
+        offset = self.file.tell()
+        self.file.write(header + fen_bytes + packed.tobytes())
+        self.file.flush()
+        self.offsets.append(offset)
+        self.write_index(array("Q", [offset]))
+        return game_id
+
+    def read(self, offset: int) -> GameRecord:
+        if offset + RECORD.size > self.mapped_size or offset + self.record_size(offset) > self.mapped_size:
+            self.remap()
+        size, game_id, result, plies, fen_length = RECORD.unpack_from(self.map, offset)
+        start = offset + RECORD.size
+        fen = bytes(self.map[start:start + fen_length]).decode("ascii").strip() or None
+        start += fen_length
+        moves = memoryview(self.map)[start:start + 2 * plies].cast("H")
+        if not NATIVE_LITTLE_ENDIAN:
+            moves = array("H", moves)
+            moves.byteswap()
+        return GameRecord(game_id, RESULTS[result], fen, moves)
+
+    def get(self, game_id: int) -> GameRecord:
+        """
+        The game with this id. Raises KeyError if there is none
+        """
+        if not 1 <= game_id <= len(self.offsets):
+            raise KeyError(game_id)
+        return self.read(self.offsets[game_id - 1])
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __iter__(self) -> Iterator[GameRecord]:
+        for offset in self.offsets:
+            yield self.read(offset)
+
+    def close(self) -> None:
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass  # records are still being used, the map is freed with them
+            self.map = None
+        self.file.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def import_pgn(pgn_path: str, database: GameDatabase) -> tuple:
+    """
+    Adds the legal games of a PGN file to the database.
+    Returns (games added, games skipped)
+    """
+    from Engine.pgn import parse_san, read_games
+    from Errors.errors import InvalidMove, KingMissing
+
+    added = skipped = 0
+    with open(pgn_path, encoding="utf-8", errors="replace") as lines:
+        for pgn_game in read_games(lines):
+            fen = pgn_game.headers.get("FEN")
+            try:
+                game = Game.from_fen(fen, backend="bitboard") if fen else Game(backend="bitboard")
+                moves = []
+                for san in pgn_game.moves:
+                    move = parse_san(game, san)
+                    moves.append(move)
+                    game.make_move(move)
+            except (InvalidMove, KingMissing, ValueError):
+                skipped += 1
+                continue
+            result = pgn_game.result if pgn_game.result in RESULTS else "*"
+            database.append(moves, result, fen)
+            added += 1
+    return added, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Binary game database tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_command = commands.add_parser("import", help="add the games of a PGN file")
+    import_command.add_argument("pgn")
+    import_command.add_argument("database")
+    stats_command = commands.add_parser("stats", help="count and replay every game")
+    stats_command.add_argument("database")
+    args = parser.parse_args()
+
+    with GameDatabase(args.database) as database:
+        start = time.perf_counter()
+        if args.command == "import":
+            added, skipped = import_pgn(args.pgn, database)
+            elapsed = time.perf_counter() - start
+            print(f"added {added} games, skipped {skipped} in {elapsed:.2f} s")
+            print(f"PGN {os.path.getsize(args.pgn)} bytes, database {os.path.getsize(args.database)} bytes")
+        else:
+            plies = sum(len(record.moves) for record in database)
+            scanned = time.perf_counter() - start
+            for record in database:
+                record.replay(backend="bitboard")
+            replayed = time.perf_counter() - start - scanned
+            print(
+                f"{len(database)} games, {plies} plies, {os.path.getsize(args.database)} bytes\n"
+                f"scanned in {scanned:.3f} s, replayed in {replayed:.2f} s"
+            )
+
+
+if __name__ == "__main__":
+    main()
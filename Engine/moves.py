@@ -0,0 +1,112 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from typing import Optional
+
+
+"""
+Integer moves
+
+A move is one int:
+
+    bits 0-5    from square
+    bits 6-11   to square
+    bits 12-14  promotion (index in PROMOTIONS, 0 for none)
+    bit 15      CAPTURE
+    bit 16      CASTLING (a king move of two squares)
+    bit 17      EN_PASSANT (also a CAPTURE)
+
+Squares are numbered like the board, square = y * 8 + x with a8 = 0 and
+h1 = 63. The flags are filled in by move generation and only describe the
+move; Game.make_move works them out from the board, so a move without
+flags (e.g. read from a file) plays the same. Moves are compared by their
+KEY bits when the flags may be missing, see Game.legal_move.
+
+Text is only made or read at the edges: square_name / parse_square for
+coordinates like "e4" and move_name / parse_move_name for long algebraic
+moves like "e7e8q".
+"""
+
+Move = int
+
+PROMOTIONS = (None, "Q", "R", "B", "N")
+PROMOTION_BITS = {piece: index << 12 for index, piece in enumerate(PROMOTIONS)}
+QUEEN_PROMOTION = PROMOTION_BITS["Q"]
+CAPTURE = 1 << 15
+CASTLING = 1 << 16
+EN_PASSANT = 1 << 17
+KEY = (1 << 15) - 1  # from, to and promotion, what Engine.gamedb stores
+FROM_TO = (1 << 12) - 1
+PROMOTION_MASK = 7 << 12
+
+FILES = "abcdefgh"
+
+
+def encode(from_sq: int, to_sq: int, promotion: Optional[str] = None, flags: int = 0) -> Move:
+    return from_sq | to_sq << 6 | PROMOTION_BITS[promotion] | flags
+
+
+def from_square(move: Move) -> int:
+    return move & 63
+
+
+def to_square(move: Move) -> int:
+    return move >> 6 & 63
+
+
+def promotion(move: Move) -> Optional[str]:
+    return PROMOTIONS[move >> 12 & 7]
+
+
+def square_name(sq: int) -> str:
+    """
+    Coordinates of a square, e.g. 0 -> "a8", 63 -> "h1"
+    """
+    return f"{FILES[sq & 7]}{8 - (sq >> 3)}"
+
+
+def parse_square(name: str) -> int:
+    """
+    The square for coordinates like "e4". Raises ValueError
+    """
+    if len(name) != 2 or name[0] not in FILES or name[1] not in "12345678":
+        raise ValueError(f"Cannot read square {name!r}")
+    return (8 - int(name[1])) * 8 + FILES.index(name[0])
+
+
+def move_name(move: Move) -> str:
+    """
+    Long algebraic name of a move, e.g. "e2e4" or "e7e8q"
+    """
+    name = square_name(move & 63) + square_name(move >> 6 & 63)
+    piece = PROMOTIONS[move >> 12 & 7]
+    return name + piece.lower() if piece else name
+
+
+def parse_move_name(name: str) -> Move:
+    """
+    The move (without flags) for a long algebraic name like "e7e8q", the
+    inverse of move_name. Raises ValueError
+    """
+    if len(name) not in (4, 5) or (len(name) == 5 and name[4] not in "qrbn"):
+        raise ValueError(f"Cannot read move {name!r}")
+    try:
+        from_sq, to_sq = parse_square(name[:2]), parse_square(name[2:4])
+    except ValueError:
+        raise ValueError(f"Cannot read move {name!r}") from None
+    return encode(from_sq, to_sq, name[4].upper() if len(name) == 5 else None)
@@ -0,0 +1,184 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import sys
+import time
+from typing import Dict, List
+
+from Engine.game import Game
+from Engine.moves import PROMOTION_BITS, PROMOTION_MASK, Move, move_name
+
+
+"""
+Perft (move path enumeration)
+
+Counts the leaf nodes of the legal move tree to a fixed depth. The counts
+for the standard positions below are well known, so any difference means
+a move generation bug. `--divide` splits the count per root move, which
+narrows a bug down to a single line when compared with another engine.
+`--backend mailbox` tests the nested list move generator instead of the
+bitboard one, and `--backend both` runs both and checks that they agree.
+
+Usage:
+    python -m Engine.perft                      # every position, depth 3
+    python -m Engine.perft --position kiwipete --depth 4
+    python -m Engine.perft --fen "<fen>" --depth 2 --divide
+    python -m Engine.perft --backend both
+"""
+
+# name: (FEN, node counts for depth 1, 2, ...)
+POSITIONS = {
+    "start": (
+        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+        [20, 400, 8902, 197281, 4865609],
+    ),
+    "kiwipete": (
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        [48, 2039, 97862, 4085603],
+    ),
+    "endgame": (
+        "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        [14, 191, 2812, 43238, 674624],
+    ),
+    "promotions": (
+        "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        [6, 264, 9467, 422333],
+    ),
+    "talkchess": (
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        [44, 1486, 62379, 2103487],
+    ),
+    "middlegame": (
+        "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        [46, 2079, 89890, 3894594],
+    ),
+}
+
+
+def legal_moves(game: Game) -> List[Move]:
+    """
+    Every legal move with the game's backend. The mailbox backend only
+    makes moves per piece (Game.get_valid_moves) and lists a promotion
+    once, so it is expanded to all four pieces here
+    """
+    if game.backend == "bitboard":
+        return game.generate_legal_moves()
+    moves = []
+    for sq in range(64):
+        if game.board[sq // 8][sq % 8][0] != game.turn:
+            continue
+        for move in game.get_valid_moves(sq):
+            if move & PROMOTION_MASK:
+                moves += [move & ~PROMOTION_MASK | bits for bits in PROMOTION_BITS.values() if bits]
+            else:
+                moves.append(move)
+    return moves
+
+
+def perft(game: Game, depth: int) -> int:
+    """
+    Counts the leaf nodes `depth` plies below the current position
+    """
+    moves = legal_moves(game)
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    for move in moves:
+        game.make_move(move)
+        nodes += perft(game, depth - 1)
+        game.unmake_move()
+    return nodes
+
+
+def divide(game: Game, depth: int) -> Dict[str, int]:
+    """
+    Perft split by root move: {move name: leaf nodes below it}
+    """
+    counts = {}
+    for move in legal_moves(game):
+        game.make_move(move)
+        counts[move_name(move)] = perft(game, depth - 1)
+        game.unmake_move()
+    return counts
+
+
+def run(name: str, fen: str, depth: int, expected: int | None, show_divide: bool, backend: str) -> int:
+    """
+    Runs and prints one perft and returns the node count
+    """
+    game = Game.from_fen(fen, backend=backend)
+    start = time.perf_counter()
+    if show_divide:
+        counts = divide(game, depth)
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(game, depth)
+    elapsed = time.perf_counter() - start
+
+    if show_divide:
+        for move, count in sorted(counts.items()):
+            print(f"  {move}: {count}")
+    status = ""
+    if expected is not None:
+        status = "ok" if nodes == expected else f"MISMATCH (expected {expected})"
+    print(
+        f"{name:<12} {backend:<8} depth {depth}  {nodes:>10} nodes  {elapsed:8.2f} s"
+        f"  {nodes / max(elapsed, 1e-9):10.0f} nodes/s  {status}"
+    )
+    return nodes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft move generation test and benchmark")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--position", choices=sorted(POSITIONS), help="only run this standard position")
+    parser.add_argument("--fen", help="run a custom position instead")
+    parser.add_argument("--divide", action="store_true", help="print the count for each root move")
+    parser.add_argument(
+        "--backend", choices=("bitboard", "mailbox", "both"), default="bitboard",
+        help="move generator to test; both also checks that they agree"
+    )
+    args = parser.parse_args()
+    if args.depth < 1:
+        parser.error("--depth must be at least 1")
+
+    if args.fen:
+        jobs = [("custom", args.fen, None)]
+    else:
+        names = [args.position] if args.position else list(POSITIONS)
+        jobs = []
+        for name in names:
+            fen, counts = POSITIONS[name]
+            expected = counts[args.depth - 1] if args.depth <= len(counts) else None
+            jobs.append((name, fen, expected))
+
+    backends = ("bitboard", "mailbox") if args.backend == "both" else (args.backend,)
+    all_ok = True
+    for name, fen, expected in jobs:
+        counts = [run(name, fen, args.depth, expected, args.divide, backend) for backend in backends]
+        if expected is not None and any(nodes != expected for nodes in counts):
+            all_ok = False
+        if len(set(counts)) > 1:
+            print(f"{name:<12} the backends disagree: {counts}")
+            all_ok = False
+    sys.exit(0 if all_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+from collections import deque
+import multiprocessing
+import os
+import re
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from Engine.game import Game
+from Engine.moves import CASTLING, Move, PROMOTIONS, parse_square
+from Errors.errors import InvalidMove, KingMissing
+
+
+"""
+PGN reading and game replay
+
+read_games parses PGN text one line at a time and yields each game as soon
+as it ends, so archives of any size are read in constant memory. Comments,
+variations and annotations are skipped; only the main line is kept.
+replay plays a game's SAN moves through Game, which checks every move is
+legal, and validate_games does that for many games across processes.
+
+Usage: python -m Engine.pgn games.pgn [--processes 4] [--fens final.txt]
+"""
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+HEADER_RE = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+TOKEN_RE = re.compile(r"[{}();]|\$\d+|\d+\.+|1-0|0-1|1/2-1/2|\*|[^\s{}();$]+")
+SAN_RE = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+
+
+class PgnGame:
+    """
+    One game read from a PGN file: its tag pairs, the SAN moves of the main
+    line and the result token ("1-0", "0-1", "1/2-1/2" or "*")
+    """
+
+    def __init__(self, headers: Dict[str, str], moves: List[str], result: str):
+        self.headers = headers
+        self.moves = moves
+        self.result = result
+
+    def __repr__(self):
+        return (
+            f"PgnGame({self.headers.get('White', '?')} - {self.headers.get('Black', '?')}, "
+            f"{len(self.moves)} plies, {self.result})"
+        )
+
+
+def read_games(lines: Iterable[str]) -> Iterator[PgnGame]:
+    """
+    Yields the games in PGN text, given as an iterable of lines (e.g. an
+    open file)
+    """
+    headers, moves, result = {}, [], "*"
+    in_comment = False  # inside { }, which may span lines
+    variation_depth = 0
+    in_movetext = False
+
+    for line in lines:
+        if in_comment:
+            end = line.find("}")
+            if end < 0:
+                continue
+            line, in_comment = line[end + 1:], False
+        stripped = line.strip()
+        if stripped.startswith("%"):
+            continue  # escape line
+        if stripped.startswith("[") and variation_depth == 0:
+            if in_movetext:
+                # A new game started without the last one ending in a result
+                yield PgnGame(headers, moves, result)
+                headers, moves, result, in_movetext = {}, [], "*", False
+            match = HEADER_RE.match(stripped)
+            if match:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+            continue
+
+        position = 0
+        while True:
+            if in_comment:
+                end = line.find("}", position)
+                if end < 0:
+                    break
+                position, in_comment = end + 1, False
+            match = TOKEN_RE.search(line, position)
+            if match is None:
+                break
+            token = match.group()
+            position = match.end()
+            in_movetext = True
+            if token == "{":
+                in_comment = True
+            elif token == ";":
+                break  # comment to the end of the line
+            elif token == "(":
+                variation_depth += 1
+            elif token == ")":
+                variation_depth = max(variation_depth - 1, 0)
+            elif variation_depth or token[0] == "$" or token[0].isdigit() and token[-1] == ".":
+                continue
+            elif token in RESULTS:
+                yield PgnGame(headers, moves, token)
+                headers, moves, result, in_movetext = {}, [], "*", False
+            else:
+                moves.append(token)
+
+    if in_movetext or headers:
+        yield PgnGame(headers, moves, result)
+
+
+def parse_san(game: Game, san: str) -> Move:
+    """
+    Finds the legal move of the side to move written as `san`, e.g. "Nbd7",
+    "exd8=Q+" or "O-O". Raises InvalidMove if there is no such move or it
+    is ambiguous
+    """
+    text = san.rstrip("+#!?")
+    moves = game.generate_legal_moves()
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        king = game.king_squares[game.turn]
+        castling = king | (king + (2 if len(text) == 3 else -2)) << 6 | CASTLING
+        if castling in moves:
+            return castling
+        raise InvalidMove(f"Illegal move {san}")
+
+    match = SAN_RE.match(text)
+    if match is None:
+        raise InvalidMove(f"Cannot read move {san!r}")
+    kind, from_file, from_rank, target, promotion = match.groups()
+    kind = kind or "P"
+    to_sq = parse_square(target)
+    if kind == "P" and to_sq // 8 in (0, 7) and promotion is None:
+        raise InvalidMove(f"Promotion piece missing in {san}")
+
+    board = game.board
+    promotion_index = PROMOTIONS.index(promotion)
+    candidates = [
+        move for move in moves
+        if move >> 6 & 63 == to_sq and move >> 12 & 7 == promotion_index
+        and board[(move & 63) // 8][move & 7][1] == kind
+        and (from_file is None or move & 7 == ord(from_file) - 97)
+        and (from_rank is None or (move & 63) // 8 == 8 - int(from_rank))
+    ]
+    if len(candidates) != 1:
+        raise InvalidMove(f"{'Ambiguous' if candidates else 'Illegal'} move {san}")
+    return candidates[0]
+
+
+def replay(pgn_game: PgnGame) -> Game:
+    """
+    Plays the game's moves from its starting position (the FEN tag, if
+    any) and returns the final position. Raises InvalidMove at the first
+    illegal move, with its move number
+    """
+    fen = pgn_game.headers.get("FEN")
+    game = Game.from_fen(fen, backend="bitboard") if fen else Game(backend="bitboard")
+    for san in pgn_game.moves:
+        try:
+            move = parse_san(game, san)
+        except InvalidMove as error:
+            number = game.fullmove_number
+            raise InvalidMove(f"{number}{'.' if game.turn == 'W' else '...'} {error}") from None
+        game.make_move(move)
+    return game
+
+
+def validate(pgn_game: PgnGame) -> Tuple[bool, int, str]:
+    """
+    Replays a game. Returns (legal, plies, final FEN or the error)
+    """
+    try:
+        return True, len(pgn_game.moves), replay(pgn_game).to_fen()
+    except (InvalidMove, KingMissing, ValueError) as error:
+        return False, len(pgn_game.moves), str(error)
+
+
+def _validate_batch(batch: List[PgnGame]) -> List[Tuple[bool, int, str]]:
+    return [validate(pgn_game) for pgn_game in batch]
+
+
+def validate_games(
+        games: Iterable[PgnGame],
+        processes: Optional[int] = None,
+        batch_size: int = 64
+    ) -> Iterator[Tuple[PgnGame, Tuple[bool, int, str]]]:
+    """
+    Yields (game, validate(game)) for every game, in order, replaying them
+    in `processes` worker processes (all cores by default). Games are sent
+    in batches, and only a few batches per process are read ahead, so a
+    generator from read_games keeps memory use constant
+    """
+    if processes == 1:
+        for pgn_game in games:
+            yield pgn_game, validate(pgn_game)
+        return
+
+    with multiprocessing.Pool(processes) as pool:
+        pending = deque()
+        limit = 2 * (processes or os.cpu_count() or 1)
+        batch = []
+        for pgn_game in games:
+            batch.append(pgn_game)
+            if len(batch) < batch_size:
+                continue
+            pending.append((batch, pool.apply_async(_validate_batch, (batch,))))
+            batch = []
+            while len(pending) >= limit:
+                done, results = pending.popleft()
+                yield from zip(done, results.get())
+        if batch:
+            pending.append((batch, pool.apply_async(_validate_batch, (batch,))))
+        while pending:
+            done, results = pending.popleft()
+            yield from zip(done, results.get())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that every game in a PGN file is legal")
+    parser.add_argument("path")
+    parser.add_argument("--processes", type=int, help="worker processes (all cores by default)")
+    parser.add_argument("--fens", help="write the final position of every game to this file")
+    args = parser.parse_args()
+
+    fens = open(args.fens, "w") if args.fens else None
+    count = invalid = plies = 0
+    start = time.perf_counter()
+    with open(args.path, encoding="utf-8", errors="replace") as lines:
+        for pgn_game, (legal, game_plies, detail) in validate_games(read_games(lines), args.processes):
+            count += 1
+            plies += game_plies
+            if not legal:
+                invalid += 1
+                print(f"game {count} ({pgn_game.headers.get('Event', '?')}): {detail}")
+            if fens is not None:
+                fens.write(f"{detail if legal else '-'}\n")
+    elapsed = time.perf_counter() - start
+    if fens is not None:
+        fens.close()
+    print(
+        f"{count} games, {invalid} invalid, {plies} plies in {elapsed:.2f} s"
+        f"  ({count / max(elapsed, 1e-9):.0f} games/s, {plies / max(elapsed, 1e-9):.0f} plies/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
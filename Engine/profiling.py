@@ -0,0 +1,242 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import atexit
+import functools
+import importlib
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+"""
+Profiling hooks
+
+Counters and timers for the hot paths of the rules engine. Nothing in the
+engine calls this module: enable() wraps the methods listed in HOOKS on
+their classes and disable() puts the originals back, so while profiling is
+off the engine runs exactly the code it would without it.
+
+    from Engine import profiling
+    profiling.enable(trace=True)
+    ...                                    # play some moves
+    print(profiling.summary())             # calls and time per hook
+    profiling.write_trace("trace.json")    # open in chrome://tracing or Perfetto
+
+Programs call enable_from_environment() at startup, so profiling can be
+switched on without changing code: CHESS_PROFILE=1 logs a summary after
+every move (see log_summary) and CHESS_TRACE=trace.json also records a
+trace, written when the program exits.
+"""
+
+log = logging.getLogger(__name__)
+
+# (module, class, method, stat name, timed). Untimed hooks only count calls,
+# for methods so cheap that reading the clock would dwarf them
+HOOKS = [
+    ("Engine.game", "Game", "move", "move", True),
+    ("Engine.game", "Game", "get_valid_moves", "movegen.piece", True),
+    ("Engine.game", "Game", "generate_legal_moves", "movegen.legal", True),
+    ("Engine.game", "Game", "is_in_check", "is_in_check", True),
+    ("Engine.game", "Game", "outcome", "mate_detection", True),
+    ("Engine.game", "Game", "make_move", "make_move", False),
+    ("Engine.game", "Game", "unmake_move", "unmake_move", False),
+    ("Engine.game", "Game", "attacked_squares", "attacked_squares", False),
+    ("Engine.bitboard", "Bitboards", "attack_map", "attack_map", True),
+    ("Engine.search", "Searcher", "search", "search", True),
+]
+MAX_EVENTS = 1_000_000  # trace events kept, later ones are counted but dropped
+
+enabled = False
+_originals: List[Tuple[type, str, object]] = []
+_stats: Dict[str, "Stat"] = {}
+_trace: Optional[List[tuple]] = None
+_dropped = 0
+_start = 0.0
+
+
+class Stat:
+    """
+    Calls of one hook and the time spent in them (seconds, 0 for untimed hooks)
+    """
+
+    def __init__(self, timed: bool):
+        self.timed = timed
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __repr__(self):
+        return f"Stat({self.calls} calls, {self.total * 1e3:.3f} ms)"
+
+
+def _record(name: str, stat: Stat, start: float, end: float) -> None:
+    global _dropped
+    elapsed = end - start
+    stat.calls += 1
+    stat.total += elapsed
+    if elapsed > stat.max:
+        stat.max = elapsed
+    if _trace is not None:
+        if len(_trace) < MAX_EVENTS:
+            _trace.append((name, start, elapsed, threading.get_ident()))
+        else:
+            _dropped += 1
+
+
+def _wrap(function, name: str, stat: Stat):
+    if not stat.timed:
+        @functools.wraps(function)
+        def counted(*args, **kwargs):
+            stat.calls += 1
+            return function(*args, **kwargs)
+        return counted
+
+    if inspect.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def timed_async(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                _record(name, stat, start, time.perf_counter())
+        return timed_async
+
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _record(name, stat, start, time.perf_counter())
+    return timed
+
+
+def enable(trace: bool = False) -> None:
+    """
+    Starts counting (and timing) the hooks. trace also records every timed
+    call for write_trace
+    """
+    global enabled, _trace, _start
+    if enabled:
+        disable()
+    for module_name, class_name, method, name, timed in HOOKS:
+        cls = getattr(importlib.import_module(module_name), class_name)
+        original = cls.__dict__[method]
+        stat = _stats.setdefault(name, Stat(timed))
+        _originals.append((cls, method, original))
+        setattr(cls, method, _wrap(original, name, stat))
+    _trace = [] if trace else None
+    _start = time.perf_counter()
+    enabled = True
+
+
+def disable() -> None:
+    """
+    Puts the original methods back. The stats and trace are kept
+    """
+    global enabled
+    while _originals:
+        cls, method, original = _originals.pop()
+        setattr(cls, method, original)
+    enabled = False
+
+
+def reset() -> None:
+    global _dropped
+    for stat in _stats.values():
+        stat.calls, stat.total, stat.max = 0, 0.0, 0.0
+    if _trace is not None:
+        _trace.clear()
+    _dropped = 0
+
+
+def stats() -> Dict[str, Stat]:
+    return dict(_stats)
+
+
+def summary() -> str:
+    """
+    A table of the hooks called since the last reset, most time first
+    """
+    lines = [f"{'hook':<18}{'calls':>10}{'total ms':>12}{'mean us':>10}{'max us':>10}"]
+    ordered = sorted(_stats.items(), key=lambda item: (-item[1].total, -item[1].calls))
+    for name, stat in ordered:
+        if not stat.calls:
+            continue
+        if stat.timed:
+            lines.append(
+                f"{name:<18}{stat.calls:>10}{stat.total * 1e3:>12.2f}"
+                f"{stat.total / stat.calls * 1e6:>10.1f}{stat.max * 1e6:>10.1f}"
+            )
+        else:
+            lines.append(f"{name:<18}{stat.calls:>10}{'-':>12}{'-':>10}{'-':>10}")
+    return "\n".join(lines)
+
+
+def log_summary(label: str = "move") -> None:
+    """
+    Logs the summary since the last call and starts counting again, e.g.
+    once per move. Does nothing while profiling is off
+    """
+    if not enabled:
+        return
+    log.info("%s\n%s", label, summary())
+    for stat in _stats.values():
+        stat.calls, stat.total, stat.max = 0, 0.0, 0.0
+    if _trace is not None and len(_trace) < MAX_EVENTS:
+        _trace.append((label, time.perf_counter(), None, threading.get_ident()))
+
+
+def write_trace(path: str) -> int:
+    """
+    Writes the recorded calls as a Chrome trace (JSON) file and returns
+    the number of events
+    """
+    if _trace is None:
+        raise RuntimeError("Tracing was not enabled, see enable(trace=True)")
+    pid = os.getpid()
+    events = []
+    for name, start, elapsed, thread in _trace:
+        event = {"name": name, "pid": pid, "tid": thread, "ts": (start - _start) * 1e6}
+        if elapsed is None:
+            event.update(ph="i", s="p")  # a marker, see log_summary
+        else:
+            event.update(ph="X", dur=elapsed * 1e6, cat="engine")
+        events.append(event)
+    with open(path, "w") as file:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+    if _dropped:
+        log.warning("%d trace events were dropped (more than %d)", _dropped, MAX_EVENTS)
+    return len(events)
+
+
+def enable_from_environment() -> None:
+    """
+    Enables profiling if CHESS_PROFILE or CHESS_TRACE is set (see above)
+    """
+    trace_path = os.environ.get("CHESS_TRACE")
+    if not (trace_path or os.environ.get("CHESS_PROFILE")):
+        return
+    enable(trace=bool(trace_path))
+    if trace_path:
+        atexit.register(write_trace, trace_path)
@@ -0,0 +1,418 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import time
+from typing import Callable, List, Optional
+
+from Engine.bitboard import popcount
+from Engine.evaluation import PIECE_VALUES, PawnTable, evaluate
+from Engine.game import Game
+from Engine.moves import CAPTURE, FROM_TO, PROMOTION_MASK, PROMOTIONS, QUEEN_PROMOTION, Move, move_name
+
+
+"""
+Computer opponent
+
+Negamax alpha-beta search with iterative deepening, a quiescence search
+over captures, a transposition table and move ordering (transposition
+table move, then captures by MVV-LVA, then killer moves, then the history
+heuristic). Searches stop at a depth, node or time limit, or when
+Searcher.stop() is called from another thread.
+
+Usage: python -m Engine.search [--fen FEN] [--depth N] [--movetime SECONDS]
+"""
+
+MATE = 100000
+MATE_BOUND = MATE - 1000  # scores beyond this are mates
+INFINITY = MATE + 1
+MAX_PLY = 128
+
+# Transposition table entry flags
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class SearchStopped(Exception):
+    """
+    Raised inside the search when a limit is hit or stop() was called
+    """
+
+
+def score_to_tt(score: int, ply: int) -> int:
+    """
+    Search scores give mates in plies from the root (MATE - ply). Tables
+    store them in plies from the position instead, so a position reached
+    at another ply (or in another search) reads the right distance back
+    """
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_tt(score: int, ply: int) -> int:
+    """
+    The inverse of score_to_tt, for a position `ply` plies from the root
+    """
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class TranspositionTable:
+    """
+    Remembers search results per position (Zobrist key). When full, the
+    table is cleared. Entries are (depth, score, flag, move); scores are
+    stored with score_to_tt, so probe and store need the position's ply
+    """
+
+    def __init__(self, max_entries: int = 1 << 20):
+        self.max_entries = max_entries
+        self.entries = {}
+
+    def probe(self, key: int, ply: int = 0) -> Optional[tuple]:
+        entry = self.entries.get(key)
+        if entry is not None and abs(entry[1]) > MATE_BOUND:
+            return entry[0], score_from_tt(entry[1], ply), entry[2], entry[3]
+        return entry
+
+    def store(self, key: int, depth: int, score: int, flag: int, move: Optional[Move], ply: int = 0) -> None:
+        score = score_to_tt(score, ply)
+        entries = self.entries
+        old = entries.get(key)
+        if old is not None and old[0] > depth and flag != EXACT:
+            return  # keep the deeper result
+        if old is None and len(entries) >= self.max_entries:
+            entries.clear()
+        entries[key] = (depth, score, flag, move)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+class SearchResult:
+    """
+    What a search found: the best move, its score (centipawns for the side
+    to move, or MATE - plies), the principal variation and statistics
+    """
+
+    def __init__(self, move: Optional[Move], score: int, depth: int, pv: List[Move], nodes: int, elapsed: float):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.pv = pv
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+    @property
+    def nps(self) -> int:
+        return int(self.nodes / self.elapsed) if self.elapsed > 0 else 0
+
+    def __repr__(self):
+        return (
+            f"SearchResult(move={self.move}, score={self.score}, depth={self.depth}, "
+            f"nodes={self.nodes}, nps={self.nps})"
+        )
+
+
+class Searcher:
+    """
+    Searches Game positions for the best move. The same Searcher can be
+    reused between moves, so its transposition table and history carry over.
+
+    tablebases: an optional Engine.tablebase.Tablebases, probed for exact
+    results once few enough pieces are left
+    """
+
+    def __init__(self, tt: Optional[TranspositionTable] = None, tablebases=None):
+        self.tt = tt if tt is not None else TranspositionTable()
+        self.tablebases = tablebases
+        self.pawn_table = PawnTable()
+        self.history = {}
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.nodes = 0
+        self.stopped = False
+        self.deadline = None
+        self.node_limit = None
+
+    def stop(self) -> None:
+        """
+        Asks a running search to return as soon as possible. Safe to call
+        from another thread
+        """
+        self.stopped = True
+
+    def search(
+            self,
+            game: Game,
+            depth: Optional[int] = None,
+            movetime: Optional[float] = None,
+            nodes: Optional[int] = None,
+            info_callback: Optional[Callable[[SearchResult], None]] = None
+        ) -> SearchResult:
+        """
+        Iterative deepening search of `game` (which is left as it was).
+
+        depth: deepest iteration to run
+        movetime: seconds to think for
+        nodes: rough node budget
+        info_callback: called with a SearchResult after every finished iteration
+        With no limits the search runs to depth 64 or until stop() is called.
+        """
+        start = time.perf_counter()
+        self.stopped = False
+        self.nodes = 0
+        self.deadline = start + movetime if movetime is not None else None
+        self.node_limit = nodes
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        max_depth = depth if depth is not None else 64
+
+        moves = game.generate_legal_moves()
+        result = SearchResult(moves[0] if moves else None, 0, 0, [], 0, 0.0)
+        if len(moves) <= 1:
+            return result
+        if self.tablebases is not None:
+            found = self.tablebases.best_move(game)
+            if found is not None:
+                move, (outcome, plies) = found
+                score = outcome * (MATE - plies) if outcome else 0
+                return SearchResult(move, score, 0, [move], 0, time.perf_counter() - start)
+
+        for iteration in range(1, max_depth + 1):
+            try:
+                score = self.negamax(game, iteration, -INFINITY, INFINITY, 0)
+            except SearchStopped:
+                break
+            pv = self.principal_variation(game, iteration)
+            result = SearchResult(
+                pv[0] if pv else result.move, score, iteration, pv,
+                self.nodes, time.perf_counter() - start
+            )
+            if info_callback is not None:
+                info_callback(result)
+            if abs(score) > MATE_BOUND:
+                break  # a forced mate was found, deeper searches won't change it
+            if self.deadline is not None and time.perf_counter() - start > (self.deadline - start) / 2:
+                break  # the next iteration would very likely not finish
+
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def check_limits(self) -> None:
+        if self.stopped:
+            raise SearchStopped
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchStopped
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchStopped
+
+    def negamax(self, game: Game, depth: int, alpha: int, beta: int, ply: int) -> int:
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_limits()
+
+        # A draw by the fifty-move rule, or a repetition: once is enough,
+        # the side that could avoid it would repeat again
+        if ply and (game.halfmove_clock >= 100 or game.repetitions[game.hash] > 1):
+            return 0
+        if ply and self.tablebases is not None and popcount(game.bitboards.occupied) <= 4:
+            found = self.tablebases.probe(game)
+            if found is not None:
+                outcome, plies = found
+                return outcome * (MATE - ply - plies) if outcome else 0
+        if depth <= 0:
+            return self.quiescence(game, alpha, beta, ply)
+
+        original_alpha = alpha
+        key = game.hash
+        tt_move = None
+        entry = self.tt.probe(key, ply)
+        if entry is not None:
+            entry_depth, entry_score, flag, tt_move = entry
+            if ply and entry_depth >= depth:
+                if flag == EXACT:
+                    return entry_score
+                if flag == LOWER and entry_score >= beta:
+                    return entry_score
+                if flag == UPPER and entry_score <= alpha:
+                    return entry_score
+
+        moves = game.generate_legal_moves()
+        if not moves:
+            return -(MATE - ply) if self.in_check(game) else 0
+
+        best_score, best_move = -INFINITY, None
+        for move in self.order_moves(game, moves, tt_move, ply):
+            game.make_move(move)
+            try:
+                score = -self.negamax(game, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                game.unmake_move()
+
+            if score > best_score:
+                best_score, best_move = score, move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if not move & CAPTURE:
+                    killers = self.killers[ply]
+                    if killers[0] != move:
+                        killers[0], killers[1] = move, killers[0]
+                    self.history[move & FROM_TO] = self.history.get(move & FROM_TO, 0) + depth * depth
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.tt.store(key, depth, best_score, flag, best_move, ply)
+        return best_score
+
+    def quiescence(self, game: Game, alpha: int, beta: int, ply: int) -> int:
+        """
+        Searches captures only, so the evaluation is not taken in the middle
+        of an exchange. When in check every evasion is searched instead
+        """
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_limits()
+
+        if ply >= MAX_PLY - 1:
+            # Also in check: a long run of checks must not overrun the
+            # killer and PV tables
+            return evaluate(game, self.pawn_table)
+        in_check = self.in_check(game)
+        if not in_check:
+            stand_pat = evaluate(game, self.pawn_table)
+            if stand_pat >= beta:
+                return stand_pat
+            alpha = max(alpha, stand_pat)
+
+        moves = game.generate_legal_moves()
+        if not moves:
+            return -(MATE - ply) if in_check else 0
+        if not in_check:
+            moves = [move for move in moves if move & CAPTURE or move & PROMOTION_MASK == QUEEN_PROMOTION]
+
+        for move in self.order_moves(game, moves, None, ply):
+            game.make_move(move)
+            try:
+                score = -self.quiescence(game, -beta, -alpha, ply + 1)
+            finally:
+                game.unmake_move()
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return alpha
+
+    def in_check(self, game: Game) -> bool:
+        enemy = "B" if game.turn == "W" else "W"
+        return game.bitboards.is_attacked(game.king_squares[game.turn], enemy)
+
+    def order_moves(self, game: Game, moves: List[Move], tt_move: Optional[Move], ply: int) -> List[Move]:
+        board = game.board
+        killers = self.killers[ply] if ply < MAX_PLY else (None, None)
+        history = self.history
+
+        def score(move):
+            if move == tt_move:
+                return 1 << 30
+            if move & CAPTURE:
+                # MVV-LVA: most valuable victim first, then least valuable
+                # attacker (en passant takes a pawn from an empty square)
+                from_sq, to_sq = move & 63, move >> 6 & 63
+                victim = board[to_sq // 8][to_sq % 8][1]
+                attacker = board[from_sq // 8][from_sq % 8][1]
+                return (1 << 20) + PIECE_VALUES.get(victim, 100) * 16 - PIECE_VALUES[attacker] // 10
+            if move >> 12 & 7:
+                return (1 << 20) + PIECE_VALUES[PROMOTIONS[move >> 12 & 7]]
+            if move == killers[0]:
+                return 1 << 19
+            if move == killers[1]:
+                return (1 << 19) - 1
+            return history.get(move & FROM_TO, 0)
+
+        return sorted(moves, key=score, reverse=True)
+
+    def principal_variation(self, game: Game, depth: int) -> List[Move]:
+        """
+        Follows the best moves stored in the transposition table
+        """
+        pv = []
+        seen = set()
+        while len(pv) < depth and game.hash not in seen:
+            seen.add(game.hash)
+            entry = self.tt.probe(game.hash)
+            if entry is None or entry[3] is None or game.legal_move(entry[3]) != entry[3]:
+                break
+            move = entry[3]
+            pv.append(move)
+            game.make_move(move)
+        for _ in pv:
+            game.unmake_move()
+        return pv
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search a position for the best move")
+    parser.add_argument("--fen", default="rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+    parser.add_argument("--depth", type=int)
+    parser.add_argument("--movetime", type=float, help="seconds")
+    parser.add_argument("--nodes", type=int)
+    parser.add_argument("--workers", type=int, default=1, help="search processes (lazy SMP)")
+    parser.add_argument("--book", help="Polyglot opening book to look the position up in first")
+    parser.add_argument("--tablebases", help="directory of endgame tables (see Engine.tablebase)")
+    args = parser.parse_args()
+    if args.depth is None and args.movetime is None and args.nodes is None:
+        args.movetime = 5.0
+
+    def report(result):
+        print(
+            f"depth {result.depth:2d}  score {result.score:6d}  nodes {result.nodes:9d}"
+            f"  nps {result.nps:7d}  pv {' '.join(move_name(move) for move in result.pv)}"
+        )
+
+    game = Game.from_fen(args.fen, backend="bitboard")
+    if args.book:
+        from Engine.polyglot import OpeningBook
+        with OpeningBook(args.book) as book:
+            move = book.choose(game)
+        if move is not None:
+            print(f"bestmove {move_name(move)} (book)")
+            return
+    tablebases = None
+    if args.tablebases:
+        from Engine.tablebase import Tablebases
+        tablebases = Tablebases(args.tablebases)
+    if args.workers > 1:
+        from Engine.smp import ParallelSearcher
+        with ParallelSearcher(args.workers, searcher=Searcher(tablebases=tablebases)) as searcher:
+            result = searcher.search(game, args.depth, args.movetime, args.nodes, report)
+    else:
+        result = Searcher(tablebases=tablebases).search(game, args.depth, args.movetime, args.nodes, report)
+    print(f"bestmove {move_name(result.move) if result.move else '(none)'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+from typing import Dict, Optional
+
+import trio
+
+from Engine import profiling
+from Engine.game import Game
+from Engine.moves import move_name, parse_move_name
+
+
+"""
+Headless game server
+
+Hosts many Games in one process, without the GUI, over TCP. Every request
+and response is one line of JSON:
+
+    {"id": 1, "op": "new"}                              -> {"id": 1, "game": 7, "fen": ...}
+    {"id": 2, "op": "moves", "game": 7}                 -> {"id": 2, "moves": ["e2e4", ...]}
+    {"id": 3, "op": "move", "game": 7, "move": "e2e4"}  -> {"id": 3, "status": "ongoing", "fen": ...}
+    {"id": 4, "op": "state", "game": 7}                 -> {"id": 4, "status": ..., "turn": "B", "fen": ...}
+    {"id": 5, "op": "close", "game": 7}                 -> {"id": 5}
+
+Failed requests are answered with {"id": ..., "error": "..."}; a request
+that hits a bug in the engine gets "internal error" and its game is
+closed, while the other games carry on. Games are
+shared by all connections, so two players can play one game from two
+connections. "status" is "ongoing" or how the game ended, see Game.outcome.
+
+Each connection reads at most `pipeline` requests ahead of the one being
+answered, and answers are only sent as fast as the client reads them, so
+a slow or flooding client is held back by TCP instead of growing queues.
+
+Usage: python -m Engine.server [--port 8765] [--max-games 10000]
+"""
+
+log = logging.getLogger(__name__)
+
+MAX_LINE = 4096  # bytes, longer requests close the connection
+
+
+class RequestError(Exception):
+    """
+    A request that cannot be carried out; sent back as {"error": ...}
+    """
+
+
+class GameServer:
+    """
+    The games hosted by the server and the requests that act on them
+    """
+
+    def __init__(self, max_games: int = 10000, pipeline: int = 16):
+        self.max_games = max_games
+        self.pipeline = pipeline
+        self.games: Dict[int, Game] = {}
+        self.game_ids = itertools.count(1)
+
+    def status(self, game: Game) -> str:
+        outcome = game.outcome()
+        return "ongoing" if outcome is None else outcome[1]
+
+    def get_game(self, request: dict) -> Game:
+        game = self.games.get(request.get("game"))
+        if game is None:
+            raise RequestError(f"No game {request.get('game')!r}")
+        return game
+
+    def handle(self, request: dict) -> dict:
+        """
+        Carries out one request and returns the response (without the id)
+        """
+        op = request.get("op")
+        if op == "new":
+            if len(self.games) >= self.max_games:
+                raise RequestError("Too many games")
+            fen = request.get("fen")
+            if fen is not None and not isinstance(fen, str):
+                raise RequestError("fen must be a string")
+            try:
+                # from_fen also rejects positions that cannot occur in a game,
+                # e.g. one where a king can be captured
+                game = Game.from_fen(fen, backend="bitboard") if fen else Game(backend="bitboard")
+            except ValueError as error:
+                raise RequestError(str(error)) from None
+            game_id = next(self.game_ids)
+            self.games[game_id] = game
+            return {"game": game_id, "fen": game.to_fen()}
+
+        game = self.get_game(request)
+        if op == "moves":
+            return {"moves": [move_name(move) for move in game.generate_legal_moves()]}
+        if op == "move":
+            if game.outcome() is not None:
+                raise RequestError("The game is over")
+            move = game.legal_move(parse_move_name(str(request.get("move"))))
+            if move is None:
+                raise RequestError(f"Illegal move {request.get('move')}")
+            game.make_move(move)
+            return {"status": self.status(game), "fen": game.to_fen()}
+        if op == "state":
+            return {"status": self.status(game), "turn": game.turn, "fen": game.to_fen()}
+        if op == "close":
+            del self.games[request["game"]]
+            return {}
+        raise RequestError(f"Unknown op {op!r}")
+
+    async def serve_connection(self, stream: trio.SocketStream) -> None:
+        requests_send, requests_receive = trio.open_memory_channel(self.pipeline)
+
+        async def read_requests():
+            async with requests_send:
+                buffer = b""
+                while True:
+                    try:
+                        data = await stream.receive_some(65536)
+                    except trio.BrokenResourceError:
+                        data = b""  # the client went away
+                    if not data:
+                        return
+                    buffer += data
+                    *lines, buffer = buffer.split(b"\n")
+                    if len(buffer) > MAX_LINE:
+                        return
+                    for line in lines:
+                        if line.strip():
+                            # Blocks while `pipeline` requests are waiting,
+                            # which stops reading from the socket
+                            await requests_send.send(line)
+
+        async def answer_requests():
+            async with requests_receive:
+                async for line in requests_receive:
+                    request = {}
+                    try:
+                        request = json.loads(line)
+                        if not isinstance(request, dict):
+                            request = {}
+                            raise RequestError("A request must be a JSON object")
+                        response = self.handle(request)
+                    except (RequestError, ValueError, TypeError) as error:
+                        response = {"error": str(error)}
+                    except Exception:
+                        # A bug hit by one game must not take down the
+                        # connection, or the server with every other game
+                        log.exception("Request %r failed", request)
+                        game_id = request.get("game")
+                        if isinstance(game_id, int):
+                            self.games.pop(game_id, None)
+                        response = {"error": "internal error"}
+                    response["id"] = request.get("id")
+                    try:
+                        await stream.send_all(json.dumps(response).encode() + b"\n")
+                    except trio.BrokenResourceError:
+                        return  # the client went away
+                    await trio.sleep(0)  # let other connections run between requests
+
+        async with stream:
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(read_requests)
+                nursery.start_soon(answer_requests)
+
+    async def serve(self, port: int, host: Optional[str] = "127.0.0.1", task_status=trio.TASK_STATUS_IGNORED):
+        await trio.serve_tcp(self.serve_connection, port, host=host, task_status=task_status)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host chess games over TCP (JSON lines)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-games", type=int, default=10000)
+    parser.add_argument("--pipeline", type=int, default=16, help="requests read ahead per connection")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get("CHESS_LOG", "WARNING").upper())
+    profiling.enable_from_environment()
+    server = GameServer(args.max_games, args.pipeline)
+    print(f"Serving on {args.host}:{args.port}")
+    try:
+        trio.run(server.serve, args.port, args.host)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+from multiprocessing import shared_memory
+import random
+import time
+from typing import Callable, Optional
+
+from Engine.game import Game
+from Engine.moves import FROM_TO, Move
+from Engine.search import EXACT, SearchResult, Searcher, SearchStopped, score_from_tt, score_to_tt
+
+
+"""
+Parallel search (lazy SMP)
+
+A CPython process can only search on one core, so ParallelSearcher runs
+helper processes that search the same root position at the same time as
+the main search. They share nothing but a transposition table in shared
+memory: results one process stores cut the trees of the others, which
+makes the main search reach each depth sooner.
+
+Each helper has its own pipes for jobs and results and polls a lock-free
+stop flag, so a helper that dies (killed, or an exception in _helper_main)
+holds no lock the others need: its result pipe reports end of file and the
+main search carries on without it.
+"""
+
+log = logging.getLogger(__name__)
+
+MOVE_BITS = (1 << 18) - 1
+SCORE_OFFSET = 1 << 31
+
+
+class SharedTranspositionTable:
+    """
+    A fixed size transposition table in shared memory, with the same
+    probe/store interface as Engine.search.TranspositionTable.
+
+    Each slot is two 64-bit words: key ^ data and data. Slots are written
+    without locks; a slot half overwritten by another process fails the
+    key check on probe and is treated as empty. Mate scores are stored in
+    plies from the position, see Engine.search.score_to_tt.
+    data = score + 2**31 (32 bits) | depth << 32 (8 bits) | flag << 40 (2 bits)
+           | move << 42 (the Engine.moves int, 18 bits, then a has move bit)
+    """
+
+    def __init__(self, entries: int = 1 << 20, name: Optional[str] = None):
+        """
+        Creates a new table of `entries` slots, or attaches to the table
+        called `name` made by another process
+        """
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=entries * 16)
+            self.owner = True
+        else:
+            # Helpers are multiprocessing children and share the creator's
+            # resource tracker, so attaching does not register it twice
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        self.words = self.shm.buf.cast("Q")
+        self.slots = len(self.words) // 2
+
+    def probe(self, key: int, ply: int = 0) -> Optional[tuple]:
+        index = (key % self.slots) * 2
+        data = self.words[index + 1]
+        if self.words[index] ^ data != key or not data:
+            return None
+        move = None
+        if data >> 60 & 1:
+            move = data >> 42 & MOVE_BITS
+        score = score_from_tt((data & 0xFFFFFFFF) - SCORE_OFFSET, ply)
+        return data >> 32 & 255, score, data >> 40 & 3, move
+
+    def store(self, key: int, depth: int, score: int, flag: int, move: Optional[Move], ply: int = 0) -> None:
+        index = (key % self.slots) * 2
+        old = self.words[index + 1]
+        if self.words[index] ^ old == key and (old >> 32 & 255) > depth and flag != EXACT:
+            return  # keep the deeper result
+        data = (score_to_tt(score, ply) + SCORE_OFFSET) | min(depth, 255) << 32 | flag << 40
+        if move is not None:
+            data |= (move | 1 << 18) << 42
+        self.words[index] = key ^ data
+        self.words[index + 1] = data
+
+    def clear(self) -> None:
+        self.shm.buf[:] = bytes(len(self.shm.buf))
+
+    def close(self) -> None:
+        self.words.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class _HelperSearcher(Searcher):
+    """
+    Searcher for helper processes. It stops when the main search sets the
+    shared stop flag, and starts with a little random history so it orders
+    quiet moves differently from the other searchers
+    """
+
+    def __init__(self, tt: SharedTranspositionTable, stop_flag, seed: int):
+        super().__init__(tt)
+        self.stop_flag = stop_flag
+        self.random = random.Random(seed)
+
+    def search(self, game, depth=None, movetime=None, nodes=None, info_callback=None):
+        self.history = {move & FROM_TO: self.random.randrange(8) for move in game.generate_legal_moves()}
+        return super().search(game, depth, movetime, nodes, info_callback)
+
+    def check_limits(self) -> None:
+        if self.stop_flag.value:
+            raise SearchStopped
+        super().check_limits()
+
+
+def _helper_main(tt_name: str, seed: int, jobs, results, stop_flag) -> None:
+    """
+    Helper process loop: search every (fen, repetitions, depth, movetime,
+    nodes) job received on `jobs` until told to stop, then send the node
+    count on `results`
+    """
+    tt = SharedTranspositionTable(name=tt_name)
+    searcher = _HelperSearcher(tt, stop_flag, seed)
+    while True:
+        try:
+            job = jobs.recv()
+        except EOFError:
+            job = None  # the main process went away
+        if job is None:
+            break
+        fen, repetitions, depth, movetime, nodes = job
+        game = Game.from_fen(fen, backend="bitboard")
+        game.repetitions = repetitions
+        # Helpers go one ply further so they are still useful when the main
+        # search starts its last iteration
+        result = searcher.search(game, depth and depth + 1, movetime, nodes)
+        results.send(result.nodes)
+    tt.close()
+
+
+class ParallelSearcher:
+    """
+    Runs a Searcher in this process plus `workers - 1` helper processes over
+    a shared transposition table. Has the same search()/stop() interface as
+    Searcher; with workers=1 it is a plain Searcher on the shared table.
+    Call close() when done to stop the helpers and free the table.
+
+    searcher: the Searcher to run in this process, if a subclass is needed
+    (its transposition table is replaced by the shared one)
+    """
+
+    def __init__(self, workers: int = 1, tt_entries: int = 1 << 20, searcher: Optional[Searcher] = None):
+        context = multiprocessing.get_context()
+        self.tt = SharedTranspositionTable(tt_entries)
+        self.searcher = searcher if searcher is not None else Searcher()
+        self.searcher.tt = self.tt
+        self.stop_flag = context.RawValue("b", 0)
+        self.helpers = {}  # seed: (process, job pipe, result pipe)
+        for seed in range(1, workers):
+            job_reader, job_writer = context.Pipe(duplex=False)
+            result_reader, result_writer = context.Pipe(duplex=False)
+            process = context.Process(
+                target=_helper_main,
+                args=(self.tt.name, seed, job_reader, result_writer, self.stop_flag),
+                daemon=True,
+            )
+            process.start()
+            # Only the helper keeps its ends open, so its death closes them
+            job_reader.close()
+            result_writer.close()
+            self.helpers[seed] = (process, job_writer, result_reader)
+
+    def stop(self) -> None:
+        self.searcher.stop()
+
+    def search(
+            self,
+            game: Game,
+            depth: Optional[int] = None,
+            movetime: Optional[float] = None,
+            nodes: Optional[int] = None,
+            info_callback: Optional[Callable[[SearchResult], None]] = None
+        ) -> SearchResult:
+        """
+        See Searcher.search. Node counts include the helpers' nodes
+        """
+        start = time.perf_counter()
+        self.stop_flag.value = 0
+        job = (game.to_fen(), game.repetitions, depth, movetime, nodes)
+        for seed, (_, jobs, _) in list(self.helpers.items()):
+            try:
+                jobs.send(job)
+            except OSError:
+                self.drop_helper(seed)
+        try:
+            result = self.searcher.search(game, depth, movetime, nodes, info_callback)
+        finally:
+            self.stop_flag.value = 1
+            helper_nodes = self.collect_nodes()
+        result.nodes += helper_nodes
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def collect_nodes(self) -> int:
+        """
+        Waits for every helper to send its node count after a search.
+        Helpers that died are dropped instead of waited for
+        """
+        waiting = {results: seed for seed, (_, _, results) in self.helpers.items()}
+        nodes = 0
+        while waiting:
+            for results in wait(list(waiting)):
+                seed = waiting.pop(results)
+                try:
+                    nodes += results.recv()
+                except EOFError:
+                    self.drop_helper(seed)
+        return nodes
+
+    def drop_helper(self, seed: int) -> None:
+        process, jobs, results = self.helpers.pop(seed)
+        process.join(timeout=1)
+        log.warning("Search helper %d died (exit code %s)", seed, process.exitcode)
+        jobs.close()
+        results.close()
+
+    def close(self) -> None:
+        for process, jobs, results in self.helpers.values():
+            try:
+                jobs.send(None)
+            except OSError:
+                pass
+        for process, jobs, results in self.helpers.values():
+            process.join(timeout=5)
+            jobs.close()
+            results.close()
+        self.helpers = {}
+        self.tt.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,727 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+from array import array
+from collections import OrderedDict, defaultdict
+from itertools import combinations_with_replacement
+import mmap
+import multiprocessing
+import os
+import struct
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+import zlib
+
+from Engine.bitboard import (
+    BACK_RANKS, KING_ATTACKS, KNIGHT_ATTACKS, PAWN_ATTACKS, bishop_attacks, iter_squares, popcount,
+    queen_attacks, rook_attacks
+)
+from Engine.game import Game
+from Engine.moves import Move
+
+
+"""
+Endgame tablebases
+
+Distance to mate (DTM) tables for endings of 3 and 4 pieces, made by
+retrograde analysis: starting from the checkmates, positions are resolved
+one ply further from mate at a time by taking moves back, so each position
+is only looked at a few times. Captures and promotions lead into other
+tables, which are made first. Pawns may only be on one side: with pawns on
+both (KPvKP) a position can hold an en passant capture, which the tables
+have no room for.
+
+A table is named after its pieces, strongest side first (e.g. "KQvKR").
+Without pawns the white king (of the table) is mirrored into the a8-d8-d5
+triangle, so a table has 10 * 64 ** (pieces - 1) positions per side to
+move. Pawns only allow the board to be mirrored left to right: the white
+king is kept on files a-d (32 squares) and pawns, which are never on the
+first or last rank, take 48 squares instead of 64. Results are
+stored as codes of as few bits as the table needs, in blocks that can be
+zlib compressed; probing reads one block, so it needs no more memory than
+the blocks recently used.
+
+Usage:
+    python -m Engine.tablebase generate 3 --directory Tablebases
+    python -m Engine.tablebase generate KQvKR --processes 8 --compress
+    python -m Engine.tablebase probe "8/8/8/4k3/8/8/8/KQ6 w - - 0 1"
+"""
+
+PIECE_ORDER = "KQRBNP"
+PIECE_VALUES = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "P": 1}
+SIDES = ("W", "B")  # color 0 and 1
+DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Tablebases")
+
+MAGIC = b"CHESSTB1"
+HEADER = struct.Struct("<8s16sBBxxIII")  # magic, name, bits, compressed, block entries, positions, blocks
+BLOCK_ENTRIES = 8192
+INVALID = 255  # only while generating, stored as a draw
+WIN, LOSS = 1, -1
+
+# The 10 squares x >= y, x <= 3, y <= 3 (a8-d8-d5 with y counted from rank 8)
+TRIANGLE = [y * 8 + x for y in range(4) for x in range(y, 4)]
+TRIANGLE_SLOT = {sq: slot for slot, sq in enumerate(TRIANGLE)}
+
+
+def _transform(t: int, sq: int) -> int:
+    x, y = sq % 8, sq // 8
+    if t & 1:
+        x = 7 - x
+    if t & 2:
+        y = 7 - y
+    if t & 4:
+        x, y = y, x
+    return y * 8 + x
+
+
+# The 8 symmetries of the board, which keep pawnless positions equivalent
+TRANSFORMS = [[_transform(t, sq) for sq in range(64)] for t in range(8)]
+# Symmetries that put a king on each square into the triangle
+KING_TRANSFORMS = [
+    [TRANSFORMS[t] for t in range(8) if TRANSFORMS[t][sq] in TRIANGLE_SLOT] for sq in range(64)
+]
+
+
+def attacks(kind: str, sq: int, occupied: int, color: int) -> int:
+    if kind == "P":
+        return PAWN_ATTACKS[SIDES[color]][sq]
+    if kind == "N":
+        return KNIGHT_ATTACKS[sq]
+    if kind == "K":
+        return KING_ATTACKS[sq]
+    if kind == "R":
+        return rook_attacks(sq, occupied)
+    if kind == "B":
+        return bishop_attacks(sq, occupied)
+    return queen_attacks(sq, occupied)
+
+
+def table_name(white: str, black: str) -> Tuple[str, bool]:
+    """
+    The name of the table for these pieces (e.g. "KR", "KQ"), and whether
+    the colors are swapped in it
+    """
+    def strength(pieces):
+        return sum(PIECE_VALUES[kind] for kind in pieces), [-PIECE_ORDER.index(kind) for kind in pieces]
+
+    white = "".join(sorted(white, key=PIECE_ORDER.index))
+    black = "".join(sorted(black, key=PIECE_ORDER.index))
+    if strength(white) < strength(black):
+        return f"{black}v{white}", True
+    return f"{white}v{black}", False
+
+
+def endings(pieces: int) -> List[str]:
+    """
+    Names of every ending with this many pieces (kings included), except
+    those with pawns on both sides
+    """
+    names = set()
+    for extra in combinations_with_replacement("QRBNP", pieces - 2):
+        for split in range(len(extra) + 1):
+            white, black = "K" + "".join(extra[:split]), "K" + "".join(extra[split:])
+            if "P" not in white or "P" not in black:
+                names.add(table_name(white, black)[0])
+    return sorted(names, key=lambda name: (len(name), [PIECE_ORDER.index(c) for c in name if c != "v"]))
+
+
+class Layout:
+    """
+    How the positions of a table are numbered. Pieces are listed white
+    first, each side in PIECE_ORDER. Without pawns the index is the
+    triangle slot of the white king followed by the other squares in base
+    64. With pawns it is the white king's square on files a-d (y * 4 + x)
+    followed by the other squares, in base 48 for pawns (counted from a7)
+    and 64 for the rest
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        white, black = name.split("v")
+        self.kinds = white + black
+        self.colors = [0] * len(white) + [1] * len(black)
+        self.kings = (0, len(white))
+        self.count = len(self.kinds)
+        self.pawns = "P" in self.kinds
+        if self.pawns:
+            self.size = 32
+            for kind in self.kinds[1:]:
+                self.size *= 48 if kind == "P" else 64
+        else:
+            self.size = 10 * 64 ** (self.count - 1)
+
+    def index(self, squares: List[int]) -> int:
+        if self.pawns:
+            table = TRANSFORMS[1] if squares[0] & 7 > 3 else TRANSFORMS[0]
+            king = table[squares[0]]
+            index = (king >> 3) * 4 + (king & 7)
+            for kind, sq in zip(self.kinds[1:], squares[1:]):
+                if kind == "P":
+                    index = index * 48 + table[sq] - 8
+                else:
+                    index = index * 64 + table[sq]
+            return index
+        best = None
+        for table in KING_TRANSFORMS[squares[0]]:
+            index = TRIANGLE_SLOT[table[squares[0]]]
+            for sq in squares[1:]:
+                index = index * 64 + table[sq]
+            if best is None or index < best:
+                best = index
+        return best
+
+    def squares(self, index: int) -> List[int]:
+        squares = []
+        if self.pawns:
+            for kind in reversed(self.kinds[1:]):
+                if kind == "P":
+                    index, sq = divmod(index, 48)
+                    squares.append(sq + 8)
+                else:
+                    index, sq = divmod(index, 64)
+                    squares.append(sq)
+            squares.append((index >> 2) * 8 + (index & 3))
+            squares.reverse()
+            return squares
+        for _ in range(self.count - 1):
+            index, sq = divmod(index, 64)
+            squares.append(sq)
+        squares.append(TRIANGLE[index])
+        squares.reverse()
+        return squares
+
+
+def code_width(bits: int) -> int:
+    """
+    Bytes to read for a code of `bits` bits starting anywhere in a byte
+    """
+    return (bits + 7 + 7) // 8
+
+
+class Table:
+    """
+    One table file, memory-mapped
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, name, self.bits, self.compressed, self.block_entries, size, blocks = \
+            HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a tablebase file")
+        self.layout = Layout(name.rstrip(b"\0").decode("ascii"))
+        self.offsets = array("Q")
+        self.offsets.frombytes(self.map[HEADER.size:HEADER.size + 8 * (blocks + 1)])
+        self.data_start = HEADER.size + 8 * (blocks + 1)
+        self.mask = (1 << self.bits) - 1
+        self.width = code_width(self.bits)
+        self.cache = OrderedDict()  # block number: decompressed block
+
+    def block(self, number: int):
+        start = self.data_start + self.offsets[number]
+        end = self.data_start + self.offsets[number + 1]
+        if not self.compressed:
+            return memoryview(self.map)[start:end]
+        block = self.cache.get(number)
+        if block is None:
+            block = zlib.decompress(self.map[start:end])
+            self.cache[number] = block
+            if len(self.cache) > 64:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(number)
+        return block
+
+    def code(self, entry: int) -> int:
+        number, entry = divmod(entry, self.block_entries)
+        bit = entry * self.bits
+        data = self.block(number)
+        return int.from_bytes(data[bit >> 3:(bit >> 3) + self.width], "little") >> (bit & 7) & self.mask
+
+    def close(self) -> None:
+        self.map.close()
+        self.file.close()
+
+
+def decode(code: int) -> Tuple[int, int]:
+    """
+    (1 win / 0 draw / -1 loss, plies to mate) for a stored code
+    """
+    if code == 0:
+        return 0, 0
+    return (WIN if code % 2 == 0 else LOSS), code - 1
+
+
+class Tablebases:
+    """
+    The tables in a directory, opened when first needed.
+
+    probe(game) returns (result, plies) for the side to move: result is
+    1 (it mates in `plies`), 0 (draw) or -1 (it is mated in `plies`), or
+    None when the position is not covered.
+    """
+
+    def __init__(self, directory: str = DIRECTORY):
+        self.directory = directory
+        self.tables: Dict[str, Optional[Table]] = {}
+        self.materials: Dict[Tuple[str, str], Tuple[Optional[Table], bool]] = {}
+
+    def table(self, name: str) -> Optional[Table]:
+        if name not in self.tables:
+            path = os.path.join(self.directory, f"{name}.ctb")
+            self.tables[name] = Table(path) if os.path.exists(path) else None
+        return self.tables[name]
+
+    def material(self, white: str, black: str) -> Tuple[Optional[Table], bool]:
+        """
+        The table for these pieces (each side in PIECE_ORDER) and whether
+        the colors are swapped in it. Cached, as it is needed on every probe
+        """
+        key = white, black
+        found = self.materials.get(key)
+        if found is None:
+            name, swapped = table_name(white, black)
+            found = self.materials[key] = (self.table(name) if name != "KvK" else None), swapped
+        return found
+
+    def probe_squares(self, white: str, black: str, white_squares: List[int],
+                      black_squares: List[int], turn: int) -> Optional[Tuple[int, int]]:
+        """
+        white, black: the kinds of each side's pieces in PIECE_ORDER, e.g. "KQ"
+        white_squares, black_squares: their squares, in the same order
+        turn: color to move (0 white / 1 black)
+        """
+        if white == "K" and black == "K":
+            return 0, 0
+        table, swapped = self.material(white, black)
+        if table is None:
+            return None
+        if swapped:
+            # The colors change places, so the board is turned around too
+            # (pawns move the other way)
+            white_squares, black_squares = [sq ^ 56 for sq in black_squares], [sq ^ 56 for sq in white_squares]
+            turn = 1 - turn
+        layout = table.layout
+        return decode(table.code(turn * layout.size + layout.index(white_squares + black_squares)))
+
+    def probe_pieces(self, pieces: List[Tuple[str, int, int]], turn: int) -> Optional[Tuple[int, int]]:
+        """
+        pieces: (kind, color 0 white / 1 black, square) for every piece
+        turn: color to move
+        """
+        ordered = sorted(pieces, key=lambda piece: (piece[1], PIECE_ORDER.index(piece[0])))
+        return self.probe_squares(
+            "".join(kind for kind, color, _ in ordered if color == 0),
+            "".join(kind for kind, color, _ in ordered if color == 1),
+            [sq for _, color, sq in ordered if color == 0],
+            [sq for _, color, sq in ordered if color == 1],
+            turn
+        )
+
+    def probe(self, game: Game) -> Optional[Tuple[int, int]]:
+        bitboards = game.bitboards.pieces
+        # The tables hold no en passant rights (see the module docstring)
+        if popcount(game.bitboards.occupied) > 4 or game.en_passant is not None:
+            return None
+        white, black, white_squares, black_squares = "", "", [], []
+        for kind in PIECE_ORDER:
+            bb = bitboards["W" + kind]
+            while bb:
+                low = bb & -bb
+                white += kind
+                white_squares.append(low.bit_length() - 1)
+                bb ^= low
+            bb = bitboards["B" + kind]
+            while bb:
+                low = bb & -bb
+                black += kind
+                black_squares.append(low.bit_length() - 1)
+                bb ^= low
+        return self.probe_squares(white, black, white_squares, black_squares, 0 if game.turn == "W" else 1)
+
+    def best_move(self, game: Game) -> Optional[Tuple[Move, Tuple[int, int]]]:
+        """
+        The move that mates soonest (or draws, or is mated last) and the
+        position's (result, plies), or None if the position is not covered
+        """
+        result = self.probe(game)
+        if result is None:
+            return None
+        best, best_key = None, None
+        for move in game.generate_legal_moves():
+            game.make_move(move)
+            after = self.probe(game)
+            game.unmake_move()
+            if after is None:
+                continue
+            outcome, plies = after
+            # The opponent's loss is our win: shortest wins first, then
+            # draws, then the longest losses
+            key = (-outcome, -plies if outcome < 0 else plies)
+            if best_key is None or key > best_key:
+                best, best_key = move, key
+        return (best, result) if best is not None else None
+
+    def close(self) -> None:
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+
+
+# Generation. The work is split into chunks that worker processes run with
+# these module globals set up by _init_worker
+
+_layout: Optional[Layout] = None
+_tablebases: Optional[Tablebases] = None
+
+
+def _init_worker(name: str, directory: str) -> None:
+    global _layout, _tablebases
+    _layout = Layout(name)
+    _tablebases = Tablebases(directory)
+
+
+def _attacked(sq: int, squares: List[int], by: int, occupied: int, skip: int = -1) -> bool:
+    layout = _layout
+    for i, piece_sq in enumerate(squares):
+        if layout.colors[i] == by and i != skip and attacks(layout.kinds[i], piece_sq, occupied, by) >> sq & 1:
+            return True
+    return False
+
+
+def _pawn_pushes(sq: int, color: int, occupied: int) -> int:
+    step = -8 if color == 0 else 8
+    to_sq = sq + step
+    if occupied >> to_sq & 1:
+        return 0
+    pushes = 1 << to_sq
+    if sq >> 3 == (6 if color == 0 else 1) and not occupied >> (to_sq + step) & 1:
+        pushes |= 1 << (to_sq + step)
+    return pushes
+
+
+def _pawn_unpushes(sq: int, color: int, occupied: int) -> int:
+    """
+    The squares a pawn on `sq` can have been pushed from
+    """
+    back = 8 if color == 0 else -8
+    from_sq = sq + back
+    if not 8 <= from_sq < 56 or occupied >> from_sq & 1:
+        return 0  # a pawn never stands on the first or last rank
+    origins = 1 << from_sq
+    if (from_sq + back) >> 3 == (6 if color == 0 else 1) and not occupied >> (from_sq + back) & 1:
+        origins |= 1 << (from_sq + back)
+    return origins
+
+
+def _position_info(position: int) -> Tuple[int, int, int, int]:
+    """
+    Looks at the moves of one position. Returns (flags, moves staying in
+    the table, shortest win through a capture or promotion, longest loss
+    through one), distances in plies. Flags: 1 invalid, 2 in check, 4 has legal
+    moves, 8 cannot lose (a capture wins or draws)
+    """
+    layout = _layout
+    side, index = divmod(position, layout.size)
+    squares = layout.squares(index)
+    if len(set(squares)) != layout.count or layout.index(squares) != index:
+        return 1, 0, 0, 0
+    occupied = 0
+    for sq in squares:
+        occupied |= 1 << sq
+    enemy = 1 - side
+    king, enemy_king = squares[layout.kings[side]], squares[layout.kings[enemy]]
+    if _attacked(enemy_king, squares, side, occupied):
+        return 1, 0, 0, 0
+
+    flags = 2 if _attacked(king, squares, enemy, occupied) else 0
+    own = 0
+    for i, sq in enumerate(squares):
+        if layout.colors[i] == side:
+            own |= 1 << sq
+    children = set()
+    conversion_win = conversion_loss = 0
+    for i, from_sq in enumerate(squares):
+        if layout.colors[i] != side:
+            continue
+        kind = layout.kinds[i]
+        if kind == "P":
+            targets = _pawn_pushes(from_sq, side, occupied) | attacks(kind, from_sq, occupied, side) & occupied & ~own
+        else:
+            targets = attacks(kind, from_sq, occupied, side) & ~own
+        for to_sq in iter_squares(targets):
+            after = squares[:]
+            after[i] = to_sq
+            occupied_after = occupied & ~(1 << from_sq) | 1 << to_sq
+            king_after = to_sq if i == layout.kings[side] else king
+            captured = -1
+            if occupied >> to_sq & 1:
+                captured = squares.index(to_sq)
+            if _attacked(king_after, after, enemy, occupied_after, skip=captured):
+                continue
+            flags |= 4
+            promotes = kind == "P" and BACK_RANKS >> to_sq & 1
+            if captured < 0 and not promotes:
+                children.add(enemy * layout.size + layout.index(after))
+                continue
+            for new_kind in ("QRBN" if promotes else kind):
+                pieces = [
+                    (new_kind if j == i else layout.kinds[j], layout.colors[j], sq)
+                    for j, sq in enumerate(after) if j != captured
+                ]
+                outcome, plies = _tablebases.probe_pieces(pieces, enemy)
+                if outcome == 0:
+                    flags |= 8
+                elif outcome == LOSS:
+                    flags |= 8
+                    if not conversion_win or plies + 1 < conversion_win:
+                        conversion_win = plies + 1
+                else:
+                    conversion_loss = max(conversion_loss, plies + 1)
+    return flags, len(children), conversion_win, conversion_loss
+
+
+def _info_chunk(bounds: Tuple[int, int]) -> Tuple[bytes, bytes, bytes, bytes]:
+    flags, counts, wins, losses = (bytearray(bounds[1] - bounds[0]) for _ in range(4))
+    for k, position in enumerate(range(*bounds)):
+        flags[k], counts[k], wins[k], losses[k] = _position_info(position)
+    return bytes(flags), bytes(counts), bytes(wins), bytes(losses)
+
+
+def _parents(position: int) -> Iterable[int]:
+    """
+    The positions one move before this one (in this table)
+    """
+    layout = _layout
+    side, index = divmod(position, layout.size)
+    squares = layout.squares(index)
+    mover = 1 - side
+    occupied = 0
+    for sq in squares:
+        occupied |= 1 << sq
+    king = squares[layout.kings[side]]
+    parents = set()
+    for i, to_sq in enumerate(squares):
+        if layout.colors[i] != mover:
+            continue
+        kind = layout.kinds[i]
+        if kind == "P":
+            # Pawn captures and promotions come from other tables
+            origins = _pawn_unpushes(to_sq, mover, occupied)
+        else:
+            origins = attacks(kind, to_sq, occupied, mover) & ~occupied
+        for from_sq in iter_squares(origins):
+            before = squares[:]
+            before[i] = from_sq
+            # The side that did not move cannot have been in check
+            if not _attacked(king, before, mover, occupied & ~(1 << to_sq) | 1 << from_sq):
+                parents.add(mover * layout.size + layout.index(before))
+    return parents
+
+
+def _parents_chunk(positions: List[int]) -> Tuple[array, array]:
+    counts, flat = array("I"), array("I")
+    for position in positions:
+        parents = _parents(position)
+        counts.append(len(parents))
+        flat.extend(parents)
+    return counts, flat
+
+
+def _chunks(items: list, count: int) -> List[list]:
+    size = max(1, -(-len(items) // count))
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def generate(name: str, directory: str = DIRECTORY, processes: Optional[int] = None,
+             compress: bool = False, log=print) -> str:
+    """
+    Makes the table `name` (and the tables its captures and promotions
+    lead to, if missing) in `directory`. Returns the path of the table file.
+    Raises ValueError for pawns on both sides (see the module docstring)
+    """
+    name, _ = table_name(*name.split("v"))
+    white, black = name.split("v")
+    if "P" in white and "P" in black:
+        raise ValueError(f"{name}: tables with pawns on both sides are not supported")
+    os.makedirs(directory, exist_ok=True)
+    subtables = set()
+    for i in range(1, len(white)):
+        subtables.add(table_name(white[:i] + white[i + 1:], black)[0])
+        if white[i] == "P":
+            subtables.update(table_name(white[:i] + kind + white[i + 1:], black)[0] for kind in "QRBN")
+    for i in range(1, len(black)):
+        subtables.add(table_name(white, black[:i] + black[i + 1:])[0])
+        if black[i] == "P":
+            subtables.update(table_name(white, black[:i] + kind + black[i + 1:])[0] for kind in "QRBN")
+    for sub in sorted(subtables):
+        if sub != "KvK" and not os.path.exists(os.path.join(directory, f"{sub}.ctb")):
+            generate(sub, directory, processes, compress, log)
+
+    start = time.perf_counter()
+    layout = Layout(name)
+    total = 2 * layout.size
+    pool = None
+    if processes != 1:
+        pool = multiprocessing.Pool(processes, _init_worker, (name, directory))
+        workers = processes or os.cpu_count() or 1
+        run = pool.map
+    else:
+        _init_worker(name, directory)
+        workers = 1
+        run = lambda function, chunks: [function(chunk) for chunk in chunks]
+
+    try:
+        # Pass 1: moves of every position
+        step = max(4096, total // (workers * 16))
+        flags, counts, conversion_losses = bytearray(), bytearray(), bytearray()
+        buckets = defaultdict(list)  # plies: [(position, WIN or LOSS)]
+        for chunk_flags, chunk_counts, chunk_wins, chunk_losses in run(
+                _info_chunk, [(low, min(low + step, total)) for low in range(0, total, step)]):
+            base = len(flags)
+            flags += chunk_flags
+            counts += chunk_counts
+            conversion_losses += chunk_losses
+            for k, win in enumerate(chunk_wins):
+                if win:
+                    buckets[win].append((base + k, WIN))
+        values = bytearray(total)
+        for position in range(total):
+            flag = flags[position]
+            if flag & 1:
+                values[position] = INVALID
+            elif not flag & 4:
+                if flag & 2:
+                    buckets[0].append((position, LOSS))  # checkmate
+            elif counts[position] == 0 and not flag & 8:
+                buckets[conversion_losses[position]].append((position, LOSS))
+        log(f"{name}: positions looked at in {time.perf_counter() - start:.1f} s")
+
+        # Pass 2: take moves back from resolved positions, nearest mates first
+        plies = 0
+        while any(distance >= plies for distance in buckets):
+            resolved = []
+            for position, outcome in buckets.pop(plies, ()):
+                if values[position] == 0:
+                    values[position] = plies + 1  # the stored code, see decode
+                    resolved.append((position, outcome))
+            if resolved:
+                parents_of = []
+                for chunk_counts, flat in run(
+                        _parents_chunk, _chunks([position for position, _ in resolved], workers * 4)):
+                    k = 0
+                    for count in chunk_counts:
+                        parents_of.append(flat[k:k + count])
+                        k += count
+                for (position, outcome), parents in zip(resolved, parents_of):
+                    for parent in parents:
+                        if values[parent]:
+                            continue
+                        if outcome == LOSS:
+                            buckets[plies + 1].append((parent, WIN))
+                        else:
+                            counts[parent] -= 1
+                            if counts[parent] == 0 and not flags[parent] & 8:
+                                buckets[max(plies + 1, conversion_losses[parent])].append((parent, LOSS))
+            plies += 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    path = os.path.join(directory, f"{name}.ctb")
+    write_table(path, name, values, layout.size, compress)
+    longest = max((code for code in values if code != INVALID), default=0)
+    log(
+        f"{name}: {total} positions in {time.perf_counter() - start:.1f} s,"
+        f" longest mate {max(longest - 1, 0)} plies, {os.path.getsize(path)} bytes"
+    )
+    return path
+
+
+def write_table(path: str, name: str, values: bytearray, size: int, compress: bool) -> None:
+    """
+    Bit-packs the codes (INVALID stored as 0) in blocks of BLOCK_ENTRIES
+    """
+    codes = values.translate(bytes(range(INVALID)) + b"\0")
+    bits = max(max(codes, default=0).bit_length(), 1)
+    blocks, offsets, position = [], array("Q", [0]), 0
+    for start in range(0, len(codes), BLOCK_ENTRIES):
+        chunk = codes[start:start + BLOCK_ENTRIES]
+        packed = bytearray()
+        for group in range(0, len(chunk), 8):
+            word = 0
+            for k, code in enumerate(chunk[group:group + 8]):
+                word |= code << (k * bits)
+            packed += word.to_bytes(bits, "little")
+        packed += bytes(code_width(bits))  # so a probe can always read a full width
+        block = zlib.compress(bytes(packed), 9) if compress else bytes(packed)
+        blocks.append(block)
+        position += len(block)
+        offsets.append(position)
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, name.encode("ascii"), bits, compress, BLOCK_ENTRIES, size, len(blocks)))
+        file.write(offsets.tobytes())
+        for block in blocks:
+            file.write(block)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Endgame tablebases")
+    parser.add_argument("--directory", default=DIRECTORY)
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate_command = commands.add_parser("generate", help="make tables")
+    generate_command.add_argument("tables", nargs="+", help="table names (e.g. KQvKR) or 3 / 4 for all")
+    generate_command.add_argument("--processes", type=int, help="worker processes (all cores by default)")
+    generate_command.add_argument("--compress", action="store_true", help="zlib compress the blocks")
+    probe_command = commands.add_parser("probe", help="look up a position")
+    probe_command.add_argument("fen")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        names = []
+        for name in args.tables:
+            names += endings(int(name)) if name.isdigit() else [name]
+        for name in names:
+            if not os.path.exists(os.path.join(args.directory, f"{table_name(*name.split('v'))[0]}.ctb")):
+                generate(name, args.directory, args.processes, args.compress)
+        return
+
+    from Engine.moves import move_name
+    tablebases = Tablebases(args.directory)
+    game = Game.from_fen(args.fen, backend="bitboard")
+    result = tablebases.probe(game)  # opens the table
+    start = time.perf_counter()
+    for _ in range(1000):
+        tablebases.probe(game)
+    elapsed = (time.perf_counter() - start) / 1000
+    if result is None:
+        print("not in the tablebases")
+        return
+    outcome, plies = result
+    text = {WIN: f"wins, mate in {(plies + 1) // 2}", LOSS: f"loses, mated in {plies // 2}", 0: "draw"}
+    best = tablebases.best_move(game)
+    print(f"{text[outcome]} ({plies} plies), probed in {elapsed * 1e6:.0f} us")
+    if best is not None:
+        print(f"best move {move_name(best[0])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+from typing import Callable, Dict, Optional
+
+import trio
+
+from Engine.game import Game
+from Engine.polyglot import OpeningBook
+from Engine.search import SearchResult, Searcher, SearchStopped
+from Engine.smp import ParallelSearcher
+from Engine.tablebase import Tablebases
+from Errors.errors import EngineCrashed
+
+
+"""
+Search in a worker process
+
+The search is pure Python, so in a thread it would hold the GIL and stall
+the GUI. EngineProcess runs a Searcher in a separate process (which keeps
+its transposition table between moves) and exposes it as a trio-friendly
+async call that streams each finished iteration back and is cancelled like
+any other trio operation.
+
+The worker is started as `python -m Engine.worker` rather than with
+multiprocessing, which would import the GUI module (and open a window)
+again in the child. The position is sent as a FEN plus the game's
+repetition counts (Game.repetitions), which a FEN cannot hold, so the
+search still sees draws by repetition. Messages are pickled tuples over stdin/stdout:
+    parent -> worker: ("search", id, fen, repetitions, depth, movetime, nodes), ("stop", id), None
+    worker -> parent: ("info", id, SearchResult), ("done", id, SearchResult)
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _WorkerSearcher(Searcher):
+    """
+    Searcher that can be stopped by id, so a late stop message for an
+    earlier search never stops the current one
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.current = None
+        self.cancelled = None
+
+    def check_limits(self) -> None:
+        if self.cancelled == self.current:
+            raise SearchStopped
+        super().check_limits()
+
+
+def main() -> None:
+    """
+    Worker process loop
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1, help="search processes (lazy SMP)")
+    parser.add_argument("--book", help="Polyglot opening book to play from first")
+    parser.add_argument("--tablebases", help="directory of endgame tables")
+    args = parser.parse_args()
+
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    searcher = _WorkerSearcher(tablebases=Tablebases(args.tablebases) if args.tablebases else None)
+    engine = searcher
+    if args.workers > 1:
+        engine = ParallelSearcher(args.workers, searcher=searcher)
+    book = OpeningBook(args.book) if args.book else None
+    requests = queue.Queue()
+
+    def read_messages():
+        while True:
+            try:
+                message = pickle.load(stdin)
+            except EOFError:
+                message = None
+            if message is None:
+                requests.put(None)
+                return
+            if message[0] == "stop":
+                searcher.cancelled = message[1]
+            else:
+                requests.put(message)
+
+    def send(message):
+        pickle.dump(message, stdout)
+        stdout.flush()
+
+    threading.Thread(target=read_messages, daemon=True).start()
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        _, search_id, fen, repetitions, depth, movetime, nodes = request
+        searcher.current = search_id
+        game = Game.from_fen(fen, backend="bitboard")
+        if repetitions is not None:
+            game.repetitions = repetitions
+        move = book.choose(game) if book is not None else None
+        if move is not None:
+            result = SearchResult(move, 0, 0, [move], 0, 0.0)
+        else:
+            result = engine.search(
+                game, depth, movetime, nodes, lambda info: send(("info", search_id, info)))
+        send(("done", search_id, result))
+    if engine is not searcher:
+        engine.close()
+
+
+class EngineProcess:
+    """
+    A Searcher running in its own process. The process is started on the
+    first search and stopped by close()
+
+    workers: number of processes searching together (see Engine.smp)
+    book: path of a Polyglot opening book; book moves are played without
+    searching (their SearchResult has depth 0)
+    tablebases: directory of endgame tables for the search (Engine.tablebase)
+    """
+
+    def __init__(self, workers: int = 1, book: Optional[str] = None, tablebases: Optional[str] = None):
+        self.process = None
+        self.search_id = 0
+        self.workers = workers
+        self.book = book
+        self.tablebases = tablebases
+
+    def start(self) -> None:
+        command = [sys.executable, "-m", "Engine.worker", "--workers", str(self.workers)]
+        if self.book is not None:
+            command += ["--book", os.path.abspath(self.book)]
+        if self.tablebases is not None:
+            command += ["--tablebases", os.path.abspath(self.tablebases)]
+        self.process = subprocess.Popen(
+            command,
+            cwd=ROOT,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def send(self, message) -> None:
+        pickle.dump(message, self.process.stdin)
+        self.process.stdin.flush()
+
+    def crashed(self) -> EngineCrashed:
+        """
+        Forgets a worker process that stopped answering, so the next search
+        starts a new one, and returns the error to raise
+        """
+        self.process.kill()
+        code = self.process.wait()
+        self.process = None
+        return EngineCrashed(f"The engine process stopped (exit code {code})")
+
+    def close(self) -> None:
+        """
+        Stops the worker process
+        """
+        if self.process is not None:
+            try:
+                self.send(None)
+            except BrokenPipeError:
+                pass
+            self.process.wait(timeout=5)
+            self.process = None
+
+    def _receive(self, info_callback: Optional[Callable[[SearchResult], None]]) -> SearchResult:
+        """
+        Runs in a trio worker thread, forwarding progress to the trio thread
+        """
+        while True:
+            try:
+                kind, search_id, result = pickle.load(self.process.stdout)
+            except (EOFError, pickle.UnpicklingError) as error:
+                raise self.crashed() from error
+            if search_id != self.search_id:
+                continue
+            if kind == "done":
+                return result
+            if info_callback is not None:
+                trio.from_thread.run_sync(info_callback, result)
+
+    async def search(
+            self,
+            fen: str,
+            depth: Optional[int] = None,
+            movetime: Optional[float] = None,
+            nodes: Optional[int] = None,
+            info_callback: Optional[Callable[[SearchResult], None]] = None,
+            repetitions: Optional[Dict[int, int]] = None
+        ) -> SearchResult:
+        """
+        Searches the position without blocking the trio event loop.
+        repetitions: the game's Game.repetitions, so positions that already
+        occurred are scored as draws (a FEN alone has no history)
+        info_callback is called (on the trio thread) after every iteration.
+        If the calling task is cancelled, the search is stopped and
+        trio.Cancelled is raised once the worker has answered.
+        Raises EngineCrashed if the worker process dies.
+        """
+        if self.process is None:
+            self.start()
+        self.search_id += 1
+        search_id = self.search_id
+        try:
+            self.send(("search", search_id, fen, repetitions, depth, movetime, nodes))
+        except BrokenPipeError as error:
+            raise self.crashed() from error
+        finished = False
+
+        async def stop_on_cancel():
+            try:
+                await trio.sleep_forever()
+            finally:
+                if not finished:
+                    try:
+                        self.send(("stop", search_id))
+                    except BrokenPipeError:
+                        pass  # the worker died, which _receive reports
+
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(stop_on_cancel)
+            # Only this thread reads the pipe, so it is always left to finish
+            # (cancelling stops the search, which makes that quick)
+            with trio.CancelScope(shield=True):
+                try:
+                    result = await trio.to_thread.run_sync(self._receive, info_callback)
+                finally:
+                    finished = True  # answered, or there is no worker left to stop
+            nursery.cancel_scope.cancel()
+        return result
+
+
+if __name__ == "__main__":
+    main()
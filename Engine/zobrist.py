@@ -0,0 +1,74 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import random
+from typing import Dict, List, Optional
+
+from Engine.bitboard import PIECE_NAMES
+
+
+"""
+Zobrist hashing
+
+A position's key is the XOR of one random 64-bit number per (piece, square),
+plus numbers for black to move, the castling rights and the en passant file.
+Making a move only XORs the numbers that changed in and out, see
+Game.make_move. The numbers come from a fixed seed so keys are the same in
+every process and can be stored.
+"""
+
+_random = random.Random(3141)
+
+PIECE_KEYS: Dict[str, List[int]] = {
+    name: [_random.getrandbits(64) for _ in range(64)] for name in PIECE_NAMES
+}
+BLACK_TO_MOVE_KEY = _random.getrandbits(64)
+# Indexed by castling_index
+CASTLE_KEYS = [_random.getrandbits(64) for _ in range(16)]
+# Indexed by the file (x) of the en passant square
+EN_PASSANT_KEYS = [_random.getrandbits(64) for _ in range(8)]
+
+
+def castling_index(castle_status: Dict[str, list]) -> int:
+    """
+    Packs Game.castle_status into 4 bits: W O-O, W O-O-O, B O-O, B O-O-O
+    """
+    white, black = castle_status["W"], castle_status["B"]
+    return white[0] | white[1] << 1 | black[0] << 2 | black[1] << 3
+
+
+def position_key(
+        board: List[list],
+        turn: str,
+        castle_status: Dict[str, list],
+        en_passant: Optional[int]
+    ) -> int:
+    """
+    Computes a key from scratch. Only needed when a position is set up,
+    moves update the key incrementally
+    """
+    key = CASTLE_KEYS[castling_index(castle_status)]
+    for y, row in enumerate(board):
+        for x, piece in enumerate(row):
+            if piece != "  ":
+                key ^= PIECE_KEYS[piece][y * 8 + x]
+    if turn == "B":
+        key ^= BLACK_TO_MOVE_KEY
+    if en_passant is not None:
+        key ^= EN_PASSANT_KEYS[en_passant % 8]
+    return key
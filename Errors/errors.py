@@ -2,4 +2,7 @@ class InvalidMove(Exception):
     pass
 
 class KingMissing(Exception):
+    pass
+
+class EngineCrashed(Exception):
     pass
\ No newline at end of file
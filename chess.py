@@ -17,9 +17,11 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 from copy import deepcopy                       # Used for board copying operations (nested list)
+from functools import partial                   # Binding square buttons to their coordinates
+import logging                                  # Debug output (CHESS_LOG=DEBUG to see it)
 import os                                       # For executable (_MEIPASS)
 import sys                                      # For executable (_MEIPASS)
-from typing import Literal, List, Optional      # Type annotations
+from typing import Literal                      # Type annotations
 import trio                                     # For async code
 
 # Remove red dots when user right clicks
@@ -30,7 +32,10 @@ from kivymd.app import MDApp
 from kivymd.uix.button import MDFlatButton, MDRaisedButton
 
 from kivy.lang import Builder
-from kivy.graphics import Rectangle, Color
+from kivy.graphics import Rectangle, Color, Fbo, ClearColor, ClearBuffers, InstructionGroup
+from kivy.graphics.texture import Texture
+from kivy.core.image import Image as CoreImage
+from kivy.core.text import Label as CoreLabel
 from kivy.uix.gridlayout import GridLayout
 from kivy.uix.modalview import ModalView
 from kivy.uix.screenmanager import Screen, ScreenManager
@@ -41,513 +46,23 @@ from kivy.uix.label import Label
 from kivy.uix.popup import Popup
 from kivy.core.window import Window
 
-from Errors.errors import InvalidMove, KingMissing
-
-
-"""
-Chess Game Logic
-"""
-
-class Game:
-    """
-    This class consists of the chess game logic.
-    """
-
-    def __init__(self):
-        self.board = [
-            ["BR", "BN", "BB", "BQ", "BK", "BB", "BN", "BR"],
-            ["BP", "BP", "BP", "BP", "BP", "BP", "BP", "BP"],
-            ["  ", "  ", "  ", "  ", "  ", "  ", "  ", "  "],
-            ["  ", "  ", "  ", "  ", "  ", "  ", "  ", "  "],
-            ["  ", "  ", "  ", "  ", "  ", "  ", "  ", "  "],
-            ["  ", "  ", "  ", "  ", "  ", "  ", "  ", "  "],
-            ["WP", "WP", "WP", "WP", "WP", "WP", "WP", "WP"],
-            ["WR", "WN", "WB", "WQ", "WK", "WB", "WN", "WR"],
-        ]
-        self.turn = "W"
-        self.moves = 0
-        self.winner = None
-        self.warning = ""
-        self.pawn_promotion_view = None
-        self.wait_for_promotion = trio.Event()
-        self.pawn_promoted_to = None
-        self.castle_status = {
-            "W": [True, True],  # O-O, O-O-O
-            "B": [True, True]
-        }
-        self.letter_match = {
-            "a": 0,
-            "b": 1,
-            "c": 2,
-            "d": 3,
-            "e": 4,
-            "f": 5,
-            "g": 6,
-            "h": 7
-        }
-        self.pieces = {
-            "WQ": "\u2655",
-            "WR": "\u2656",
-            "WB": "\u2657",
-            "WN": "\u2658",
-
-            "BQ": "\u265B",
-            "BR": "\u265C",
-            "BB": "\u265D",
-            "BN": "\u265E",
-        }
-
-    def coords_to_index(self, coords: str, to_return: Literal["int", "str"] = "int") -> str | list:
-        """
-        This function converts coords to index form so it can be
-        located in the nested list (board)
-        """
-        x, y = coords[0], coords[1]
-        return [
-            self.letter_match[x], 8 - int(y)
-            ] if to_return == "int" else f"{self.letter_match[x]}{8 - int(y)}"
-
-    def index_to_coords(self, index: str):
-        """
-        This function converts board indicies to coordinate form!
-        E.g. "00" -> "a8"
-        """
-        return f"{chr(int(index[0])+97)}{8 - int(index[1])}"
-
-    def get_king_coords(self, color: str, board: Optional[List[list]] = None):
-        """
-        This function gets the coods of the king
-        Returns "0" if king cannot be found
-        """
-        if board is None:
-            board = self.board
-        for y in range(8):
-            for x in range(8):
-                if board[y][x] == f"{color}K":
-                    return self.index_to_coords(f"{x}{y}")
-        raise KingMissing("The king cannot be found on the board!")
-
-    def find_pawn_moves(
-            self,
-            color: Literal["W", "B"],
-            piece_x: int,
-            piece_y: int,
-            return_check: bool = False
-        ) -> List[str]:
-        """
-        Finds all valid pawn moves
-        """
-        ret = []
-        if not return_check:  # if return_check, only check for takes
-            # Find valid vert movements (1/ 2 up for first move)
-            can_move_vertically = False
-            # Single vert moves
-            new_x, new_y = (piece_x, piece_y +
-                            1) if color == "B" else (piece_x, piece_y-1)
-            if self.board[new_y][new_x] == "  " and piece_x == new_x:
-                can_move_vertically = True
-                ret.append(f"{new_x}{new_y}")
-
-            # Double vert moves
-            # First, check if the pawn is on it's home square
-            if can_move_vertically and ((piece_y == 1 and color == "B") or (piece_y == 6 and color == "W")):
-                new_x, new_y = (piece_x, piece_y +
-                                2) if color == "B" else (piece_x, piece_y-2)
-                if self.board[new_y][new_x] == "  " and piece_x == new_x:
-                    ret.append(f"{new_x}{new_y}")
-
-        # Check for diagonal movement
-        new_y = piece_y+1 if color == "B" else piece_y-1
-        # Check for left/right diagonals
-        for i in (-1, 1):
-            new_x = piece_x + i
-            if 0 <= new_x < 8:
-                if self.board[new_y][new_x][0] == ("W" if color == "B" else "B"):
-                    ret.append(f"{new_x}{new_y}")
-                    if return_check and self.board[new_y][new_x][1] == "P":
-                        return True
-
-        return ret if not return_check else False
-
-    def find_horizontal_moves(
-            self,
-            color: Literal["W", "B"],
-            piece_x: int,
-            piece_y: int,
-            return_check: bool = False
-        ) -> List[str] | bool:
-        """
-        Find all valid left and right movements
-        """
-        ret = []
-        # Check for valid left movements and right movements
-        ind = 0
-        for movements in (range(1, piece_x + 1), range(1, 8-piece_x)):
-            for x in movements:
-                new_x = piece_x - x if ind == 0 else piece_x + x
-
-                # Check if potential square is not occupied by your own piece,
-                # else stop checking further
-                if self.board[piece_y][new_x][0] != color:
-                    ret.append(f"{new_x}{piece_y}")
-
-                    # If that spot is occupied by opponent's piece,
-                    # stop checking for moves further along axis
-                    if self.board[piece_y][new_x][0] == ("W" if color == "B" else "B"):
-                        if return_check and self.board[piece_y][new_x][1] in ["R", "Q"]:
-                            return True
-                        break
-                else:
-                    break
-
-            ind += 1
-        return ret if not return_check else False
-
-    def find_vertical_moves(
-            self, color: Literal["W", "B"],
-            piece_x: int,
-            piece_y: int,
-            return_check: bool = False
-        ) -> List[str] | bool:
-        """
-        Checks for all valid up and down movements
-        """
-        ret = []
-        ind = 0
-        for movements in (range(1, piece_y + 1), range(1, 8-piece_y)):
-            for y in movements:
-                new_y = piece_y - y if ind == 0 else piece_y + y
-
-                # Check if potential square is not occupied by your own piece,
-                # else stop checking further
-                if self.board[new_y][piece_x][0] != color:
-                    ret.append(f"{piece_x}{new_y}")
-
-                    # If that spot is occupied by opponent's piece,
-                    # stop checking for moves further along axis
-                    if self.board[new_y][piece_x][0] == ("W" if color == "B" else "B"):
-                        if return_check and self.board[new_y][piece_x][1] in ["R", "Q"]:
-                            return True
-                        break
-                else:
-                    break
-
-            ind += 1
-        return ret if not return_check else False
-
-    def find_diagonal_moves(
-            self,
-            color: Literal["W", "B"],
-            piece_x: int,
-            piece_y: int,
-            return_check: bool = False
-        ) -> List[str] | bool:
-        """
-        Find all diagonal moves
-        """
-        ret = []
-        for y in (-1, 1):
-            for x in (-1, 1):
-                modx, mody = x, y
-                while 0 <= piece_x+modx < 8 and 0 <= piece_y+mody < 8:
-                    if self.board[piece_y+mody][piece_x+modx][0] != color:
-                        ret.append(f"{piece_x+modx}{piece_y+mody}")
-
-                        # If that spot is occupied by opponent's piece,
-                        # stop checking for moves further along axis
-                        if self.board[piece_y+mody][piece_x+modx][0] == ("W" if color == "B" else "B"):
-
-                            if return_check and self.board[piece_y+mody][piece_x+modx][1] in ["B", "Q"]:
-                                return True
-                            break
-                    else:
-                        break
-
-                    modx += x
-                    mody += y
-
-        return ret if not return_check else False
-
-    def find_knight_moves(
-            self,
-            color: Literal["W", "B"],
-            piece_x: int,
-            piece_y: int,
-            return_check: bool = False
-        ) -> List[str] | bool:
-        """
-        Find all valid knight moves (L shape)
-        """
-        ret = []
-        for mody in (-2, -1, 1, 2):
-            for modx in (-2, -1, 1, 2):
-                if 0 <= piece_x+modx < 8 and 0 <= piece_y+mody < 8:
-                    if abs(modx) == abs(mody):
-                        continue  # Skip check if x and y change is same because only L shaped movements should be checked
-                    if self.board[piece_y+mody][piece_x+modx][0] != color:
-                        ret.append(f"{piece_x+modx}{piece_y+mody}")
-                        if return_check and self.board[piece_y+mody][piece_x+modx][1] == "N":
-                            return True
-
-        return ret if not return_check else False
-
-    def find_adj_moves(
-            self,
-            color: Literal["W", "B"],
-            piece_x: int,
-            piece_y: int,
-            return_check: bool = False
-        ) -> List[str]:
-        """
-        Finds all adjacent moves (mostly used for king movement)
-        """
-        ret = []
-        for mody in (-1, 0, 1):
-            for modx in (-1, 0, 1):
-                if mody == 0 and modx == 0:
-                    continue
-                if 0 <= piece_x+modx < 8 and 0 <= piece_y+mody < 8:
-                    if self.board[piece_y+mody][piece_x+modx][0] != color:
-                        ret.append(f"{piece_x+modx}{piece_y+mody}")
-                        if return_check and self.board[piece_y+mody][piece_x+modx][1] == "K":
-                            return True
-
-        return ret if not return_check else False
-
-    def is_in_check(
-            self,
-            color: Literal["W", "B"],
-            piece_x: int,
-            piece_y: int,
-            temp_board: Optional[List[list]] = None
-        ) -> bool:
-        """
-        This function checks if a "potential" position
-        on the board is threatened.
-        Will be used for kind movements and castling to ensure the
-        players don't castle into check ect.
-        """
-        original_board = deepcopy(self.board)
-        if temp_board is None:
-            temp_board = self.board
-        self.board = deepcopy(temp_board)
-        in_check = []
-        in_check.append(self.find_horizontal_moves(
-            color, piece_x, piece_y, True))
-        in_check.append(self.find_vertical_moves(
-            color, piece_x, piece_y, True))
-        in_check.append(self.find_diagonal_moves(
-            color, piece_x, piece_y, True))
-        in_check.append(self.find_knight_moves(color, piece_x, piece_y, True))
-        in_check.append(self.find_adj_moves(color, piece_x, piece_y, True))
-        in_check.append(self.find_pawn_moves(color, piece_x, piece_y, True))
-        self.board = original_board
-        return True if True in in_check else False
-
-    def get_valid_moves(self, curr_pos: str) -> list:
-        """
-        Returns a list of all valid moves the piece can make. (In list index format)
-        """
-        piece_x, piece_y = self.coords_to_index(curr_pos)
-        piece = self.board[piece_y][piece_x]
-        color = piece[0]
-        valid_moves = []
-
-        if piece[0] not in ("W", "B"):
-            raise InvalidMove
-        
-        if color != self.turn: # No valid moves if it isn't user's turn
-            return []
-
-        # Check for valid pawn movement
-        if piece[-1] == "P":  # "P" in "WP"
-            valid_moves += self.find_pawn_moves(piece[0], piece_x, piece_y)
-
-        # Check for rook movement
-        if piece[-1] == "R":
-            valid_moves += self.find_horizontal_moves(
-                piece[0], piece_x, piece_y)
-            valid_moves += self.find_vertical_moves(piece[0], piece_x, piece_y)
-
-        # Check for knight movement
-        if piece[-1] == "N":
-            valid_moves += self.find_knight_moves(piece[0], piece_x, piece_y)
-
-        # Check for bishop movement
-        if piece[-1] == "B":
-            valid_moves += self.find_diagonal_moves(piece[0], piece_x, piece_y)
-
-        if piece[-1] == "Q":
-            valid_moves += self.find_horizontal_moves(
-                piece[0], piece_x, piece_y)
-            valid_moves += self.find_vertical_moves(piece[0], piece_x, piece_y)
-            valid_moves += self.find_diagonal_moves(piece[0], piece_x, piece_y)
-
-        if piece[-1] == "K":
-            valid_moves += self.find_adj_moves(piece[0], piece_x, piece_y)
-            # Check if player is allowed to castle
-            """
-            Castle status is defined as such:
-            self.castle_status = {
-            "W": [O-O: bool, O-O-O: bool],
-            "B": ...
-            }
-            """
-            if not self.is_in_check(color, piece_x, piece_y):  # king cannot castle if in check!
-                castling = self.castle_status[color]
-                num = 7 if color == "W" else 0  # row coord
-                # King's side castling (O-O)
-                if not self.is_in_check(color, 5, num) and castling[0] and all(self.board[num][i] == "  " for i in range(5, 7)) and self.board[num][7] == f"{color}R":
-                    valid_moves.append(f"6{num} O-O")
-                # Queen's side castling (O-O-O)
-                if not self.is_in_check(color, 3, num) and castling[1] and all(self.board[num][i] == "  " for i in range(1, 4)) and self.board[num][0] == f"{color}R":
-                    valid_moves.append(f"2{num} O-O-O")
-
-        # Check if king is in check.
-        for move in valid_moves.copy():
-            x, y = int(move[0]), int(move[1])
-            temp_board = deepcopy(self.board)
-            temp_board[piece_y][piece_x] = "  "
-            temp_board[y][x] = piece
-            king_pos = self.coords_to_index(
-                self.get_king_coords(piece[0], temp_board))
-            if self.is_in_check(piece[0], king_pos[0], king_pos[1], temp_board):
-                valid_moves.remove(move)
-
-        print("Valid Moves:", [self.index_to_coords(i) for i in valid_moves])
-        return valid_moves
-
-    def select_piece(self, button):
-        """
-        Called when a user selects a piece to promote their pawn to.
-        """
-        self.pawn_promotion_view.dismiss()
-        self.pawn_promoted_to = list(self.pieces)[list(
-            self.pieces.values()).index(button.text)]
-        self.wait_for_promotion.set()
-
-    def prompt_for_promotion(
-            self,
-            color: Literal["W", "B"]
-        ) -> Literal["Q", "R", "B", "N"] | None:
-        """
-        Open a ModalView to prompt for pawn promotion piece choice
-        """
-        print("Prompting for pawn promotion!")
-        if not self.pawn_promotion_view:
-            box = GridLayout(rows=4, cols=1)
-            box.add_widget(MDFlatButton(
-                text=self.pieces["WQ"], on_release=self.select_piece))
-            box.add_widget(MDFlatButton(
-                text=self.pieces["WR"], on_release=self.select_piece))
-            box.add_widget(MDFlatButton(
-                text=self.pieces["WB"], on_release=self.select_piece))
-            box.add_widget(MDFlatButton(
-                text=self.pieces["WN"], on_release=self.select_piece))
-            self.pawn_promotion_view = ModalView(
-                size_hint=(None, None),
-                size=(75, 310),
-                background_color=(255, 255, 255, 1),
-                overlay_color=(0, 0, 0, 0.4),
-                padding=5
-            )
-            self.pawn_promotion_view.add_widget(box)
-        self.pawn_promotion_view.open()
-
-    async def move(self, curr_pos: str, new_pos: str) -> None:
-        """
-        This function helps move a piece on the board
-
-        curr_pos: the current position of the piece
-        new_pos: the new position of the piece
-        """
-        self.pawn_promotion = False
-        # Get the piece type based on curr_pos (WR, WN, BP, etc)
-        # Get x and y pos of pieces
-        piece_x, piece_y = self.coords_to_index(curr_pos)
-        new_x, new_y = self.coords_to_index(new_pos)
-        # Reset warning
-        self.warning = ""
-
-        piece_type = self.board[piece_y][piece_x]
-        color = piece_type[0]
-
-        valid_moves = self.get_valid_moves(curr_pos)
-        castling_moves = [i[:2] for i in valid_moves if len(i) > 2]
-
-        # Get ready to move piece
-        pos = self.coords_to_index(new_pos, to_return="str")
-        if pos in [i[:2] for i in valid_moves]:
-            # If rook/king moves, make castling illegal
-            if piece_type[1] == "R":
-                num = "1" if color == "W" else "8"
-                # O-O-O
-                if self.board[8-int(num)][self.coords_to_index(f"a{num}")[0]] == "  ":
-                    self.castle_status[color][1] = False
-                # O-O
-                if self.board[8-int(num)][self.coords_to_index(f"h{num}")[0]] == "  ":
-                    self.castle_status[color][0] = False
-            if piece_type[1] == "K":
-                self.castle_status[piece_type[0]] = [False, False]
-            # Check for pawn promotion
-            num = 0 if color == "W" else 7
-            print(num, new_y)
-            if piece_type[1] == "P" and new_y == num:
-                self.pawn_promotion = True
-
-            self.args_to_pass = piece_x, piece_y, new_x, new_y, piece_type, pos, castling_moves, color
-            if self.pawn_promotion:
-                self.pawn_promoted_to = None
-                self.wait_for_promotion = trio.Event()
-                self.prompt_for_promotion(color)
-                await self.wait_for_promotion.wait()
-
-            # Check pawn promotion
-            if self.pawn_promoted_to is not None:
-                piece_type, self.pawn_promoted_to = self.pawn_promoted_to, None
-
-            # Move piece
-            self.board[piece_y][piece_x] = "  "
-            self.board[new_y][new_x] = piece_type
-            # Check if move is a castling move
-            if pos in castling_moves:
-                self.board[new_y][new_x+1 if pos[0]
-                                  < "4" else new_x-1] = f"{color}R"
-                self.board[new_y][0 if pos[0] < "4" else 7] = "  "
-                # mark castling as illegal now
-                self.castle_status[color] = [False, False]
-
-            # Check if opponent has ANY valid moves
-            color = "W" if color == "B" else "B" # swap colors for check
-
-            # Swap turn before checking for mate is because 
-            # self.turn returns [] in get_valid_moves if it is not the user's turn
-            self.turn = "W" if self.turn == "B" else "B" 
-
-            has_valid_moves = False
-            king_pos = self.coords_to_index(self.get_king_coords(color))
-
-            # Check for either a checkmate or stalemate
-            for y, row in enumerate(self.board):
-                for x, col in enumerate(row):
-                    if col[0] == color and self.get_valid_moves(self.index_to_coords(f"{x}{y}")) != []:
-                        has_valid_moves = True
-                        break
-            if not has_valid_moves:
-                winner = "White" if color == "B" else "Black"
-                if self.is_in_check(color, king_pos[0], king_pos[1]):
-                    status = "checkmate"
-                else:
-                    status = "stalemate"
-                return winner, status
-                
-            return True
+from Engine import profiling
+from Engine.cache import MoveCache
+from Engine.game import Game
+from Engine.moves import CAPTURE, move_name, promotion, square_name
+from Engine.polyglot import OpeningBook
+from Engine.search import MATE, MATE_BOUND
+from Engine.tablebase import Tablebases, WIN, LOSS
+from Engine.worker import EngineProcess
+from Errors.errors import EngineCrashed, InvalidMove
 
 
 """
 Game GUI code below!
 """
 
+log = logging.getLogger(__name__)
+
 
 def resource_path(relative_path):
     """
@@ -573,20 +88,109 @@ class WelcomeWindow(Screen):
     pass
 
 
+BOOK_PATH = resource_path("Assets/book.bin")  # optional Polyglot opening book
+TABLEBASE_PATH = resource_path("Tablebases")  # optional endgame tables, see Engine.tablebase
+
+
+def new_game() -> Game:
+    return Game(backend="bitboard", move_cache=MoveCache(max_entries=2048))
+
+
 class GameWindow(Screen):
     def on_enter(self):
-        game = Game()
-        chessgame = Chessboard(game)
+        game = new_game()
+        chessgame = Chessboard(game, engine_color=inst.engine_color, render="canvas")
         self.add_widget(chessgame)
 
 
+def capture_ring_texture(size: int = 64) -> Texture:
+    """
+    A grey square with a transparent circle in the center, shown on
+    squares where the selected piece can capture
+    """
+    pixels = bytearray(size * size * 4)
+    center, radius = (size - 1) / 2, size / 2
+    for y in range(size):
+        for x in range(size):
+            if (x - center) ** 2 + (y - center) ** 2 > radius ** 2:
+                i = (y * size + x) * 4
+                pixels[i:i + 4] = b"\x80\x80\x80\xa0"
+    texture = Texture.create(size=(size, size), colorfmt="rgba")
+    texture.blit_buffer(bytes(pixels), colorfmt="rgba", bufferfmt="ubyte")
+    return texture
+
+
+class GlyphAtlas:
+    """
+    Renders every piece glyph once into a single texture. Pieces are then
+    drawn as Rectangles showing a region of it, so no text is laid out or
+    rasterized while playing.
+    """
+
+    def __init__(self, glyphs: dict, cell: int, font_size: float):
+        """
+        glyphs: {piece name: character}
+        cell: size in pixels of the square region each glyph gets
+        """
+        self.cell = cell
+        self.fbo = Fbo(size=(cell * len(glyphs), cell))  # owns the texture
+        with self.fbo:
+            ClearColor(0, 0, 0, 0)
+            ClearBuffers()
+            Color(1, 1, 1, 1)
+            for i, glyph in enumerate(glyphs.values()):
+                label = CoreLabel(
+                    text=glyph, font_name="DejaVuSans", font_size=font_size, color=(0, 0, 0, 1))
+                label.refresh()
+                texture = label.texture
+                Rectangle(
+                    texture=texture,
+                    size=texture.size,
+                    pos=(i*cell + (cell - texture.width)//2, (cell - texture.height)//2)
+                )
+        self.fbo.draw()
+        self.texture = self.fbo.texture
+        self.regions = {
+            name: self.texture.get_region(i*cell, 0, cell, cell)
+            for i, name in enumerate(glyphs)
+        }
+
+
 class Chessboard(Widget):
-    def __init__(self, game, **kwargs):
+    def __init__(
+            self,
+            game,
+            engine_color: Literal["W", "B"] | None = None,
+            render: Literal["widgets", "canvas"] = "widgets",
+            **kwargs
+        ):
+        """
+        engine_color: the side the computer plays, None for two players
+        render: "widgets" makes a Button per square, "canvas" draws the
+        pieces from a GlyphAtlas straight onto the canvas and works out the
+        clicked square from the touch position
+        """
         super().__init__(**kwargs)
         self.game = game
+        self.render = render
+        self.game.promotion_callback = self.prompt_for_promotion
         self.board = game.board
-        self.selected = ""
+        self.book = OpeningBook(BOOK_PATH) if os.path.exists(BOOK_PATH) else None
+        self.tablebases = Tablebases(TABLEBASE_PATH) if os.path.isdir(TABLEBASE_PATH) else None
+        self.engine = EngineProcess(
+            book=BOOK_PATH if self.book else None,
+            tablebases=TABLEBASE_PATH if self.tablebases else None
+        )
+        self.engine_color = engine_color
+        self.engine_movetime = 3  # seconds per move
+        self.engine_scope = None  # trio.CancelScope of the running search
+        self.winner_popup = None
+        self.analysis_label = Label(text="", halign="left", color=(1, 1, 1, 1))
+        self.add_widget(self.analysis_label)
+        self.selected = None
         self.pawn_promotion_view = None
+        self.wait_for_promotion = trio.Event()
+        self.pawn_promoted_to = None
         self.piece_map = {
             "WK": "\u2654",
             "WQ": "\u2655",
@@ -603,18 +207,194 @@ class Chessboard(Widget):
             "  ": "  "
         }
         self.valid_moves = []
-        self.pieces = deepcopy(self.board)
+        # Move hints are drawn on their own layer above the squares. The
+        # textures are loaded once and each square's Rectangle is reused
+        self.hint_layer = None
+        self.hint_textures = None
+        self.hint_rects = [[None] * 8 for _ in range(8)]
+        self.hints = {}  # (x, y): "move" or "capture"
+        self.pieces = deepcopy(self.board)  # Buttons, or Rectangles when rendering to the canvas
+        self.atlas = None
+        self.square_size = 0
+        self.origin = (0, 0)  # bottom left corner of the board
         self.squares = deepcopy(self.board)  # to store pos of board squares
         self.coords = {
             "y": [i for i in range(1, 9)],  # [1, 2, ...]
             "x": [chr(i) for i in range(97, 105)]  # ["a", "b", ...]
         }
 
+    def select_piece(self, button):
+        """
+        Called when a user selects a piece to promote their pawn to.
+        """
+        self.pawn_promotion_view.dismiss()
+        self.pawn_promoted_to = list(self.piece_map)[list(
+            self.piece_map.values()).index(button.text)][1]
+        self.wait_for_promotion.set()
+
+    async def prompt_for_promotion(
+            self,
+            color: Literal["W", "B"]
+        ) -> Literal["Q", "R", "B", "N"]:
+        """
+        Open a ModalView to prompt for pawn promotion piece choice
+        """
+        log.debug("Prompting for pawn promotion")
+        if not self.pawn_promotion_view:
+            box = GridLayout(rows=4, cols=1)
+            box.add_widget(MDFlatButton(
+                text=self.piece_map["WQ"], on_release=self.select_piece))
+            box.add_widget(MDFlatButton(
+                text=self.piece_map["WR"], on_release=self.select_piece))
+            box.add_widget(MDFlatButton(
+                text=self.piece_map["WB"], on_release=self.select_piece))
+            box.add_widget(MDFlatButton(
+                text=self.piece_map["WN"], on_release=self.select_piece))
+            self.pawn_promotion_view = ModalView(
+                size_hint=(None, None),
+                size=(75, 310),
+                background_color=(255, 255, 255, 1),
+                overlay_color=(0, 0, 0, 0.4),
+                padding=5
+            )
+            self.pawn_promotion_view.add_widget(box)
+        self.pawn_promoted_to = None
+        self.wait_for_promotion = trio.Event()
+        self.pawn_promotion_view.open()
+        await self.wait_for_promotion.wait()
+        return self.pawn_promoted_to
+
     def start_new_game(self, *args):
         """
         This starts a new game when a game ends.
         """
-        print("This feature is under development")
+        self.cancel_engine()
+        if self.winner_popup is not None:
+            self.winner_popup.dismiss()
+            self.winner_popup = None
+        self.game = new_game()
+        self.game.promotion_callback = self.prompt_for_promotion
+        self.board = self.game.board
+        self.selected = None
+        self.valid_moves = []
+        self.analysis_label.text = ""
+        self.engine_color = inst.engine_color  # back from two players if the computer had stopped
+        self.update_squares([(x, y) for y in range(8) for x in range(8)])
+        self.show_move_indicators()
+        self.show_hints()
+        if self.engine_color == self.game.turn:
+            inst.nursery.start_soon(self.engine_move)
+
+    def cancel_engine(self):
+        """
+        Stops the computer's search, if it is thinking
+        """
+        if self.engine_scope is not None:
+            self.engine_scope.cancel()
+            self.engine_scope = None
+
+    def show_analysis(self, result):
+        """
+        Shows the progress of the computer's search after each iteration
+        """
+        if abs(result.score) > MATE_BOUND:
+            score = f"mate in {(MATE - abs(result.score) + 1) // 2}"
+        else:
+            score = f"{result.score / 100:+.2f}"
+        pv = " ".join(move_name(move) for move in result.pv[:6])
+        self.analysis_label.text = f"depth {result.depth}  {score}  {result.nps} nps\n{pv}"
+
+    def show_hints(self):
+        """
+        Suggests the opening book's moves, or shows the tablebase result,
+        when it is the user's turn
+        """
+        if self.engine_color == self.game.turn:
+            return
+        if self.book is not None:
+            moves = self.book.moves(self.game)
+            if moves:
+                self.analysis_label.text = "book: " + " ".join(move_name(move) for move, _ in moves[:6])
+                return
+        if self.tablebases is not None:
+            found = self.tablebases.best_move(self.game)
+            if found is not None:
+                move, (outcome, plies) = found
+                result = {
+                    WIN: f"mate in {(plies + 1) // 2}", LOSS: f"mated in {plies // 2}"
+                }.get(outcome, "draw")
+                self.analysis_label.text = f"tablebase: {result}, best {move_name(move)}"
+
+    async def engine_move(self):
+        """
+        Lets the computer pick and play a move. The search runs in a worker
+        process so the board keeps rendering at full speed; it is cancelled
+        by cancel_engine when a new game starts. If the worker process dies
+        the user is left to play both sides until the next game.
+        """
+        with trio.CancelScope() as scope:
+            self.engine_scope = scope
+            try:
+                result = await self.engine.search(
+                    self.game.to_fen(),
+                    movetime=self.engine_movetime,
+                    info_callback=self.show_analysis,
+                    repetitions=self.game.repetitions
+                )
+            except EngineCrashed:
+                log.exception("The computer's search failed")
+                self.engine_scope = None
+                self.engine_color = None  # unlocks the board
+                self.analysis_label.text = "The computer stopped working, play its moves or start a new game"
+                return
+        if scope.cancel_called or result.move is None:
+            return
+        self.engine_scope = None
+
+        move = result.move
+        movement = await self.game.move(move & 63, move >> 6 & 63, promotion(move))
+        profiling.log_summary(f"engine move {move_name(result.move)}")
+        self.update_squares(self.game.last_move_squares())
+        if isinstance(movement, tuple):
+            self.show_result(*movement)
+        else:
+            self.show_hints()
+
+    def show_result(self, winner, status):
+        """
+        Opens the game over popup
+        """
+        content = BoxLayout(orientation="vertical")
+        new_game = MDRaisedButton(
+            text="New Game", 
+            pos_hint={"center_x": 0.5}, 
+            size_hint=(1, 1)
+            )
+        
+        if status == "checkmate":
+            title = f"{winner} Wins"
+            msg = Label(text=f"{winner} won by checkmate!")
+
+        elif status == "stalemate":
+            title = "Stalemate"
+            msg = Label(text="Draw by stalemate!")
+
+        else:
+            title = "Draw"
+            msg = Label(text=f"Draw by {status}!")
+        
+        content.add_widget(msg)
+        content.add_widget(new_game)
+        self.winner_popup = Popup(
+            title=title,
+            title_align="center",
+            title_size=Window.size[0]*0.05,
+            content=content,
+            size_hint=(0.7, 0.5),
+            auto_dismiss=False
+        )
+        new_game.bind(on_press=self.start_new_game)
+        self.winner_popup.open()
 
     def draw_board(self, size, pos):
         """
@@ -689,7 +469,8 @@ class Chessboard(Widget):
 
     def draw_pieces(self, size, pos):
         """
-        todo: add the ability to remove/add a single chess piece
+        This function lays out a button for every square.
+        Pieces changed by a move are updated with update_squares instead.
         """
         with self.canvas:
             for y, row in enumerate(self.board):
@@ -712,7 +493,7 @@ class Chessboard(Widget):
                             color=(0, 0, 0, 1),
                             background_color=(0, 0, 0, 0)
                         )
-                        button.bind(on_release=self.click)
+                        button.bind(on_release=partial(self.click, x, y))
                         self.pieces[y][x] = button
                         self.add_widget(button)
                     else:
@@ -724,12 +505,55 @@ class Chessboard(Widget):
                         )
                         self.pieces[y][x].text, self.pieces[y][x].font_size, self.pieces[y][x].pos, self.pieces[y][x].size = values
 
+    def draw_piece_rects(self, size, pos):
+        """
+        draw_pieces for the "canvas" render mode: one Rectangle per square
+        showing the piece's region of the glyph atlas
+        """
+        font_size = min(size[0]/1.5, 60)
+        if self.atlas is None or self.atlas.cell != int(size[0]):
+            self.atlas = GlyphAtlas(self.piece_map, int(size[0]), font_size)
+        if isinstance(self.pieces[0][0], str):
+            with self.canvas.after:
+                Color(1, 1, 1, 1)
+                self.pieces = [[Rectangle() for x in range(8)] for y in range(8)]
+        for y, row in enumerate(self.board):
+            for x, piece in enumerate(row):
+                rect = self.pieces[y][x]
+                rect.pos = (
+                    x*pos + self.width//2 - size[0]*4,
+                    (7-y)*pos + self.height//2 - size[1]*4
+                )
+                self.set_piece_texture(rect, piece)
+
+    def set_piece_texture(self, rect, piece):
+        if piece == "  ":
+            rect.size = (0, 0)
+        else:
+            rect.texture = self.atlas.regions[piece]
+            rect.size = (self.square_size, self.square_size)
+
+    def update_squares(self, squares):
+        """
+        Redraws the pieces on the given (x, y) squares only. Used after
+        moves, where a full layout (on_size) would redo all 64 squares.
+        """
+        board = self.game.board
+        self.board = board
+        for x, y in squares:
+            widget = self.pieces[y][x]
+            if isinstance(widget, str):
+                continue  # not laid out yet
+            if self.render == "canvas":
+                self.set_piece_texture(widget, board[y][x])
+            elif widget.text != self.piece_map[board[y][x]]:
+                widget.text = self.piece_map[board[y][x]]
+
     def on_size(self, *args):
         """
-        Whenever the screen size is changed or the board needs updating,
-        this function gets called.
+        Whenever the screen size is changed, this function gets called.
 
-        Handles screen updates
+        Lays out the whole board
         """
         if args != ():
             screen_size = min(args[1])
@@ -738,98 +562,135 @@ class Chessboard(Widget):
         size = (screen_size * 0.125, screen_size * 0.125)
         pos_mult = screen_size/8
         self.board = self.game.board
+        self.square_size = size[0]
+        self.origin = (self.width//2 - size[0]*4, self.height//2 - size[1]*4)
         self.draw_board(size, pos_mult)
-        self.draw_pieces(size, pos_mult)
+        self.layout_hints()
+        if self.render == "canvas":
+            self.draw_piece_rects(size, pos_mult)
+        else:
+            self.draw_pieces(size, pos_mult)
+        self.analysis_label.pos = (self.width//2 - size[0]*4, self.height//2 + size[1]*4)
+        self.analysis_label.size = (size[0]*8, size[1]/2)
+        self.analysis_label.text_size = self.analysis_label.size
 
-    def click(self, btn: str):
+    def on_touch_down(self, touch):
         """
-        This event gets called when piece is selected.
+        In the "canvas" render mode the square under the touch is worked
+        out from its position, as there are no buttons to receive it
+        """
+        if super().on_touch_down(touch):
+            return True
+        if self.render != "canvas" or not self.square_size:
+            return False
+        x = int((touch.x - self.origin[0]) // self.square_size)
+        row = int((touch.y - self.origin[1]) // self.square_size)
+        if 0 <= x < 8 and 0 <= row < 8:
+            self.click(x, 7 - row)
+            return True
+        return False
+
+    def click(self, x: int, y: int, *args):
+        """
+        This event gets called when square (x, y) of the board is selected.
         This will start a trio task to enable async behaviour!
         """
-        inst.nursery.start_soon(self.async_click, btn)
+        inst.nursery.start_soon(self.async_click, x, y)
 
-    async def async_click(self, btn: str):
+    async def async_click(self, x: int, y: int):
         """
         Handles piece selection
         """
-        index = None
-        for y, row in enumerate(self.pieces):
-            for x, col in enumerate(row):
-                if col == btn:
-                    index = f"{x}{y}"
-                    break
-            if index is not None:
-                break
-        square = self.game.index_to_coords(index)
-        valid_moves = []
-        if btn.text != "  ":
-            valid_moves = self.game.get_valid_moves(square)
-            valid_moves = [self.game.index_to_coords(
-                ind) for ind in valid_moves]
-
-        if btn.text != "  " and square not in self.valid_moves:
+        if self.engine_color == self.game.turn:
+            return  # the computer is thinking
+        if self.game.outcome() is not None:
+            return  # the game is over, only "New Game" is left
+        square = y * 8 + x
+        empty = self.game.board[y][x] == "  "
+        targets = [move >> 6 & 63 for move in self.valid_moves]
+        if not empty and square not in targets:
             self.selected = square
-            self.valid_moves = valid_moves
+            self.valid_moves = self.game.get_valid_moves(square)
 
-        elif btn.text == "  " and self.selected == "":
+        elif empty and self.selected is None:
             pass
 
         else:
-            if square in self.valid_moves:
+            if square in targets:
                 try:
                     # returns color if there is a winner
                     movement = await self.game.move(self.selected, square)
-                    print("movement:", movement)
+                    name = square_name(self.selected) + square_name(square)
+                    log.debug("Move %s: %s", name, movement)
+                    profiling.log_summary(f"move {name}")
+                    self.update_squares(self.game.last_move_squares())
                     if isinstance(movement, tuple):
-                        winner, status = movement # note: if stalemate, winner var is not used
-                        content = BoxLayout(orientation="vertical")
-                        new_game = MDRaisedButton(
-                            text="New Game", 
-                            pos_hint={"center_x": 0.5}, 
-                            size_hint=(1, 1)
-                            )
-                        
-                        if status == "checkmate":
-                            title = f"{winner} Wins"
-                            msg = Label(text=f"{winner} won by checkmate!")
-
-                        elif status == "stalemate":
-                            title = "Stalemate"
-                            msg = Label(text="Draw by stalemate!")
-                        
-                        content.add_widget(msg)
-                        content.add_widget(new_game)
-                        winner_popup = Popup(
-                            title=title,
-                            title_align="center",
-                            title_size=Window.size[0]*0.05,
-                            content=content,
-                            size_hint=(0.7, 0.5)
-                        )
-                        new_game.bind(on_press=self.start_new_game)
-                        winner_popup.open()
+                        self.show_result(*movement) # note: on a draw, winner var is not used
+                    elif self.engine_color == self.game.turn:
+                        inst.nursery.start_soon(self.engine_move)
+                    else:
+                        self.show_hints()
 
                 except InvalidMove:
                     pass
-                self.on_size()
 
-            self.selected = ""
+            self.selected = None
             self.valid_moves = []
 
-        valids = [self.game.coords_to_index(i) for i in self.valid_moves]
-        for y, row in enumerate(self.squares):
-            for x, col in enumerate(row):
-                if [x, y] in valids:
-                    self.squares[7-y][x].source = resource_path(
-                        f"Assets/move_indicator.jpg")
-                else:
-                    self.squares[7-y][x].source = None
+        self.show_move_indicators()
+
+    def layout_hints(self):
+        """
+        Creates the move hint layer on the first layout (just above the
+        squares, below the coordinates and pieces), and moves the visible
+        hints after a resize
+        """
+        if self.hint_layer is None:
+            self.hint_textures = {
+                "move": CoreImage(resource_path("Assets/move_indicator.jpg")).texture,
+                "capture": capture_ring_texture(),
+            }
+            self.hint_layer = InstructionGroup()
+            self.hint_layer.add(Color(1, 1, 1, 1))
+            self.canvas.insert(self.canvas.indexof(self.squares[7][7]) + 1, self.hint_layer)
+        for (x, y), kind in self.hints.items():
+            self.place_hint(x, y, kind)
+
+    def place_hint(self, x, y, kind):
+        rect = self.hint_rects[y][x]
+        if rect is None:
+            rect = self.hint_rects[y][x] = Rectangle()
+            self.hint_layer.add(rect)
+        rect.texture = self.hint_textures[kind]
+        rect.pos = (
+            self.origin[0] + x*self.square_size,
+            self.origin[1] + (7-y)*self.square_size
+        )
+        rect.size = (self.square_size, self.square_size)
+
+    def show_move_indicators(self):
+        """
+        Marks the squares the selected piece can move to, with a ring on
+        captures. Only squares entering or leaving the hint set (or
+        changing kind) are touched
+        """
+        hints = {}
+        for move in self.valid_moves:
+            to_sq = move >> 6 & 63
+            hints[to_sq % 8, to_sq // 8] = "capture" if move & CAPTURE else "move"
+        for (x, y), kind in hints.items():
+            if self.hints.get((x, y)) != kind:
+                self.place_hint(x, y, kind)
+        for x, y in self.hints.keys() - hints.keys():
+            self.hint_rects[y][x].size = (0, 0)
+        self.hints = hints
 
 
 class ChessApp(MDApp):
     def __init__(self, nursery):
         super().__init__()
         self.nursery = nursery
+        self.engine_color = None  # chosen on the welcome screen, None for two players
 
     def build(self):
         self.use_kivy_settings = False  # to be used in the future!
@@ -849,13 +710,13 @@ async def main():
         nursery.cancel_scope.cancel()
 
 if __name__ == '__main__':
+    logging.basicConfig(level=os.environ.get("CHESS_LOG", "WARNING").upper())
+    profiling.enable_from_environment()
     trio.run(main)
 
 """
 To-Do:
-- En Passant
 - Make move indicator smaller
-- If piece can be taken, change move indicator shape to a grey square with transparent circle in the center
 - Make pawn promotion GUI dynamically sized
 - Create a server to get latest game news and updates using a RESTAPI
 
@@ -0,0 +1,86 @@
+"""
+Chess!
+Copyright (C) 2023  kitkat3141
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import json
+
+import trio
+
+from Engine.server import GameServer
+
+
+"""
+Game server tests
+
+Run from the project root with `python -m pytest tests`
+"""
+
+
+class CrashingServer(GameServer):
+    """
+    A server with a bug: the "crash" op raises an unexpected error
+    """
+
+    def handle(self, request: dict) -> dict:
+        if request.get("op") == "crash":
+            self.get_game(request)
+            raise KeyError("crash")
+        return super().handle(request)
+
+
+class Client:
+    def __init__(self, stream: trio.SocketStream):
+        self.stream = stream
+        self.buffer = b""
+
+    async def send(self, line: bytes) -> dict:
+        await self.stream.send_all(line + b"\n")
+        while b"\n" not in self.buffer:
+            data = await self.stream.receive_some(65536)
+            assert data, "the server closed the connection"
+            self.buffer += data
+        response, self.buffer = self.buffer.split(b"\n", 1)
+        return json.loads(response)
+
+
+def test_bad_requests_do_not_stop_the_server():
+    async def main():
+        server = CrashingServer()
+        async with trio.open_nursery() as nursery:
+            listeners = await nursery.start(server.serve, 0)
+            port = listeners[0].socket.getsockname()[1]
+            first = Client(await trio.open_tcp_stream("127.0.0.1", port))
+            second = Client(await trio.open_tcp_stream("127.0.0.1", port))
+
+            assert "error" in await first.send(b"not json")
+            assert "error" in await first.send(b"[1, 2]")
+            assert "error" in await first.send(b'{"id": 1, "op": "new", "fen": "8/8/8 w - - 0 1"}')
+            assert "error" in await first.send(b'{"id": 2, "op": "moves", "game": [1]}')
+            game = (await first.send(b'{"id": 3, "op": "new"}'))["game"]
+            other = (await second.send(b'{"id": 1, "op": "new"}'))["game"]
+
+            response = await first.send(json.dumps({"id": 4, "op": "crash", "game": game}).encode())
+            assert response == {"id": 4, "error": "internal error"}
+            # Only the game that hit the bug is closed
+            assert game not in server.games
+            response = await first.send(json.dumps({"id": 5, "op": "moves", "game": other}).encode())
+            assert len(response["moves"]) == 20
+            response = await second.send(json.dumps({"id": 2, "op": "move", "game": other, "move": "e2e4"}).encode())
+            assert response["status"] == "ongoing"
+            nursery.cancel_scope.cancel()
+
+    trio.run(main)